@@ -3,11 +3,18 @@
 
 import os
 import sys
+import time
 import argparse
-import subprocess
+from collections import OrderedDict
+from typing import List, Tuple
 
-from buildscripts.builder import Builder
+from buildscripts.builder import Builder, MatrixBuilder
 from buildscripts.archiver import Archiver
+from buildscripts.version_generator import VersionInfo
+from buildscripts.ziputil import COMPRESSION_METHODS, check_compression
+from buildscripts.telemetry import get_telemetry
+from buildscripts import benchmark
+from buildscripts import pgo
 
 """
 Build entry
@@ -33,17 +40,18 @@ def __get_cpu_list_and_build_lang(args):
     elif args.target_os == 'win':
         cpu_list = args.win_cpu
         lang = args.win_lang
+    elif args.target_os == 'linux':
+        cpu_list = args.linux_cpu
+        lang = args.linux_lang
     else:
         raise Exception('Unknown Target OS: {}.'.format(args.target_os))
     return (cpu_list, lang)
 
-def __gen_gbe_version() -> str:
-    cmd = [
-        sys.executable,
-        os.path.join(PROJ_ROOT, 'buildscripts', 'version_generator.py'),
-        'fullver'
-    ]
-    return subprocess.check_output(cmd).decode('utf8').strip()
+def __gen_gbe_version(reproducible: bool) -> str:
+    version_info = VersionInfo(PROJ_ROOT)
+    if reproducible:
+        return version_info.get_reproducible_version()
+    return version_info.get_full_version()
 
 def __parse_args(args):
     args = args[1:]
@@ -52,65 +60,283 @@ def __parse_args(args):
     parser.add_argument('--build-type', type=str, choices=['debug', 'release'], default='release')
     parser.add_argument('--debug', dest='build_type', action='store_const', const='debug')
 
-    parser.add_argument('--target-os', type=str, choices=['android', 'ios', 'mac', 'win'])
+    parser.add_argument('--target-os', type=str, nargs='+', action='extend', choices=['android', 'ios', 'mac', 'win', 'linux'], help='Several target OS can be built in one call with `--matrix`.')
     parser.add_argument('--only-gen', default=False, action='store_true', help='Whether to generate only GN build files without actually compiling with ninja.')
 
-    parser.add_argument('--lib-type', type=str, choices=['shared', 'static'], default='shared', help='Build shared or static lib')
+    parser.add_argument('--gn-check', default=False, action='store_true', help='Run `gn gen --check` to validate header includes (slow, meant for CI).')
+    parser.add_argument('--force-gen', default=False, action='store_true', help='Always run `gn gen`, even if the GN args and files are unchanged.')
+
+    parser.add_argument('--lib-type', type=str, nargs='+', action='extend', choices=['shared', 'static'], default=None, help='Build shared or static lib (default: shared), both can be built in one call with `--matrix`.')
+
+    parser.add_argument('--matrix', default=False, action='store_true',
+                        help='Build all given target OS/lib types/langs/archs, with one out dir per target OS and lang where each arch is built by its own toolchain, so one ninja schedules all of them.')
+
+    parser.add_argument('--parallel-archs', type=int, default=1, metavar='N', help='Build up to N archs at the same time, the ninja jobs are split across them.')
+
+    parser.add_argument('--compiler-cache', type=str, nargs='?', const=os.path.join(PROJ_ROOT, '_out', '.compiler_cache'), default=None, metavar='DIR',
+                        help='Route compiles through a caching compiler wrapper, objects of unchanged sources and flags are reused from this dir (default: ./_out/.compiler_cache).')
+
+    parser.add_argument('--artifact-cache', type=str, nargs='?', const=os.path.join(PROJ_ROOT, '_out', '.artifact_cache'), default=None, metavar='DIR',
+                        help='Restore the outputs of arch builds whose sources, GN args and buildtools are unchanged from this cache dir instead of building (default: ./_out/.artifact_cache).')
+    parser.add_argument('--artifact-cache-size', type=int, default=4096, metavar='MB', help='Max size of the artifact cache, least recently used entries are evicted.')
+
+    parser.add_argument('--affected', default=False, action='store_true',
+                        help='Only build the out dirs affected by the source changes since their last build (from `gn refs` and the ninja deps log), the outputs and archives of the others are reused. Combine with `--reproducible-version`, otherwise the build date of the version affects every out dir.')
+
+    parser.add_argument('--reproducible-version', default=False, action='store_true', help='Use the commit date instead of the build date in the version, so a rebuild without changes is a no-op. The build date goes into the archived `build_info.json`.')
+
+    parser.add_argument('--zip-method', type=str, choices=COMPRESSION_METHODS, default='deflate', help='Compression method of the products/symbols zip, `zstd` requires the `zstandard` package.')
+    parser.add_argument('--zip-level', type=int, default=None, help='Compression level of the products/symbols zip, defaults to the method\'s default. deflate: -1..9, bzip2: 1..9, lzma (preset): 0..9, zstd: 1..22.')
+
+    parser.add_argument('--zip-cache', type=str, nargs='?', const=os.path.join(PROJ_ROOT, '_out', '.zip_cache'), default=None, metavar='DIR',
+                        help='Reuse the compressed zip entries of unchanged files from this cache dir (default: ./_out/.zip_cache), and skip zips whose inputs are unchanged. Only `build_info.json` of `--reproducible-version` is rewritten in a skipped products zip.')
+    parser.add_argument('--zip-cache-size', type=int, default=2048, metavar='MB', help='Max size of the zip cache, least recently used entries are evicted.')
+
+    parser.add_argument('--archive-staging', default=False, action='store_true', help='Also copy the archived files into the products dir like the zip layout (for debugging).')
+
+    parser.add_argument('--timing-report', type=str, default=None, metavar='PATH', help='Write the timing of each build phase and the slowest ninja edges into a JSON file.')
+
+    parser.add_argument('--bench', default=False, action='store_true', help='Build and run the native benchmark for the archs which can run on this host.')
+    parser.add_argument('--bench-output', type=str, default=None, metavar='DIR', help='Dir of the benchmark JSON results, defaults to the out dir of each arch.')
+    parser.add_argument('--bench-max-size', type=int, default=None, metavar='BYTES', help='Largest benchmark input size (default: 256 MB).')
+    parser.add_argument('--bench-min-time', type=float, default=None, metavar='SECONDS', help='Min run time of each benchmark case (default: 0.2).')
+
+    parser.add_argument('--binsize', type=str, nargs='?', const=os.path.join(PROJ_ROOT, '_out', 'binsize'), default=None, metavar='DIR',
+                        help='Report the section/object/symbol sizes of the library of every arch into this dir (default: ./_out/binsize).')
+    parser.add_argument('--binsize-baseline', type=str, default=None, metavar='DIR', help='Diff the binary size reports against the reports of the same name in this dir.')
+    parser.add_argument('--binsize-max-growth', type=int, default=None, metavar='BYTES', help='Fail if the loaded size of an arch grows by more bytes than the baseline.')
+
+    parser.add_argument('--jumbo', type=int, nargs='?', const=1, default=0, metavar='CHUNKS',
+                        help='Unity (jumbo) build: compile each source_set as up to CHUNKS files per language (default: 1), fewer compiler invocations and header parses.')
+    parser.add_argument('--pch', default=False, action='store_true', help='Precompiled headers of the common system headers (toolchains supporting them only).')
+    parser.add_argument('--lto', type=str, choices=['thin', 'full'], default=None, help='Link-time optimization of the library (shared libraries only).')
+    parser.add_argument('--pgo', default=False, action='store_true',
+                        help='Profile-guided optimization: build instrumented, train with the native benchmark, then rebuild with the merged profile. Profiles are cached by source revision.')
+    parser.add_argument('--pgo-profile', type=str, default=None, metavar='PROFDATA', help='Optimize with this merged profile instead of training.')
+    parser.add_argument('--pgo-cache', type=str, default=os.path.join(PROJ_ROOT, '_out', '.pgo_cache'), metavar='DIR', help='Cache dir of the trained profiles (default: ./_out/.pgo_cache).')
+
+    parser.add_argument('--base64-tool', default=False, action='store_true', help='Also build the `gbe_base64` command-line tool (encodes / decodes files with the base64 module).')
 
     parser.add_argument('--upload', default=False, action='store_true', help='Whether to upload products to Coding Artifactory')
 
     # Args for Android
-    parser.add_argument('--android', dest='target_os', action='store_const', const='android')
+    parser.add_argument('--android', dest='target_os', action='append_const', const='android')
     parser.add_argument('--android-cpu', action='store', type=str, nargs='+', choices=['arm', 'arm64', 'x86', 'x64'], default=['arm', 'arm64', 'x86', 'x64'])
-    parser.add_argument('--android-lang', type=str, choices=['java', 'c'], default='java')
+    parser.add_argument('--android-lang', type=str, nargs='+', action='extend', choices=['java', 'c'], default=None, help='Default: java')
 
     # Args for iOS
-    parser.add_argument('--ios', dest='target_os', action='store_const', const='ios')
+    parser.add_argument('--ios', dest='target_os', action='append_const', const='ios')
     parser.add_argument('--ios-cpu', action='store', type=str, nargs='+', choices=['arm', 'arm64', 'x64'], default=['arm', 'arm64', 'x64'])
-    parser.add_argument('--ios-lang', type=str, choices=['objc', 'c'], default='objc')
+    parser.add_argument('--ios-lang', type=str, nargs='+', action='extend', choices=['objc', 'c'], default=None, help='Default: objc')
     parser.add_argument('--ios-no-bitcode', default=False, action='store_true', help='Disable bitcode for iOS targets.')
 
     # Args for macOS
-    parser.add_argument('--mac', dest='target_os', action='store_const', const='mac')
+    parser.add_argument('--mac', dest='target_os', action='append_const', const='mac')
     parser.add_argument('--mac-cpu', action='store', type=str, nargs='+', choices=['arm64', 'x64'], default=['arm64', 'x64'])
-    parser.add_argument('--mac-lang', type=str, choices=['objc', 'c'], default='objc')
+    parser.add_argument('--mac-lang', type=str, nargs='+', action='extend', choices=['objc', 'c'], default=None, help='Default: objc')
 
     # Args for Windows
-    parser.add_argument('--win', dest='target_os', action='store_const', const='win')
+    parser.add_argument('--win', dest='target_os', action='append_const', const='win')
     parser.add_argument('--win-cpu', action='store', type=str, nargs='+', choices=['x86', 'x64'], default=['x64'])
-    parser.add_argument('--win-lang', type=str, choices=['c'], default='c')
+    parser.add_argument('--win-lang', type=str, nargs='+', action='extend', choices=['c'], default=None, help='Default: c')
+
+    # Args for Linux
+    parser.add_argument('--linux', dest='target_os', action='append_const', const='linux')
+    parser.add_argument('--linux-cpu', action='store', type=str, nargs='+', choices=['arm', 'arm64', 'x86', 'x64'], default=['x64'])
+    parser.add_argument('--linux-lang', type=str, nargs='+', action='extend', choices=['c'], default=None, help='Default: c')
+
+    args = parser.parse_args(args)
+    # Drop duplicated values, e.g. `--ios --target-os ios`
+    for target_os, lang in [('android', 'java'), ('ios', 'objc'), ('mac', 'objc'), ('win', 'c'), ('linux', 'c')]:
+        langs = getattr(args, '{}_lang'.format(target_os)) or [lang]
+        setattr(args, '{}_lang'.format(target_os), list(OrderedDict.fromkeys(langs)))
+    args.lib_type = list(OrderedDict.fromkeys(args.lib_type or ['shared']))
+    args.target_os = list(OrderedDict.fromkeys(args.target_os or []))
+    try:
+        check_compression(args.zip_method, args.zip_level)
+    except Exception as e:
+        parser.error(str(e))
+
+    if not args.matrix:
+        # Without matrix mode, every option takes a single value
+        if len(args.target_os) > 1 or len(args.lib_type) > 1 or any(len(getattr(args, '{}_lang'.format(x))) > 1 for x in args.target_os):
+            parser.error('Building several target OS/lib types/langs in one call requires --matrix.')
+        args.target_os = args.target_os[0] if args.target_os else None
+        args.lib_type = args.lib_type[0]
+        for target_os in ['android', 'ios', 'mac', 'win', 'linux']:
+            setattr(args, '{}_lang'.format(target_os), getattr(args, '{}_lang'.format(target_os))[0])
+    elif not args.target_os:
+        parser.error('Target OS must be specified.')
+    return args
+
+
+def __get_variants(args) -> List[Tuple[str, str, str, List[str]]]:
+    """(target_os, lib_type, build_lang, cpu_list) of every variant to build"""
+    if not args.matrix:
+        cpu_list, build_lang = __get_cpu_list_and_build_lang(args)
+        return [(args.target_os, args.lib_type, build_lang, cpu_list)]
+
+    variants = []
+    for target_os in args.target_os:
+        for build_lang in getattr(args, '{}_lang'.format(target_os)):
+            for lib_type in args.lib_type:
+                variants.append((target_os, lib_type, build_lang, getattr(args, '{}_cpu'.format(target_os))))
+    return variants
+
+
+def __create_builder(args, target_os: str, lib_type: str, build_lang: str, cpu_list: List[str], gbe_version: str) -> Builder:
+    builder = Builder(PROJ_NAME, args.build_type, target_os, lib_type)
+    builder.set_only_gen(args.only_gen)
+    builder.set_gn_check(args.gn_check)
+    builder.set_force_gen(args.force_gen)
+    builder.set_cpu_list(cpu_list)
+    builder.set_parallel_archs(args.parallel_archs)
+    builder.set_compiler_cache(args.compiler_cache)
+    builder.set_artifact_cache(args.artifact_cache, args.artifact_cache_size * 1024 * 1024)
+    builder.set_affected(args.affected)
+    builder.set_bench(args.bench)
+    builder.set_base64_tool(args.base64_tool)
+    builder.set_binsize(args.binsize, args.binsize_baseline, args.binsize_max_growth)
+    builder.set_jumbo(args.jumbo)
+    builder.set_pch(args.pch)
+    builder.set_lto(args.lto)
+    builder.set_build_lang(build_lang)
+    builder.set_version(gbe_version)
+    builder.set_reproducible_version(args.reproducible_version)
+    return builder
+
+
+def __get_pgo_profile(args, variants: List[Tuple[str, str, str, List[str]]], gbe_version: str) -> str:
+    """Get the trained profile of the current sources from the cache, or train it with an instrumented build"""
+    # Train on the first arch which can run on this host, the profile is used by all archs
+    training = None
+    for target_os, lib_type, build_lang, cpu_list in variants:
+        for cpu in cpu_list:
+            if training is None and benchmark.can_run_on_host(target_os, cpu):
+                training = (target_os, lib_type, build_lang, cpu)
+    if training is None:
+        raise Exception('PGO training needs an arch which can run on this host, pass a trained profile with --pgo-profile.')
+    target_os, lib_type, build_lang, cpu = training
+
+    cache = pgo.ProfileCache(args.pgo_cache)
+    key = pgo.get_profile_key(args.pgo_cache, target_os, cpu, args.build_type, args.lto)
+    profile = cache.get(key)
+    if profile is not None:
+        print('\n[*] Use cached PGO profile: {}'.format(profile))
+        return profile
+
+    print('\n' + '=' * 30)
+    print('\n[*] Build instrumented {0} {1} for PGO training...'.format(target_os, cpu))
+    builder = __create_builder(args, target_os, lib_type, build_lang, [cpu], gbe_version)
+    builder.set_bench(True)
+    builder.set_binsize(None)
+    builder.set_pgo(instrument=True)
+    builder.build()
+
+    _, executable = builder.get_benchmark_executables()[0]
+    work_dir = os.path.join(os.path.dirname(executable), 'pgo')
+    merged_profile = os.path.join(work_dir, 'merged.profdata')
+    pgo.train(executable, work_dir, merged_profile)
+    profile = cache.put(key, merged_profile)
+    print('\n[*] Cached PGO profile: {}'.format(profile))
+    return profile
+
 
-    return parser.parse_args(args)
+def __run_benchmarks(builders: List[Builder], args):
+    executed = set()
+    for builder in builders:
+        for cpu, executable in builder.get_benchmark_executables():
+            # Variants of a matrix build may share the same executable
+            if os.path.realpath(executable) in executed:
+                continue
+            executed.add(os.path.realpath(executable))
+            output_json = os.path.join(args.bench_output or os.path.dirname(executable), 'benchmark-{0}-{1}-{2}-{3}.json'.format(
+                builder.target_os, builder.lib_type, builder.build_lang, cpu))
+            print('\n[*] Run benchmark of {0} {1}...'.format(builder.target_os, cpu))
+            benchmark.run_benchmark(executable, output_json, args.bench_max_size, args.bench_min_time)
+
+    if not executed:
+        print('\n[*] None of the built archs can run on this host, skip benchmark.')
 
 
 def main(argv):
     os.chdir(PROJ_ROOT)
     args = __parse_args(argv)
-    cpu_list, build_lang = __get_cpu_list_and_build_lang(args)
-    gbe_version = __gen_gbe_version()
+    try:
+        return __build_and_archive(args)
+    finally:
+        if args.timing_report:
+            get_telemetry().write_report(
+                args.timing_report,
+                build_type=args.build_type,
+                variants=[{
+                    'target_os': target_os,
+                    'lib_type': lib_type,
+                    'build_lang': build_lang,
+                    'cpu_list': cpu_list
+                } for target_os, lib_type, build_lang, cpu_list in __get_variants(args)]
+            )
+
+
+def __build_and_archive(args):
+    telemetry = get_telemetry()
+    variants = __get_variants(args)
+    with telemetry.phase('version'):
+        gbe_version = __gen_gbe_version(args.reproducible_version)
 
     print('\n[*] Version: {}'.format(gbe_version))
 
+    pgo_profile = args.pgo_profile
+    if args.pgo and pgo_profile is None and not args.only_gen:
+        with telemetry.phase('pgo-train'):
+            pgo_profile = __get_pgo_profile(args, variants, gbe_version)
+
     # Build with `gn` and `ninja`
     print('\n' + '=' * 30)
-    builder = Builder(PROJ_NAME, args.build_type, args.target_os, args.lib_type)
-    builder.set_only_gen(args.only_gen)
-    builder.set_cpu_list(cpu_list)
-    builder.set_build_lang(build_lang)
-    builder.set_version(gbe_version)
-    builder.build()
+    builders = []
+    for target_os, lib_type, build_lang, cpu_list in variants:
+        builder = __create_builder(args, target_os, lib_type, build_lang, cpu_list, gbe_version)
+        builder.set_pgo(profile=pgo_profile)
+        builders.append(builder)
+    with telemetry.phase('build'):
+        if args.matrix:
+            MatrixBuilder(builders).build()
+        else:
+            builders[0].build()
 
     if args.only_gen:
         # Only gen complete, exit.
         return 0
 
+    if args.bench:
+        print('\n' + '=' * 30)
+        with telemetry.phase('benchmark'):
+            __run_benchmarks(builders, args)
+
     # Archive products and symbols into zip
-    print('\n' + '=' * 30)
-    archiver = Archiver(PROJ_NAME, args.build_type, args.target_os, args.lib_type)
-    archiver.set_cpu_list(cpu_list)
-    archiver.set_version(gbe_version)
-    archiver.set_build_lang(build_lang)
-    archive_result = archiver.archive()
+    for builder, (target_os, lib_type, build_lang, cpu_list) in zip(builders, variants):
+        print('\n' + '=' * 30)
+        archiver = Archiver(PROJ_NAME, args.build_type, target_os, lib_type)
+        archiver.set_cpu_list(cpu_list)
+        archiver.set_version(gbe_version)
+        archiver.set_build_lang(build_lang)
+        if builder.reused_cpus:
+            if builder.is_reused() and all(os.path.exists(x) for x in archiver.get_archive_paths().values()):
+                print('\n[*] {0} {1} {2} is not affected, keep the previous archives.'.format(target_os, lib_type, build_lang))
+            else:
+                # The reused binaries embed the version of their build, they must not be archived as this version
+                print('\n[*] {0} {1} {2} reuses the outputs of a previous build ({3}) with its version, skip archiving them as {4}.'.format(
+                    target_os, lib_type, build_lang, ', '.join(builder.reused_cpus), gbe_version))
+            continue
+        archiver.set_compression(args.zip_method, args.zip_level)
+        archiver.set_staging(args.archive_staging)
+        if args.zip_cache:
+            archiver.set_zip_cache(args.zip_cache, args.zip_cache_size * 1024 * 1024)
+        if args.reproducible_version:
+            # Keep the volatile build date out of the binary, only record it in the archive.
+            archiver.set_build_info({'version': gbe_version, 'build_time': time.strftime('%Y-%m-%dT%H:%M:%S%z')})
+        with telemetry.phase('archive', target_os=target_os, lib_type=lib_type, build_lang=build_lang):
+            archive_result = archiver.archive()
 
     print('\n[*] All build success ^_^\n')
     return 0
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# Copyright © 2021 Patrick Fu.
+
+import os
+import sys
+import json
+import hashlib
+import subprocess
+from typing import Any, Dict, List, Optional, Set
+
+PROJ_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.append(PROJ_ROOT)
+
+from buildscripts.scheduler import CommandRunner
+from buildscripts.zipcache import hash_file
+
+"""
+Affected analysis: map the source changes since the last build of an out dir
+to its GN targets, so out dirs whose outputs can't change are not rebuilt.
+"""
+
+# Git revision and build args of the last successful build, kept in the out dir
+AFFECTED_STAMP = 'gbe_affected.stamp.json'
+# Cached `gn refs` and `ninja -t deps` results of the out dir
+REFS_CACHE = 'gbe_affected_refs.json'
+REFS_RESPONSE_FILE = 'gbe_affected_refs.rsp'
+
+# The group built by `ninja` without targets, see //BUILD.gn
+DEFAULT_TARGET = '//:default'
+
+# Changes under these paths always affect every out dir (build config, toolchains, build scripts)
+ALWAYS_AFFECTED_PATHS = ['.gn', 'build', 'buildtools', 'buildscripts', 'build.py']
+
+
+def _git(args: List[str]) -> List[str]:
+    """Output of a git command with `-z`, split by '\\0'"""
+    output = subprocess.check_output(['git', '-C', PROJ_ROOT, args[0], '-z'] + args[1:], stderr=subprocess.DEVNULL)
+    return [x for x in output.decode('utf8').split('\0') if x]
+
+
+def get_head_revision() -> str:
+    output = subprocess.check_output(['git', '-C', PROJ_ROOT, 'rev-parse', '--verify', 'HEAD'], stderr=subprocess.DEVNULL)
+    return output.decode('utf8').strip()
+
+
+def get_dirty_files(revision: str = 'HEAD') -> List[str]:
+    """Files differing from `revision` in the working tree (committed, staged or not), and untracked files"""
+    changed = _git(['diff', '--name-only', '--no-renames', revision, '--'])
+    untracked = _git(['ls-files', '--others', '--exclude-standard'])
+    return sorted(set(changed + untracked))
+
+
+def _hash_path(path: str) -> Optional[str]:
+    """Content hash of a file in the working tree, None if it does not exist"""
+    full_path = os.path.join(PROJ_ROOT, path)
+    if not os.path.isfile(full_path):
+        return None
+    return hash_file(full_path)
+
+
+def _is_under(path: str, paths: List[str]) -> bool:
+    return any(path == x or path.startswith(x + '/') for x in paths)
+
+
+class AffectedAnalyzer():
+    """Whether the outputs of a gn out dir can be affected by the source changes since its last build.
+
+    The last successful build records the git revision, the files which differed
+    from it (with their content hashes) and the build args. The changed files since
+    then affect the out dir if one of them is:
+        * under `ALWAYS_AFFECTED_PATHS`, or read by `gn gen` (BUILD.gn, .gni, ...)
+        * a compile input recorded in the ninja deps log, e.g. headers not listed in
+          `sources`, or the sources included by the jumbo files
+        * a source/input of a target `//:default` depends on (`gn refs --all`)
+
+    The files `gn refs` found unused are cached in the out dir, until the GN files
+    or the build args change.
+    """
+
+    def __init__(self, out_dir: str, build_args: List[str], gen_deps: Optional[List[str]], gn: str, ninja: str,
+                 runner: Optional[CommandRunner] = None) -> None:
+        """
+        Args:
+            out_dir (str): The gn out dir
+            build_args (List[str]): GN args which change the outputs, a change affects everything
+            gen_deps (Optional[List[str]]): Input files of the last `gn gen`, relative to `out_dir`
+            gn (str): Path of `gn`
+            ninja (str): Path of `ninja`
+            runner (Optional[CommandRunner]): Runs the `gn` and `ninja` commands
+        """
+        self.out_dir = out_dir
+        self.build_args = build_args
+        self.gen_deps = gen_deps
+        self.gn = gn
+        self.ninja = ninja
+        self.runner = runner or CommandRunner()
+
+    def get_affected_reason(self) -> Optional[str]:
+        """Why the out dir needs to be built, None if its outputs can't change"""
+        stamp = self._read_json(AFFECTED_STAMP)
+        if stamp is None or self.gen_deps is None:
+            return 'no previous build'
+        if stamp.get('args') != self.build_args:
+            return 'build args changed'
+
+        changed = self._get_changed_files(stamp)
+        if changed is None:
+            return 'unknown revision of the last build: {}'.format(stamp.get('revision'))
+        if not changed:
+            return None
+
+        gen_inputs = set(self._to_source_path(x) for x in self.gen_deps)
+        for path in changed:
+            if _is_under(path, ALWAYS_AFFECTED_PATHS) or path in gen_inputs:
+                return 'build file changed: {}'.format(path)
+
+        cache = self._read_refs_cache()
+        compile_inputs = self._get_compile_inputs(cache)
+        for path in changed:
+            if path in compile_inputs:
+                return 'compile input changed: {}'.format(path)
+
+        # Only the files not used by `DEFAULT_TARGET` are cached, others lead to a build anyway
+        unknown = [x for x in changed if x not in cache['unused']]
+        if unknown and DEFAULT_TARGET in self._get_refs(unknown):
+            self._write_json(REFS_CACHE, cache)
+            return 'source of {0} changed: {1}'.format(DEFAULT_TARGET, ', '.join(unknown))
+        cache['unused'] = sorted(set(cache['unused']) | set(unknown))
+        self._write_json(REFS_CACHE, cache)
+        return None
+
+    def write_stamp(self):
+        """Record the current sources as built, after a successful build"""
+        try:
+            revision = get_head_revision()
+            dirty = {path: _hash_path(path) for path in get_dirty_files(revision)}
+        except (OSError, subprocess.CalledProcessError):
+            self.runner.log('\n[*] Not a git checkout, the next affected analysis of {} rebuilds everything.'.format(self.out_dir))
+            return
+        self._write_json(AFFECTED_STAMP, {'revision': revision, 'dirty': dirty, 'args': self.build_args})
+
+    def remove_stamp(self):
+        """Invalidate the stamp until the build succeeds"""
+        stamp_file = os.path.join(self.out_dir, AFFECTED_STAMP)
+        if os.path.exists(stamp_file):
+            os.remove(stamp_file)
+
+    def _get_changed_files(self, stamp: Dict[str, Any]) -> Optional[List[str]]:
+        """Files whose content differs from the last build, None if the revision of the last build is unknown"""
+        dirty: Dict[str, Optional[str]] = stamp.get('dirty', {})
+        try:
+            candidates = set(get_dirty_files(stamp['revision'])) | set(dirty)
+        except (KeyError, OSError, subprocess.CalledProcessError):
+            return None
+        changed = []
+        for path in sorted(candidates):
+            # Files which were dirty at the last build are compared with their hashes at that time
+            if path in dirty and dirty[path] == _hash_path(path):
+                continue
+            changed.append(path)
+        return changed
+
+    def _get_graph_key(self) -> str:
+        """Hash of the build args and the GN files, the `gn refs` results are valid as long as it is the same"""
+        h = hashlib.sha256()
+        h.update('\0'.join(self.build_args).encode('utf8'))
+        for dep in sorted(set(self.gen_deps or [])):
+            if dep == 'args.gn':
+                continue
+            path = os.path.join(self.out_dir, dep)
+            h.update(dep.encode('utf8') + b'\0')
+            h.update((hash_file(path) if os.path.isfile(path) else '').encode('utf8'))
+        return h.hexdigest()
+
+    def _read_refs_cache(self) -> Dict[str, Any]:
+        key = self._get_graph_key()
+        cache = self._read_json(REFS_CACHE)
+        if cache is None or cache.get('key') != key:
+            return {'key': key, 'unused': [], 'deps': {}}
+        return cache
+
+    def _get_compile_inputs(self, cache: Dict[str, Any]) -> Set[str]:
+        """Source files read by the compile commands, from the ninja deps log"""
+        deps_log = os.path.join(self.out_dir, '.ninja_deps')
+        if not os.path.exists(deps_log):
+            return set()
+        stat = os.stat(deps_log)
+        log_stamp = [stat.st_mtime_ns, stat.st_size]
+        if cache['deps'].get('log') == log_stamp:
+            return set(cache['deps']['inputs'])
+
+        output = self.runner.check_output([self.ninja, '-C', self.out_dir, '-t', 'deps'], cwd=PROJ_ROOT)
+        inputs = set()
+        for line in output.decode('utf8', errors='replace').splitlines():
+            # e.g. "obj/foo.o: #deps 2, deps mtime 123 (VALID)", then one indented line per dependency
+            if line.startswith((' ', '\t')) and line.strip():
+                path = self._to_source_path(line.strip())
+                if not path.startswith('../'):
+                    inputs.add(path)
+        cache['deps'] = {'log': log_stamp, 'inputs': sorted(inputs)}
+        return inputs
+
+    def _get_refs(self, paths: List[str]) -> Set[str]:
+        """Targets which (transitively) depend on any of `paths`, with `gn refs --all`"""
+        response_file = os.path.join(self.out_dir, REFS_RESPONSE_FILE)
+        with open(response_file, 'w', encoding='utf8') as fw:
+            fw.write('\n'.join('//' + x for x in paths) + '\n')
+        output = self.runner.check_output([self.gn, 'refs', self.out_dir, '@' + response_file, '--all'], cwd=PROJ_ROOT)
+        return set(x.strip() for x in output.decode('utf8', errors='replace').splitlines() if x.strip())
+
+    def _to_source_path(self, path: str) -> str:
+        """Path relative to the out dir (or absolute) to a path relative to the project root, with '/'"""
+        full_path = os.path.normpath(os.path.join(self.out_dir, path))
+        return os.path.relpath(full_path, PROJ_ROOT).replace(os.sep, '/')
+
+    def _read_json(self, name: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(os.path.join(self.out_dir, name), 'r', encoding='utf8') as fr:
+                content = json.load(fr)
+            return content if isinstance(content, dict) else None
+        except (OSError, ValueError):
+            return None
+
+    def _write_json(self, name: str, content: Dict[str, Any]):
+        path = os.path.join(self.out_dir, name)
+        with open(path + '.tmp', 'w', encoding='utf8') as fw:
+            json.dump(content, fw, indent=2, sort_keys=True)
+        os.replace(path + '.tmp', path)
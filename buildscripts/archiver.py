@@ -3,8 +3,11 @@
 
 import os
 import sys
+import json
+import time
 import shutil
-from typing import List, Dict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, Dict, Optional, Tuple
 
 """
 Script for archive products.
@@ -15,7 +18,10 @@ PROJ_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(PROJ_ROOT)
 
 from buildscripts.utils import get_out_dir, get_abi_from_cpu
-from buildscripts.ziputil import zip_folders
+from buildscripts.ziputil import zip_manifest, check_compression
+from buildscripts.zipcache import ZipEntryCache
+from buildscripts.checksums import MANIFEST_FILE, write_manifest
+from buildscripts.telemetry import get_telemetry
 
 
 class Archiver():
@@ -27,6 +33,11 @@ class Archiver():
         self.cpu_list: List[str] = []
         self.build_lang = 'c'
         self.version: str = '0.0.1.0-heads'
+        self.build_info: Optional[Dict[str, str]] = None
+        self.zip_method = 'deflate'
+        self.zip_level: Optional[int] = None
+        self.staging = False
+        self.zip_cache: Optional[ZipEntryCache] = None
 
     def set_cpu_list(self, cpu_list: List[str]):
         self.cpu_list = cpu_list
@@ -38,69 +49,194 @@ class Archiver():
         # Only use semver and branch, like '1.2.3.888-main'
         self.version = '-'.join(version.split('-')[:2])
 
+    def set_compression(self, method: str, level: Optional[int] = None):
+        """Compression method (one of `ziputil.COMPRESSION_METHODS`) and level of the zip files"""
+        check_compression(method, level)
+        self.zip_method = method
+        self.zip_level = level
+
+    def set_zip_cache(self, cache_dir: str, max_size: int):
+        """Reuse compressed zip entries of unchanged files, and skip zips whose inputs are unchanged
+
+        Args:
+            cache_dir (str): Cache dir, can be shared by several out dirs
+            max_size (int): Max cache size in bytes, least recently used entries are evicted
+        """
+        self.zip_cache = ZipEntryCache(cache_dir, max_size)
+
+    def set_staging(self, staging: bool):
+        """Also copy the archived files into the products dir like the zip layout (for debugging)"""
+        self.staging = staging
+
+    def set_build_info(self, build_info: Dict[str, str]):
+        """Extra info (e.g. build date) written into the products as `build_info.json`"""
+        self.build_info = build_info
+
     def archive(self) -> Dict[str, str]:
         """Archive products and symbols into zip file
 
+        The {path, size, sha256, crc32} of every zipped file are written into
+        `manifest.json` next to the zips, the files are hashed while reading them
+        for compression.
+
         Returns:
-            Dict[str, str]:  {'products': '/full/path/to/products.zip', 'symbols': '/full/path/to/symbols.zip'}
+            Dict[str, str]:  {'products': '/full/path/to/products.zip', 'symbols': '/full/path/to/symbols.zip', 'manifest': '/full/path/to/manifest.json'}
         """
         print('\n[*] Start archiving {0} {1}...\n'.format(self.target_os, self.build_type))
 
-        product_name = '{proj}-{ver}-{os}-{lib}-{lang}'.format(
-            proj=self.proj_name,
-            ver=self.version,
-            os=self.target_os,
-            lib=self.lib_type,
-            lang=self.build_lang
-        )
-
+        product_name = self._get_product_name()
         products_dir = get_out_dir(self.build_type, self.target_os, self.lib_type, self.build_lang, '__products')
 
-        if os.path.exists(products_dir):
-            print('[*] remove {}'.format(products_dir))
-            shutil.rmtree(products_dir)
-        print('[*] mkdir {}'.format(products_dir))
-        os.mkdir(products_dir)
-
-        tmp_product_dir = os.path.join(products_dir, product_name)
-        tmp_symbol_dir = os.path.join(products_dir, 'symbols-{}'.format(product_name))
-
-        print('[*] mkdir {}'.format(tmp_product_dir))
-        print('[*] mkdir {}'.format(tmp_symbol_dir))
-        os.mkdir(tmp_product_dir)
-        os.mkdir(tmp_symbol_dir)
+        symbol_name = 'symbols-{}'.format(product_name)
+        archive_paths = self.get_archive_paths()
+        products_zip_name = os.path.basename(archive_paths['products'])
+        symbols_zip_name = os.path.basename(archive_paths['symbols'])
+
+        if self.zip_cache is not None and os.path.exists(products_dir):
+            # Keep the previous zips, they are skipped if their inputs are unchanged
+            for name in os.listdir(products_dir):
+                if name in (products_zip_name, symbols_zip_name):
+                    continue
+                path = os.path.join(products_dir, name)
+                print('[*] remove {}'.format(path))
+                if os.path.isdir(path) and not os.path.islink(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+        else:
+            if os.path.exists(products_dir):
+                print('[*] remove {}'.format(products_dir))
+                shutil.rmtree(products_dir)
+            print('[*] mkdir {}'.format(products_dir))
+            os.mkdir(products_dir)
+
+        # (source path, name in zip), zipped straight from the build out dirs
+        products_manifest: List[Tuple[str, str]] = []
+        symbols_manifest: List[Tuple[str, str]] = []
 
         if self.target_os == 'ios' or self.target_os == 'mac':
-            self._copy_darwin(tmp_product_dir, tmp_symbol_dir)
-
-        products_zip_name = '{}.zip'.format(product_name)
-        symbols_zip_name = 'symbols-{}.zip'.format(product_name)
-        products_zip_path = os.path.join(products_dir, products_zip_name)
-        symbols_zip_path = os.path.join(products_dir, symbols_zip_name)
+            self._add_darwin_manifest(products_manifest, symbols_manifest, product_name, symbol_name)
+        elif self.target_os == 'linux':
+            self._add_linux_manifest(products_manifest, product_name)
+
+        # The build info changes on every build, it is left out of the zip cache's comparison
+        products_volatile: List[Tuple[str, str]] = []
+        if self.build_info is not None:
+            build_info_path = self._write_build_info(products_dir)
+            products_volatile.append((build_info_path, '{}/build_info.json'.format(product_name)))
+
+        if self.staging:
+            self._stage_manifest(products_dir, products_manifest + products_volatile + symbols_manifest)
+
+        # Products and symbols share no inputs, zip them at the same time
+        records: Dict[str, List[Dict[str, Any]]] = {'products': [], 'symbols': []}
+        self._zip_in_parallel({
+            'products': (products_manifest, products_dir, products_zip_name, products_volatile),
+            'symbols': (symbols_manifest, products_dir, symbols_zip_name, []),
+        }, records)
+
+        print('\n[*] Write checksum manifest: {}'.format(archive_paths['manifest']))
+        write_manifest(archive_paths['manifest'], {
+            products_zip_name: records['products'],
+            symbols_zip_name: records['symbols'],
+        })
+
+        if self.zip_cache is not None:
+            self.zip_cache.report()
+            self.zip_cache.evict()
 
-        print('\n[*] Zip products: {0}, from: {1}'.format(products_zip_path, tmp_product_dir))
-        zip_folders([tmp_product_dir], products_dir, products_zip_name, exclude_files=['.DS_Store'])
+        print('\n[*] Archive {0} {1} success!'.format(self.target_os, self.build_type))
 
-        print('\n[*] Zip symbols: {0}, from: {1}'.format(symbols_zip_path, tmp_symbol_dir))
-        zip_folders([tmp_symbol_dir], products_dir, symbols_zip_name, exclude_files=['.DS_Store'])
+        return archive_paths
 
-        print('\n[*] Archive {0} {1} success!'.format(self.target_os, self.build_type))
+    def get_archive_paths(self) -> Dict[str, str]:
+        """Paths of the zip files written by `archive`, same keys as its result"""
+        product_name = self._get_product_name()
+        products_dir = get_out_dir(self.build_type, self.target_os, self.lib_type, self.build_lang, '__products')
+        return {
+            'products': os.path.join(products_dir, '{}.zip'.format(product_name)),
+            'symbols': os.path.join(products_dir, 'symbols-{}.zip'.format(product_name)),
+            'manifest': os.path.join(products_dir, MANIFEST_FILE),
+        }
+
+    def _get_product_name(self) -> str:
+        return '{proj}-{ver}-{os}-{lib}-{lang}'.format(
+            proj=self.proj_name,
+            ver=self.version,
+            os=self.target_os,
+            lib=self.lib_type,
+            lang=self.build_lang
+        )
 
-        return {'products': products_zip_path, 'symbols': symbols_zip_path}
+    def _zip_in_parallel(self, zip_jobs: Dict[str, Tuple[List[Tuple[str, str]], str, str, List[Tuple[str, str]]]],
+                         records: Dict[str, List[Dict[str, Any]]]) -> Dict[str, float]:
+        """Zip each `{name: (manifest, dst_folder, zip_name, volatile)}` in its own thread, with the checksums into `records[name]`
 
-    def _copy_darwin(self, tmp_product_dir, tmp_symbol_dir):
-        # Copy dSYM (only shared library)
+        Returns:
+            Dict[str, float]: Seconds spent for each zip
+        """
+        # Split the compression threads across the zips
+        workers = max(1, (os.cpu_count() or 1) // len(zip_jobs))
+
+        def _zip(name: str, manifest: List[Tuple[str, str]], dst_folder: str, zip_name: str, volatile: List[Tuple[str, str]]) -> float:
+            start_time = time.time()
+            print('\n[*] Zip {0}: {1}, from: {2}'.format(name, os.path.join(dst_folder, zip_name), ', '.join(src for src, _ in manifest + volatile)))
+            with get_telemetry().phase('zip', archive=name, method=self.zip_method) as record:
+                record['tags']['written'] = zip_manifest(manifest, dst_folder, zip_name, exclude_files=['.DS_Store'],
+                                                         method=self.zip_method, level=self.zip_level, workers=workers, cache=self.zip_cache,
+                                                         records=records[name], volatile=volatile)
+            return time.time() - start_time
+
+        start_time = time.time()
+        with ThreadPoolExecutor(max_workers=len(zip_jobs)) as pool:
+            futures = {name: pool.submit(_zip, name, *job) for name, job in zip_jobs.items()}
+            timing = {name: future.result() for name, future in futures.items()}
+
+        for name, seconds in timing.items():
+            print('[*] Zip {0} took {1:.2f}s'.format(name, seconds))
+        print('[*] Zip all took {0:.2f}s'.format(time.time() - start_time))
+        return timing
+
+    def _add_darwin_manifest(self, products_manifest, symbols_manifest, product_name, symbol_name):
+        # dSYM (only shared library)
         if self.lib_type == 'shared':
-            print('\n[*] Copy Darwin dSYM...')
             for cpu in self.cpu_list:
                 src_dir = get_out_dir(self.build_type, self.target_os, self.lib_type, self.build_lang, cpu)
-
                 dsym_src = os.path.join(src_dir, '{}.dSYM'.format(self.proj_name))
-                dsym_dst = os.path.join(tmp_symbol_dir, get_abi_from_cpu(self.target_os, cpu), '{}.dSYM'.format(self.proj_name))
-                shutil.copytree(dsym_src, dsym_dst)
+                dsym_dst = '{0}/{1}/{2}.dSYM'.format(symbol_name, get_abi_from_cpu(self.target_os, cpu), self.proj_name)
+                symbols_manifest.append((dsym_src, dsym_dst))
 
-        # Copy XCFramework (Wrapper for shared or static library )
-        print('\n[*] Copy Darwin XCFramework...')
+        # XCFramework (Wrapper for shared or static library )
         xcframework_src = os.path.join(get_out_dir(self.build_type, self.target_os, self.lib_type, self.build_lang, 'xcframework'), '{}.xcframework'.format(self.proj_name))
-        xcframework_dst = os.path.join(tmp_product_dir, '{}.xcframework'.format(self.proj_name))
-        shutil.copytree(xcframework_src, xcframework_dst)
+        xcframework_dst = '{0}/{1}.xcframework'.format(product_name, self.proj_name)
+        products_manifest.append((xcframework_src, xcframework_dst))
+
+    def _add_linux_manifest(self, products_manifest, product_name):
+        # Library of each arch, the shared libraries are not stripped
+        library_file = 'lib{0}.{1}'.format(self.proj_name, 'so' if self.lib_type == 'shared' else 'a')
+        for cpu in self.cpu_list:
+            src_dir = get_out_dir(self.build_type, self.target_os, self.lib_type, self.build_lang, cpu)
+            library_dst = '{0}/{1}/{2}'.format(product_name, get_abi_from_cpu(self.target_os, cpu), library_file)
+            products_manifest.append((os.path.join(src_dir, library_file), library_dst))
+
+        # Headers are the same for all archs
+        include_src = os.path.join(get_out_dir(self.build_type, self.target_os, self.lib_type, self.build_lang, self.cpu_list[0]), 'include')
+        products_manifest.append((include_src, '{}/include'.format(product_name)))
+
+    def _stage_manifest(self, products_dir, manifest):
+        """Copy the manifest into `products_dir` like the zip layout, only for debugging"""
+        print('\n[*] Stage archive files in: {}'.format(products_dir))
+        for src, name in manifest:
+            dst = os.path.join(products_dir, name)
+            if os.path.isdir(src):
+                shutil.copytree(src, dst, symlinks=True)
+            elif not os.path.exists(dst):
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                shutil.copy2(src, dst, follow_symlinks=False)
+
+    def _write_build_info(self, products_dir) -> str:
+        build_info_path = os.path.join(products_dir, 'build_info.json')
+        print('\n[*] Write build info: {}'.format(build_info_path))
+        with open(build_info_path, 'w') as fw:
+            json.dump(self.build_info, fw, indent=2, sort_keys=True)
+        return build_info_path
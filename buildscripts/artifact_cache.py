@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+# Copyright © 2021 Patrick Fu.
+
+import os
+import sys
+import json
+import stat
+import shutil
+import hashlib
+import threading
+import subprocess
+from typing import Any, Dict, List, Tuple
+
+PROJ_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.append(PROJ_ROOT)
+
+from buildscripts.affected import AFFECTED_STAMP
+from buildscripts.zipcache import hash_file
+from buildscripts.compiler_cache import get_compiler_id
+
+"""
+Content-addressed cache of the finished outputs of per-arch builds.
+"""
+
+# Source tree inputs of the key, relative to the project root
+SOURCE_TREE_PATHS = ['.gn', 'BUILD.gn', 'build', 'src']
+_IGNORED_NAMES = ('.git', '.DS_Store', '__pycache__')
+
+# Outputs restored into an out dir, they are removed before ninja writes into the out dir
+RESTORED_OUTPUTS = 'gbe_artifact_cache.restored.json'
+
+# Host compilers of the GN toolchains (//build/toolchain/<os>:clang_*), and the SDKs of Darwin targets
+_COMPILERS = ['clang', 'clang++']
+_DARWIN_SDKS = {'ios': ['iphoneos', 'iphonesimulator'], 'mac': ['macosx']}
+
+# Tree hashes by paths, the sources do not change during a build
+_tree_hashes: Dict[Tuple[str, ...], str] = {}
+_tree_hashes_lock = threading.Lock()
+# Toolchain ids by target OS, the toolchains do not change during a build
+_toolchain_ids: Dict[str, str] = {}
+_toolchain_ids_lock = threading.Lock()
+
+
+def get_tree_hash(paths: List[str]) -> str:
+    """Hash of the names, content and symlink targets of files and dir trees, computed once per process
+
+    Args:
+        paths (List[str]): Absolute paths, or relative to the project root, missing ones are skipped
+    """
+    with _tree_hashes_lock:
+        if tuple(paths) in _tree_hashes:
+            return _tree_hashes[tuple(paths)]
+
+        h = hashlib.sha256()
+        for top in paths:
+            top_path = os.path.join(PROJ_ROOT, top)
+            entries = [top_path] if not os.path.isdir(top_path) else []
+            for root, dirs, files in os.walk(top_path):
+                dirs[:] = sorted(x for x in dirs if x not in _IGNORED_NAMES)
+                entries.extend(os.path.join(root, x) for x in sorted(files) if x not in _IGNORED_NAMES)
+            for path in entries:
+                h.update(os.path.relpath(path, PROJ_ROOT).replace(os.sep, '/').encode('utf8') + b'\0')
+                if os.path.islink(path):
+                    h.update(b'link:' + os.readlink(path).encode('utf8'))
+                elif os.path.isfile(path):
+                    h.update(hash_file(path).encode('utf8'))
+        _tree_hashes[tuple(paths)] = h.hexdigest()
+        return _tree_hashes[tuple(paths)]
+
+
+def remove_restored_outputs(out_dir: str):
+    """Remove the outputs restored into `out_dir`
+
+    They may be hard links into the cache, a tool writing the same path in place
+    would modify the cached file.
+    """
+    path = os.path.join(out_dir, RESTORED_OUTPUTS)
+    try:
+        with open(path, 'r') as fr:
+            outputs = json.load(fr)
+    except (OSError, ValueError):
+        return
+    for name in outputs:
+        _remove(os.path.join(out_dir, name))
+    os.remove(path)
+
+
+class ArtifactCache():
+    """Outputs of per-arch builds, keyed by the source tree, the GN args, the gn/ninja binaries and the host compilers/SDKs.
+
+    Layout of the cache dir:
+        entries/<key[:2]>/<key>/       the outputs, laid out like the out dir, files are read-only
+        entries/<key[:2]>/<key>.json   {"outputs": [..], "size": ..}, mtime is the last use
+
+    Entries are stored as copies (clones on APFS/Btrfs/XFS), since the out dir is
+    rebuilt in place. They are restored as hard links, or clones/copies across file
+    systems. The least recently used entries are evicted once the cache exceeds
+    `max_size` bytes.
+    """
+
+    def __init__(self, cache_dir: str, max_size: int) -> None:
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+        self.restored_bytes = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(cache_dir, 'entries'), exist_ok=True)
+
+    @staticmethod
+    def get_key(gn_args: List[str], toolchain_dir: str, compiler_id: str) -> str:
+        """Key of an arch build
+
+        Args:
+            gn_args (List[str]): Rendered GN args which determine the outputs
+            toolchain_dir (str): Dir of the `gn`/`ninja` binaries
+            compiler_id (str): `get_compiler_id` of the target OS
+        """
+        h = hashlib.sha256()
+        h.update(get_tree_hash(SOURCE_TREE_PATHS).encode('utf8') + b'\0')
+        h.update(get_tree_hash([toolchain_dir]).encode('utf8') + b'\0')
+        h.update(compiler_id.encode('utf8') + b'\0')
+        h.update('\0'.join(gn_args).encode('utf8'))
+        return h.hexdigest()
+
+    def get_compiler_id(self, target_os: str, xcrun: str = 'xcrun') -> str:
+        """Identity of the host compilers building `target_os`, and of the SDKs on Darwin, computed once per process
+
+        A shared cache must not restore outputs of another clang/Xcode, e.g. after an upgrade or from another host.
+        """
+        with _toolchain_ids_lock:
+            if target_os in _toolchain_ids:
+                return _toolchain_ids[target_os]
+
+            h = hashlib.sha256()
+            compilers = _COMPILERS
+            if target_os in _DARWIN_SDKS:
+                compilers = [_check_output([xcrun, '--find', x]) or x for x in _COMPILERS]
+                for sdk in _DARWIN_SDKS[target_os]:
+                    for flag in ('--show-sdk-version', '--show-sdk-build-version'):
+                        h.update('{0} {1}: {2}\0'.format(sdk, flag, _check_output([xcrun, '--sdk', sdk, flag])).encode('utf8'))
+            for compiler in compilers:
+                try:
+                    compiler_id = get_compiler_id(self.cache_dir, compiler)
+                except OSError:
+                    compiler_id = 'missing'
+                h.update('{0}: {1}\0'.format(os.path.basename(compiler), compiler_id).encode('utf8'))
+            _toolchain_ids[target_os] = h.hexdigest()
+            return _toolchain_ids[target_os]
+
+    def has(self, key: str) -> bool:
+        return os.path.exists(self._entry_path(key) + '.json')
+
+    def restore(self, key: str, out_dir: str) -> bool:
+        """Restore the outputs of `key` into `out_dir`, replacing the existing ones
+
+        Returns:
+            bool: False if there is no such entry
+        """
+        entry_dir = self._entry_path(key)
+        try:
+            with open(entry_dir + '.json', 'r') as fr:
+                meta = json.load(fr)
+            outputs: List[str] = meta['outputs']
+            if not all(os.path.lexists(os.path.join(entry_dir, x)) for x in outputs):
+                raise ValueError('Corrupted cache entry')
+            os.utime(entry_dir + '.json')
+        except (OSError, ValueError, KeyError):
+            with self._lock:
+                self.misses += 1
+            return False
+
+        os.makedirs(out_dir, exist_ok=True)
+        # The affected stamp describes the outputs being replaced
+        _remove(os.path.join(out_dir, AFFECTED_STAMP))
+        # Recorded first, a partial restore is cleaned up by the next build too
+        with open(os.path.join(out_dir, RESTORED_OUTPUTS), 'w') as fw:
+            json.dump(outputs, fw)
+        for name in outputs:
+            dst = os.path.join(out_dir, name)
+            _remove(dst)
+            _link_tree(os.path.join(entry_dir, name), dst)
+
+        with self._lock:
+            self.hits += 1
+            self.restored_bytes += meta.get('size', 0)
+        return True
+
+    def put(self, key: str, out_dir: str, outputs: List[str]) -> bool:
+        """Store the `outputs` (names in `out_dir`) of a finished build
+
+        Returns:
+            bool: False if one of the outputs is missing
+        """
+        entry_dir = self._entry_path(key)
+        if os.path.exists(entry_dir + '.json'):
+            os.utime(entry_dir + '.json')
+            return True
+        if not all(os.path.lexists(os.path.join(out_dir, x)) for x in outputs):
+            return False
+        # Left by an interrupted put
+        _remove(entry_dir)
+
+        # Copy into a temp dir then rename, parallel writers of the same key are safe.
+        tmp_dir = '{0}.tmp{1}-{2}'.format(entry_dir, os.getpid(), threading.get_ident())
+        os.makedirs(tmp_dir)
+        try:
+            for name in outputs:
+                os.makedirs(os.path.dirname(os.path.join(tmp_dir, name)), exist_ok=True)
+                _clone(os.path.join(out_dir, name), os.path.join(tmp_dir, name))
+            size = _make_read_only(tmp_dir)
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            _remove(tmp_dir)
+            if os.path.isdir(entry_dir):
+                return True # Stored by another build meanwhile
+            raise
+        meta_tmp = '{0}.json.tmp{1}-{2}'.format(entry_dir, os.getpid(), threading.get_ident())
+        with open(meta_tmp, 'w') as fw:
+            json.dump({'outputs': outputs, 'size': size}, fw)
+        os.replace(meta_tmp, entry_dir + '.json')
+        with self._lock:
+            self.stored += 1
+        return True
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits in `max_size`"""
+        entries = []
+        total_size = 0
+        entries_dir = os.path.join(self.cache_dir, 'entries')
+        for prefix in os.listdir(entries_dir):
+            for name in os.listdir(os.path.join(entries_dir, prefix)):
+                if not name.endswith('.json'):
+                    continue
+                path = os.path.join(entries_dir, prefix, name)
+                try:
+                    with open(path, 'r') as fr:
+                        size = json.load(fr).get('size', 0)
+                    mtime = os.stat(path).st_mtime
+                except (OSError, ValueError):
+                    continue
+                entries.append((mtime, size, path[:-len('.json')]))
+                total_size += size
+
+        entries.sort()
+        evicted = 0
+        while entries and total_size > self.max_size:
+            _, size, entry_dir = entries.pop(0)
+            # Drop the meta first, a half removed entry is never restored
+            _remove(entry_dir + '.json')
+            _remove(entry_dir)
+            total_size -= size
+            evicted += 1
+        if evicted:
+            print('[*] [ArtifactCache] Evicted {0} entries, {1:.1f} MB left'.format(evicted, total_size / 1024 / 1024))
+
+    def report(self):
+        print('\n[*] [ArtifactCache] {0} hits, {1} misses, {2} stored, {3:.1f} MB outputs restored'.format(
+            self.hits, self.misses, self.stored, self.restored_bytes / 1024 / 1024))
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, 'entries', key[:2], key)
+
+
+def _check_output(cmd: List[str]) -> str:
+    """Stripped stdout of a command, empty if it fails"""
+    try:
+        return subprocess.check_output(cmd, stderr=subprocess.DEVNULL).decode('utf8', errors='replace').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def _clone(src: str, dst: str):
+    """Copy a file or dir tree with its symlinks, cloning the file data where the file system supports it"""
+    if sys.platform == 'darwin':
+        cmd = ['cp', '-c', '-R', '-p', src, dst]
+    elif sys.platform.startswith('linux'):
+        cmd = ['cp', '-a', '--reflink=auto', src, dst]
+    else:
+        cmd = []
+    if cmd and subprocess.call(cmd, stderr=subprocess.DEVNULL) == 0:
+        return
+    _remove(dst)
+    if os.path.isdir(src) and not os.path.islink(src):
+        shutil.copytree(src, dst, symlinks=True)
+    else:
+        shutil.copy2(src, dst, follow_symlinks=False)
+
+
+def _link_tree(src: str, dst: str):
+    """Recreate a file or dir tree with hard links of its files, or clones across file systems"""
+    if os.path.islink(src):
+        os.symlink(os.readlink(src), dst)
+        return
+    if not os.path.isdir(src):
+        try:
+            os.link(src, dst)
+        except OSError:
+            _clone(src, dst)
+        return
+    os.makedirs(dst)
+    for name in sorted(os.listdir(src)):
+        _link_tree(os.path.join(src, name), os.path.join(dst, name))
+
+
+def _make_read_only(path: str) -> int:
+    """Remove the write permission of the files under `path`, returns their total size"""
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            file_path = os.path.join(root, name)
+            if os.path.islink(file_path):
+                continue
+            st = os.stat(file_path)
+            os.chmod(file_path, stat.S_IMODE(st.st_mode) & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+            size += st.st_size
+    return size
+
+
+def _remove(path: str):
+    if os.path.isdir(path) and not os.path.islink(path):
+        def _on_error(func: Any, failed_path: str, _: Any):
+            # Read-only files can't be removed on Windows
+            os.chmod(failed_path, stat.S_IWRITE)
+            func(failed_path)
+        shutil.rmtree(path, onerror=_on_error)
+    elif os.path.lexists(path):
+        os.remove(path)
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# Copyright © 2021 Patrick Fu.
+
+import os
+import sys
+import json
+import platform
+import subprocess
+from typing import Any, Dict, List, Optional
+
+"""
+Run the native benchmark executable (//src/common/benchmark) and summarize its JSON results.
+"""
+
+BENCHMARK_EXECUTABLE = 'gbe_benchmark'
+
+
+def get_host_cpu() -> str:
+    """The host cpu in GN naming (arm/arm64/x86/x64)"""
+    machine = platform.machine().lower()
+    if machine in ('x86_64', 'amd64'):
+        return 'x64'
+    elif machine in ('arm64', 'aarch64'):
+        return 'arm64'
+    elif machine in ('i386', 'i686', 'x86'):
+        return 'x86'
+    elif machine.startswith('arm'):
+        return 'arm'
+    return machine
+
+
+def can_run_on_host(target_os: str, cpu: str) -> bool:
+    if target_os == 'linux':
+        return sys.platform.startswith('linux') and cpu == get_host_cpu()
+    elif target_os == 'mac':
+        return sys.platform == 'darwin' and cpu == get_host_cpu()
+    return False
+
+
+def run_benchmark(executable: str, output_json: str, max_size: Optional[int] = None, min_time: Optional[float] = None,
+                  env: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """Run the benchmark executable, write its results into `output_json` and print a summary
+
+    Args:
+        executable (str): Path of `gbe_benchmark`
+        output_json (str): Path of the JSON results
+        max_size (Optional[int]): Largest input size in bytes, defaults to the executable's default
+        min_time (Optional[float]): Min seconds of each case, defaults to the executable's default
+        env (Optional[Dict[str, str]]): Environment of the executable, defaults to the current one
+
+    Returns:
+        Dict[str, Any]: The JSON results
+    """
+    if os.path.dirname(output_json):
+        os.makedirs(os.path.dirname(output_json), exist_ok=True)
+    cmd = [executable, '--json', output_json]
+    if max_size is not None:
+        cmd += ['--max-size', str(max_size)]
+    if min_time is not None:
+        cmd += ['--min-time', str(min_time)]
+
+    print('\n[*] Execute command: {}'.format(' '.join(cmd)))
+    subprocess.check_call(cmd, env=env)
+    with open(output_json, 'r') as fr:
+        results = json.load(fr)
+    print_summary(results)
+    print('[*] Benchmark results: {}'.format(output_json))
+    return results
+
+
+def print_summary(results: Dict[str, Any]):
+    rows: List[List[str]] = [['name', 'size', 'iterations', 'ns/op', 'MB/s']]
+    for result in results['results']:
+        rows.append([
+            result['name'],
+            str(result['size']),
+            str(result['iterations']),
+            '{:.1f}'.format(result['ns_per_op']),
+            '{:.1f}'.format(result['mb_per_s']) if result['size'] else '-',
+        ])
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    print('')
+    for row in rows:
+        print('[*] ' + '  '.join(cell.ljust(width) if i == 0 else cell.rjust(width) for i, (cell, width) in enumerate(zip(row, widths))))
@@ -0,0 +1,473 @@
+#!/usr/bin/env python3
+# Copyright © 2021 Patrick Fu.
+
+import os
+import sys
+import json
+import struct
+import argparse
+from typing import Any, Dict, List, Optional, Tuple
+
+"""
+Size analysis of the built libraries (ELF, Mach-O, universal binaries and ar archives):
+per section, per object file and per symbol, and the diff against a baseline report.
+
+    python3 buildscripts/binsize.py report path/to/libGNBuildExample.so --json binsize.json
+    python3 buildscripts/binsize.py diff baseline.json binsize.json
+
+Check the parsers against the checked-in fixtures (see buildscripts/testdata/binsize/generate.sh):
+
+    python3 buildscripts/binsize.py report buildscripts/testdata/binsize/*.[oa] --baseline buildscripts/testdata/binsize/expected.json --check
+"""
+
+REPORT_VERSION = 1
+
+# ELF e_machine and Mach-O cputype, to GN cpu names
+_ELF_MACHINES = {3: 'x86', 40: 'arm', 62: 'x64', 183: 'arm64'}
+_MACHO_CPU_TYPES = {7: 'x86', 0x01000007: 'x64', 12: 'arm', 0x0100000c: 'arm64', 0x0200000c: 'arm64_32'}
+
+_AR_MAGIC = b'!<arch>\n'
+_ELF_MAGIC = b'\x7fELF'
+_FAT_MAGICS = (b'\xca\xfe\xba\xbe', b'\xca\xfe\xba\xbf')
+_MACHO_MAGICS = {
+    b'\xce\xfa\xed\xfe': ('<', False),
+    b'\xcf\xfa\xed\xfe': ('<', True),
+    b'\xfe\xed\xfa\xce': ('>', False),
+    b'\xfe\xed\xfa\xcf': ('>', True),
+}
+
+# Input sections of `-ffunction-sections`/`-fdata-sections` objects, named like the output sections they are linked into
+_ELF_OUTPUT_SECTIONS = ['.data.rel.ro', '.text', '.rodata', '.data', '.bss', '.tdata', '.tbss']
+_ELF_OUTPUT_SECTIONS += ['.rela' + x for x in _ELF_OUTPUT_SECTIONS] + ['.rel' + x for x in _ELF_OUTPUT_SECTIONS]
+
+_SHT_SYMTAB = 2
+_SHT_DYNSYM = 11
+_SHF_ALLOC = 0x2
+_SHN_COMMON = 0xfff2
+_SHN_LORESERVE = 0xff00
+
+_LC_SEGMENT = 0x1
+_LC_SYMTAB = 0x2
+_LC_SEGMENT_64 = 0x19
+_N_STAB = 0xe0
+_N_PEXT = 0x10
+_N_TYPE = 0x0e
+_N_SECT = 0x0e
+_N_EXT = 0x01
+
+
+def parse_binary(path: str) -> Dict[str, Dict[str, Any]]:
+    """Sizes of a library, executable or object file
+
+    Returns:
+        Dict[str, Dict[str, Any]]: {arch: info}, one arch unless it is a universal binary. The info is
+            {
+                'format': 'elf' | 'mach-o' | 'ar',
+                'file_size': bytes in the file,
+                'size': bytes of the sections loaded into memory (debug info excluded),
+                'sections': {name: bytes},
+                'objects': {object file name: loaded bytes}, the members of an ar archive,
+                'symbols': {name: bytes},
+                'exported_symbols': count of the defined symbols visible outside the binary
+            }
+    """
+    with open(path, 'rb') as fr:
+        data = fr.read()
+    archs = _parse(data)
+    if archs is None:
+        raise Exception('Unknown binary format: {}.'.format(path))
+    return archs
+
+
+def make_report(binaries: Dict[str, str], properties: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Report of several binaries
+
+    Args:
+        binaries (Dict[str, str]): {name: path}, slices of universal binaries are named '<name>-<arch>'
+        properties (Optional[Dict[str, Any]]): Extra info of the report, e.g. the build variant
+    """
+    report: Dict[str, Any] = {'version': REPORT_VERSION, 'properties': properties or {}, 'binaries': {}}
+    for name, path in binaries.items():
+        archs = parse_binary(path)
+        for arch, info in archs.items():
+            info['arch'] = arch
+            info['path'] = path
+            report['binaries'][name if len(archs) == 1 else '{0}-{1}'.format(name, arch)] = info
+    return report
+
+
+def read_report(path: str) -> Dict[str, Any]:
+    with open(path, 'r') as fr:
+        report = json.load(fr)
+    if report.get('version') != REPORT_VERSION:
+        raise Exception('Unsupported binary size report version: {}.'.format(report.get('version')))
+    return report
+
+
+def write_report(path: str, report: Dict[str, Any]):
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'w') as fw:
+        json.dump(report, fw, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def diff_reports(baseline: Dict[str, Any], current: Dict[str, Any]) -> Dict[str, Any]:
+    """Changes of the binaries of `current` since `baseline`
+
+    Returns:
+        Dict[str, Any]: {'binaries': {name: diff}}, where a diff is {'status': 'added' | 'removed'}, or
+            {'status': 'changed' | 'unchanged', 'size': {'old', 'new', 'delta'}, ...} with the changed
+            sections/objects/symbols, largest growth first
+    """
+    binaries: Dict[str, Any] = {}
+    for name in sorted(set(baseline['binaries']) | set(current['binaries'])):
+        old = baseline['binaries'].get(name)
+        new = current['binaries'].get(name)
+        if old is None or new is None:
+            binaries[name] = {'status': 'added' if old is None else 'removed'}
+            continue
+        diff: Dict[str, Any] = {}
+        for key in ('file_size', 'size', 'exported_symbols'):
+            diff[key] = {'old': old[key], 'new': new[key], 'delta': new[key] - old[key]}
+        for key in ('sections', 'objects', 'symbols'):
+            changes = []
+            for item in set(old[key]) | set(new[key]):
+                delta = new[key].get(item, 0) - old[key].get(item, 0)
+                if delta:
+                    changes.append((item, {'old': old[key].get(item, 0), 'new': new[key].get(item, 0), 'delta': delta}))
+            changes.sort(key=lambda x: (-x[1]['delta'], x[0]))
+            diff[key] = dict(changes)
+        changed = any(diff[key]['delta'] for key in ('file_size', 'size', 'exported_symbols')) or any(diff[key] for key in ('sections', 'objects', 'symbols'))
+        diff['status'] = 'changed' if changed else 'unchanged'
+        binaries[name] = diff
+    return {'version': REPORT_VERSION, 'binaries': binaries}
+
+
+def print_report(report: Dict[str, Any]):
+    rows: List[List[str]] = [['binary', 'format', 'file size', 'loaded size', 'exported', 'largest section']]
+    for name, info in report['binaries'].items():
+        sections = sorted(info['sections'].items(), key=lambda x: -x[1])
+        rows.append([
+            name,
+            info['format'],
+            _format_size(info['file_size']),
+            _format_size(info['size']),
+            str(info['exported_symbols']),
+            '{0} ({1})'.format(sections[0][0], _format_size(sections[0][1])) if sections else '-',
+        ])
+    _print_table(rows)
+
+
+def print_diff(diff: Dict[str, Any], top: int = 10):
+    """Print the size changes of every binary, and its `top` largest changes of sections/objects/symbols"""
+    for name, binary in diff['binaries'].items():
+        if binary['status'] != 'changed':
+            print('\n[*] {0}: {1}'.format(name, binary['status']))
+            continue
+        size = binary['size']
+        print('\n[*] {0}: loaded size {1} -> {2} ({3}), file size {4}'.format(
+            name, _format_size(size['old']), _format_size(size['new']), _format_delta(size['delta'], size['old']),
+            _format_delta(binary['file_size']['delta'], binary['file_size']['old'])))
+        rows: List[List[str]] = []
+        for key in ('sections', 'objects', 'symbols'):
+            changes = sorted(binary[key].items(), key=lambda x: -abs(x[1]['delta']))[:top]
+            rows.extend([key[:-1], item, _format_size(change['old']), _format_size(change['new']), _format_delta(change['delta'], change['old'])]
+                        for item, change in changes)
+        if rows:
+            _print_table([['', 'name', 'old', 'new', 'delta']] + rows)
+
+
+def get_size_growth(diff: Dict[str, Any]) -> Dict[str, int]:
+    """Growth of the loaded size in bytes, of the binaries which grew"""
+    return {name: binary['size']['delta'] for name, binary in diff['binaries'].items()
+            if binary['status'] == 'changed' and binary['size']['delta'] > 0}
+
+
+def _new_info(binary_format: str, file_size: int) -> Dict[str, Any]:
+    return {'format': binary_format, 'file_size': file_size, 'size': 0, 'sections': {}, 'objects': {}, 'symbols': {}, 'exported_symbols': 0}
+
+
+def _parse(data: bytes) -> Optional[Dict[str, Dict[str, Any]]]:
+    """{arch: info} of a binary, None if the format is unknown"""
+    if data.startswith(_AR_MAGIC):
+        return _parse_ar(data)
+    if data[:4] in _FAT_MAGICS:
+        return _parse_fat(data)
+    parsed = _parse_object(data)
+    if parsed is None:
+        return None
+    arch, info = parsed
+    return {arch: info}
+
+
+def _parse_object(data: bytes) -> Optional[Tuple[str, Dict[str, Any]]]:
+    if data.startswith(_ELF_MAGIC):
+        return _parse_elf(data)
+    if data[:4] in _MACHO_MAGICS:
+        return _parse_macho(data)
+    return None
+
+
+def _parse_fat(data: bytes) -> Dict[str, Dict[str, Any]]:
+    """Slices of a universal binary, each one can be a Mach-O file or an ar archive"""
+    is_64 = data[:4] == _FAT_MAGICS[1]
+    nfat_arch, = struct.unpack_from('>I', data, 4)
+    archs = {}
+    for i in range(nfat_arch):
+        if is_64:
+            cputype, _, offset, size, _, _ = struct.unpack_from('>iiQQII', data, 8 + i * 32)
+        else:
+            cputype, _, offset, size, _ = struct.unpack_from('>iiIII', data, 8 + i * 20)
+        arch = _MACHO_CPU_TYPES.get(cputype, 'cputype-{}'.format(cputype))
+        parsed = _parse(data[offset:offset + size])
+        if parsed is not None:
+            archs[arch] = next(iter(parsed.values()))
+    return archs
+
+
+def _parse_ar(data: bytes) -> Dict[str, Dict[str, Any]]:
+    """Members of a GNU or BSD ar archive, summed per arch"""
+    members: List[Tuple[str, Optional[str], Dict[str, Any]]] = []
+    long_names = b''
+    pos = len(_AR_MAGIC)
+    while pos + 60 <= len(data):
+        header = data[pos:pos + 60]
+        name = header[:16].decode('utf8', errors='replace').rstrip()
+        size = int(header[48:58].decode('ascii').strip())
+        body = data[pos + 60:pos + 60 + size]
+        pos += 60 + size + (size & 1)
+
+        if name.startswith('#1/'):
+            # BSD: the name follows the header
+            name_len = int(name[3:])
+            name = body[:name_len].rstrip(b'\0').decode('utf8', errors='replace')
+            body = body[name_len:]
+        if name in ('/', '/SYM64/') or name.startswith('__.SYMDEF'):
+            continue
+        if name == '//':
+            long_names = body
+            continue
+        if name.startswith('/') and name[1:].isdigit():
+            # GNU: offset into the long names, which end with '/\n'
+            start = int(name[1:])
+            name = long_names[start:long_names.find(b'/\n', start)].decode('utf8', errors='replace')
+        elif name.endswith('/'):
+            name = name[:-1]
+
+        parsed = _parse_object(body)
+        if parsed is None:
+            # e.g. LLVM bitcode of LTO builds, counted by its file size
+            info = _new_info('unknown', len(body))
+            info['size'] = len(body)
+            members.append((name, None, info))
+        else:
+            members.append((name, parsed[0], parsed[1]))
+
+    known_archs = sorted(set(arch for _, arch, _ in members if arch is not None))
+    archs: Dict[str, Dict[str, Any]] = {}
+    for name, arch, info in members:
+        arch = arch or (known_archs[0] if len(known_archs) == 1 else 'unknown')
+        total = archs.setdefault(arch, _new_info('ar', len(data)))
+        total['size'] += info['size']
+        total['exported_symbols'] += info['exported_symbols']
+        total['objects'][name] = total['objects'].get(name, 0) + info['size']
+        for key in ('sections', 'symbols'):
+            for item, size in info[key].items():
+                total[key][item] = total[key].get(item, 0) + size
+    return archs
+
+
+def _parse_elf(data: bytes) -> Tuple[str, Dict[str, Any]]:
+    is_64 = data[4] == 2
+    endian = '<' if data[5] == 1 else '>'
+    if is_64:
+        header_format, section_format, symbol_format = 'HHIQQQIHHHHHH', 'IIQQQQIIQQ', 'IBBHQQ'
+    else:
+        header_format, section_format, symbol_format = 'HHIIIIIHHHHHH', 'IIIIIIIIII', 'IIIBBH'
+    _, machine, _, _, _, shoff, _, _, _, _, shentsize, shnum, shstrndx = struct.unpack_from(endian + header_format, data, 16)
+    info = _new_info('elf', len(data))
+    arch = _ELF_MACHINES.get(machine, 'machine-{}'.format(machine))
+    if shoff == 0:
+        return arch, info
+
+    # (sh_name, sh_type, sh_flags, sh_addr, sh_offset, sh_size, sh_link, sh_info, sh_addralign, sh_entsize)
+    first = struct.unpack_from(endian + section_format, data, shoff)
+    # Too many sections for the header, the counts are in the first section
+    shnum = shnum or first[5]
+    shstrndx = first[6] if shstrndx == 0xffff else shstrndx
+    sections = [struct.unpack_from(endian + section_format, data, shoff + i * shentsize) for i in range(shnum)]
+    names = [_read_string(data, sections[shstrndx][4] + x[0]) for x in sections]
+
+    for name, section in zip(names[1:], sections[1:]):
+        name = next((x for x in _ELF_OUTPUT_SECTIONS if name.startswith(x + '.')), name)
+        info['sections'][name] = info['sections'].get(name, 0) + section[5]
+        if section[2] & _SHF_ALLOC:
+            info['size'] += section[5]
+
+    def __read_symbols(sh_type: int) -> List[Tuple[str, int, int, int]]:
+        """(name, size, bind, visibility) of the defined symbols"""
+        symbols = []
+        symbol_size = struct.calcsize(endian + symbol_format)
+        for symtab in [x for x in sections if x[1] == sh_type]:
+            strtab_offset = sections[symtab[6]][4]
+            for offset in range(symtab[4] + symbol_size, symtab[4] + symtab[5], symtab[9] or symbol_size):
+                if is_64:
+                    st_name, st_info, st_other, st_shndx, _, st_size = struct.unpack_from(endian + symbol_format, data, offset)
+                else:
+                    st_name, _, st_size, st_info, st_other, st_shndx = struct.unpack_from(endian + symbol_format, data, offset)
+                # Skip the undefined and absolute symbols, and the section/file names
+                if st_shndx == 0 or (st_shndx >= _SHN_LORESERVE and st_shndx != _SHN_COMMON) or st_info & 0xf in (3, 4):
+                    continue
+                symbols.append((_read_string(data, strtab_offset + st_name), st_size, st_info >> 4, st_other & 0x3))
+        return symbols
+
+    # .symtab has all symbols unless stripped, .dynsym has the exported ones
+    symbols = __read_symbols(_SHT_SYMTAB) or __read_symbols(_SHT_DYNSYM)
+    for name, size, _, _ in symbols:
+        if name and size:
+            info['symbols'][name] = info['symbols'].get(name, 0) + size
+    # Global or weak, with default or protected visibility
+    exported = __read_symbols(_SHT_DYNSYM) or symbols
+    info['exported_symbols'] = sum(1 for _, _, bind, visibility in exported if bind in (1, 2) and visibility in (0, 3))
+    return arch, info
+
+
+def _parse_macho(data: bytes) -> Tuple[str, Dict[str, Any]]:
+    endian, is_64 = _MACHO_MAGICS[data[:4]]
+    cputype, _, _, ncmds, _, _ = struct.unpack_from(endian + 'iIIIII', data, 4)
+    info = _new_info('mach-o', len(data))
+    arch = _MACHO_CPU_TYPES.get(cputype, 'cputype-{}'.format(cputype))
+
+    # (segname, sectname, addr, size), in the order of their 1-based section numbers
+    sections: List[Tuple[str, str, int, int]] = []
+    symtab = None
+    pos = 32 if is_64 else 28
+    for _ in range(ncmds):
+        cmd, cmdsize = struct.unpack_from(endian + 'II', data, pos)
+        if cmd in (_LC_SEGMENT, _LC_SEGMENT_64):
+            if cmd == _LC_SEGMENT_64:
+                nsects, = struct.unpack_from(endian + 'I', data, pos + 64)
+                section_start, section_size, section_format = pos + 72, 80, '16s16sQQ'
+            else:
+                nsects, = struct.unpack_from(endian + 'I', data, pos + 48)
+                section_start, section_size, section_format = pos + 56, 68, '16s16sII'
+            for i in range(nsects):
+                sectname, segname, addr, size = struct.unpack_from(endian + section_format, data, section_start + i * section_size)
+                sections.append((_decode_name(segname), _decode_name(sectname), addr, size))
+        elif cmd == _LC_SYMTAB:
+            symtab = struct.unpack_from(endian + 'IIII', data, pos + 8)
+        pos += cmdsize
+
+    for segname, sectname, _, size in sections:
+        name = '{0},{1}'.format(segname, sectname)
+        info['sections'][name] = info['sections'].get(name, 0) + size
+        if segname != '__DWARF':
+            info['size'] += size
+
+    if symtab is None:
+        return arch, info
+    symoff, nsyms, stroff, _ = symtab
+    nlist_format, nlist_size = (endian + 'IBBHQ', 16) if is_64 else (endian + 'IBBHI', 12)
+    defined = []
+    for i in range(nsyms):
+        n_strx, n_type, n_sect, _, n_value = struct.unpack_from(nlist_format, data, symoff + i * nlist_size)
+        if n_type & _N_STAB or n_type & _N_TYPE != _N_SECT or not 0 < n_sect <= len(sections):
+            continue
+        name = _read_string(data, stroff + n_strx)
+        # Real symbols first, then the assembler temp labels ('l_.str'), then the section start labels ('ltmp0')
+        rank = 0 if not name.startswith(('l', 'L')) else 2 if name.startswith('ltmp') else 1
+        defined.append((n_sect, n_value, rank, name))
+        if n_type & _N_EXT and not n_type & _N_PEXT:
+            info['exported_symbols'] += 1
+
+    # Mach-O symbols have no size, the first symbol of an address spans to the next address of its section
+    defined.sort()
+    for i, (n_sect, n_value, _, name) in enumerate(defined):
+        if i > 0 and defined[i - 1][:2] == (n_sect, n_value):
+            continue
+        _, _, addr, size = sections[n_sect - 1]
+        end = addr + size
+        following = next((x for x in defined[i + 1:] if x[:2] != (n_sect, n_value)), None)
+        if following is not None and following[0] == n_sect:
+            end = min(end, following[1])
+        if end > n_value:
+            info['symbols'][name] = info['symbols'].get(name, 0) + end - n_value
+    return arch, info
+
+
+def _read_string(data: bytes, offset: int) -> str:
+    end = data.find(b'\0', offset)
+    return data[offset:end if end >= 0 else len(data)].decode('utf8', errors='replace')
+
+
+def _decode_name(name: bytes) -> str:
+    return name.rstrip(b'\0').decode('utf8', errors='replace')
+
+
+def _format_size(size: int) -> str:
+    if abs(size) < 1024:
+        return '{} B'.format(size)
+    return '{:.1f} KB'.format(size / 1024)
+
+
+def _format_delta(delta: int, old: int) -> str:
+    text = '{0}{1}'.format('+' if delta > 0 else '-' if delta < 0 else '', _format_size(abs(delta)))
+    return '{0} ({1:+.1%})'.format(text, delta / old) if old else text
+
+
+def _print_table(rows: List[List[str]]):
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    print('')
+    for row in rows:
+        print('[*] ' + '  '.join(cell.ljust(width) if i < 2 else cell.rjust(width) for i, (cell, width) in enumerate(zip(row, widths))))
+
+
+def __parse_args(args):
+    parser = argparse.ArgumentParser(description='Binary size report of libraries, executables and object files.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    report = subparsers.add_parser('report', help='Report the section/object/symbol sizes of binaries.')
+    report.add_argument('binaries', type=str, nargs='+', help='ELF/Mach-O/universal binaries or ar archives.')
+    report.add_argument('--json', type=str, default=None, metavar='PATH', help='Write the report into a JSON file.')
+    report.add_argument('--baseline', type=str, default=None, metavar='PATH', help='Print the diff against this report.')
+    report.add_argument('--check', default=False, action='store_true', help='Exit with 1 if a binary differs from the baseline, e.g. to check the parsers against the fixtures.')
+    diff = subparsers.add_parser('diff', help='Diff two JSON reports.')
+    diff.add_argument('baseline', type=str, help='The baseline report.')
+    diff.add_argument('current', type=str, help='The current report.')
+    diff.add_argument('--json', type=str, default=None, metavar='PATH', help='Write the diff into a JSON file.')
+    for subparser in (report, diff):
+        subparser.add_argument('--top', type=int, default=10, help='Largest changes printed of each binary.')
+    return parser.parse_args(args[1:])
+
+
+def main(argv):
+    args = __parse_args(argv)
+    if args.command == 'report':
+        current = make_report({os.path.basename(x): x for x in args.binaries})
+        print_report(current)
+        if args.json:
+            write_report(args.json, current)
+            print('\n[*] Binary size report: {}'.format(args.json))
+        if not args.baseline:
+            return 0
+        baseline = read_report(args.baseline)
+    else:
+        baseline = read_report(args.baseline)
+        current = read_report(args.current)
+
+    diff = diff_reports(baseline, current)
+    print_diff(diff, args.top)
+    if args.command == 'diff' and args.json:
+        write_report(args.json, diff)
+        print('\n[*] Binary size diff: {}'.format(args.json))
+    if args.command == 'report' and args.check:
+        changed = [name for name, binary in diff['binaries'].items() if binary['status'] != 'unchanged']
+        if changed:
+            print('\n[*] Check failed, differ from {0}: {1}'.format(args.baseline, ', '.join(changed)))
+            return 1
+        print('\n[*] Check success: {}'.format(args.baseline))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
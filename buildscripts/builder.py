@@ -3,9 +3,13 @@
 
 import os
 import sys
+import json
 import shutil
+import hashlib
+import plistlib
 import subprocess
-from typing import List
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
 
 """
 Script for build all platforms.
@@ -16,6 +20,17 @@ PROJ_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(PROJ_ROOT)
 
 from buildscripts.utils import get_out_dir, get_abi_from_cpu
+from buildscripts.scheduler import CommandRunner, JobScheduler, get_jobs_per_task
+from buildscripts.telemetry import get_telemetry
+from buildscripts.zipcache import hash_file
+from buildscripts.artifact_cache import ArtifactCache
+from buildscripts import gn
+from buildscripts import compiler_cache
+from buildscripts import benchmark
+from buildscripts import binsize
+
+# Hashes of the lipo and XCFramework inputs, kept next to the XCFramework
+XCFRAMEWORK_STAMP = 'gbe_xcframework.stamp.json'
 
 
 class Builder():
@@ -27,26 +42,101 @@ class Builder():
         self.cpu_list: List[str] = []
         self.build_lang = 'c'
         self.only_gen = False
+        self.parallel_archs = 1
         self.version: str = 'unknown'
-        self.common_args = [
-            '--build-type', build_type,
-            '--target-os', target_os,
-            '--lib-type', lib_type
-        ]
+        self.compiler_cache: Optional[str] = None
+        # Archs skipped by the affected analysis, their previous outputs are reused
+        self.reused_cpus: List[str] = []
+        self.artifact_cache: Optional[ArtifactCache] = None
+        self.binsize_output: Optional[str] = None
+        self.binsize_baseline: Optional[str] = None
+        self.binsize_max_growth: Optional[int] = None
+        # Can be replaced by a stand-in script, e.g. to test on Linux
+        self.xcrun = os.environ.get('GBE_XCRUN', 'xcrun')
+        # Args of `gn.make_config` shared by all archs
+        self.gn_options: Dict[str, Any] = {
+            'build_type': build_type,
+            'target_os': target_os,
+            'lib_type': lib_type
+        }
 
     def set_version(self, version: str):
         self.version = version
-        self.common_args.extend(['--version', self.version])
+        self.gn_options['version'] = self.version
+
+    def set_reproducible_version(self, reproducible: bool):
+        self.gn_options['reproducible_version'] = reproducible
 
     def set_only_gen(self, only_gen: bool):
         self.only_gen = only_gen
         if self.only_gen:
             print('\n[*] Set only gen, do not build.')
-            self.common_args.append('--only-gen')
+        self.gn_options['only_gen'] = only_gen
+
+    def set_gn_check(self, gn_check: bool):
+        self.gn_options['gn_check'] = gn_check
+
+    def set_force_gen(self, force_gen: bool):
+        self.gn_options['force_gen'] = force_gen
+
+    def set_compiler_cache(self, cache_dir: Optional[str]):
+        self.compiler_cache = os.path.abspath(cache_dir) if cache_dir else None
+        self.gn_options['compiler_cache'] = self.compiler_cache
+
+    def set_artifact_cache(self, cache_dir: Optional[str], max_size: int = 0):
+        """Restore the outputs of unchanged arch builds from `cache_dir` instead of running gn/ninja
+
+        Args:
+            cache_dir (Optional[str]): Cache dir, can be shared by several out dirs, None to disable
+            max_size (int): Max cache size in bytes, least recently used entries are evicted
+        """
+        self.artifact_cache = ArtifactCache(os.path.abspath(cache_dir), max_size) if cache_dir else None
+
+    def set_affected(self, affected: bool):
+        """Only build the archs affected by the source changes since their last build"""
+        self.gn_options['affected'] = affected
+
+    def set_binsize(self, output_dir: Optional[str], baseline_dir: Optional[str] = None, max_growth: Optional[int] = None):
+        """Report the section/object/symbol sizes of the library of every arch after the build
+
+        Args:
+            output_dir (Optional[str]): Dir of the JSON report, None to disable
+            baseline_dir (Optional[str]): Dir of the baseline reports, the report of the same name is diffed
+            max_growth (Optional[int]): Fail if the loaded size of an arch grows by more bytes than the baseline
+        """
+        self.binsize_output = os.path.abspath(output_dir) if output_dir else None
+        self.binsize_baseline = os.path.abspath(baseline_dir) if baseline_dir else None
+        self.binsize_max_growth = max_growth
+
+    def set_bench(self, bench: bool):
+        self.gn_options['bench'] = bench
+
+    def set_base64_tool(self, base64_tool: bool):
+        self.gn_options['base64_tool'] = base64_tool
+
+    def set_jumbo(self, chunks: int):
+        """Unity build with up to `chunks` files per source_set and language, 0 to compile file by file"""
+        self.gn_options['jumbo'] = chunks
+
+    def set_pch(self, pch: bool):
+        self.gn_options['pch'] = pch
+
+    def set_lto(self, lto: Optional[str]):
+        self.gn_options['lto'] = lto
+
+    def set_pgo(self, instrument: bool = False, profile: Optional[str] = None):
+        """Instrumented build for training, or optimized build with the merged `profile`"""
+        self.gn_options['pgo_instrument'] = instrument
+        self.gn_options['pgo_profile'] = profile
 
     def set_cpu_list(self, cpu_list: List[str]):
         self.cpu_list = cpu_list
 
+    def set_parallel_archs(self, parallel_archs: int):
+        if parallel_archs < 1:
+            raise Exception('Parallel archs must be greater than 0.')
+        self.parallel_archs = parallel_archs
+
     def set_build_lang(self, lang: str):
         if lang == 'java' and self.target_os != 'android':
             raise Exception('Java build lang only available for Android.')
@@ -56,36 +146,216 @@ class Builder():
 
     def build(self):
         """
-        Invoke the ./gn.py to run `gn gen` and `ninja` build
+        Invoke `gn.generate_and_build` to run `gn gen` and `ninja` build
         """
         print('\n[*] Start building {0} {1}...'.format(self.target_os, self.build_type))
-        for cpu in self.cpu_list:
-            print('\n[*] Build arch {0} for {1} {2}...'.format(cpu, self.target_os, self.build_type))
-            build_cmd = [sys.executable, '-u', os.path.join(PROJ_ROOT, 'buildscripts', 'gn.py')]
-            build_cmd.extend(self.common_args)
-            build_cmd += ['--{0}-cpu'.format(self.target_os), cpu]
-            build_cmd += ['--{0}-lang'.format(self.target_os), self.build_lang]
-            print('\n[*] Execute command: {}'.format(' '.join(build_cmd)))
-            subprocess.check_call(build_cmd)
+        if self.compiler_cache:
+            print('\n[*] Use compiler cache: {}'.format(self.compiler_cache))
+            stats_offset = compiler_cache.get_stats_offset(self.compiler_cache)
+        self.reused_cpus = []
+        parallel = min(self.parallel_archs, len(self.cpu_list))
+        if parallel > 1:
+            self._build_archs_in_parallel(parallel)
+        else:
+            for cpu in self.cpu_list:
+                print('\n[*] Build arch {0} for {1} {2}...'.format(cpu, self.target_os, self.build_type))
+                self._build_arch(cpu, self._get_arch_config(cpu))
+
+        self.create_products()
+        self.analyze_binary_size()
 
+        if self.compiler_cache:
+            self._report_compiler_cache(stats_offset)
+
+        if self.artifact_cache is not None and not self.only_gen:
+            self.artifact_cache.report()
+            self.artifact_cache.evict()
+
+        self._print_success()
+
+    def create_products(self):
+        """
+        Create the final products (e.g. XCFramework) from the built archs
+        """
         if not self.only_gen:
             if self.target_os == 'ios' or self.target_os == 'mac':
                 print('\n[*] Creating Darwin XCFramework...')
                 self._create_darwin_xcframework()
 
+    def analyze_binary_size(self):
+        """
+        Write the binary size report of the built archs, and diff it against the baseline, see `set_binsize`
+        """
+        if self.binsize_output is None or self.only_gen:
+            return
+        binaries = OrderedDict()
+        for cpu in self.cpu_list:
+            binary = self._get_arch_binary(cpu)
+            if binary is not None and os.path.exists(binary):
+                binaries[cpu] = os.path.relpath(binary, PROJ_ROOT)
+        if not binaries:
+            print('\n[*] No library of {0} {1} to analyze, skip binary size report.'.format(self.target_os, self.lib_type))
+            return
+
+        report_name = 'binsize-{0}-{1}-{2}-{3}.json'.format(self.target_os, self.lib_type, self.build_lang, self.build_type)
+        report_path = os.path.join(self.binsize_output, report_name)
+        baseline_path = os.path.join(self.binsize_baseline, report_name) if self.binsize_baseline else None
+        # Read first, the baseline dir can be the output dir of the previous build
+        baseline = binsize.read_report(baseline_path) if baseline_path and os.path.exists(baseline_path) else None
+
+        print('\n[*] Analyze binary size of {0} {1} {2}...'.format(self.target_os, self.lib_type, self.build_lang))
+        with get_telemetry().phase('binsize', target_os=self.target_os, lib_type=self.lib_type, build_lang=self.build_lang):
+            report = binsize.make_report(binaries, {
+                'target_os': self.target_os,
+                'lib_type': self.lib_type,
+                'build_lang': self.build_lang,
+                'build_type': self.build_type,
+                'version': self.version,
+            })
+        binsize.print_report(report)
+
+        if baseline is not None:
+            diff = binsize.diff_reports(baseline, report)
+            binsize.print_diff(diff)
+            diff_path = os.path.join(self.binsize_output, report_name[:-len('.json')] + '.diff.json')
+            binsize.write_report(diff_path, diff)
+            print('\n[*] Binary size diff: {}'.format(diff_path))
+            growth = binsize.get_size_growth(diff)
+            if self.binsize_max_growth is not None and any(x > self.binsize_max_growth for x in growth.values()):
+                # The report is not written, a baseline in the output dir keeps failing until the growth is fixed
+                raise Exception('Binary size grew by more than {0} bytes: {1}.'.format(
+                    self.binsize_max_growth, ', '.join('{0} +{1}'.format(name, x) for name, x in growth.items())))
+        elif baseline_path:
+            print('\n[*] No baseline report: {}'.format(baseline_path))
+
+        binsize.write_report(report_path, report)
+        print('\n[*] Binary size report: {}'.format(report_path))
+
+    def is_reused(self) -> bool:
+        """Whether no arch was built because none is affected, see `set_affected`
+
+        The reused outputs keep the version of the build which produced them.
+        """
+        return bool(self.cpu_list) and set(self.reused_cpus) == set(self.cpu_list)
+
+    def get_benchmark_executables(self) -> List[Tuple[str, str]]:
+        """(cpu, path) of the benchmark executables which can run on this host"""
+        executables = []
+        for cpu in self.cpu_list:
+            if benchmark.can_run_on_host(self.target_os, cpu):
+                out_dir = get_out_dir(self.build_type, self.target_os, self.lib_type, self.build_lang, cpu)
+                executables.append((cpu, os.path.join(out_dir, benchmark.BENCHMARK_EXECUTABLE)))
+        return executables
+
+    def get_matrix_config(self, lib_types: List[str], jobs: int = 0):
+        """Config of a matrix build, all archs of this builder and `lib_types` in one out dir"""
+        options = dict(self.gn_options)
+        options['{}_cpu'.format(self.target_os)] = self.cpu_list[0]
+        options['{}_lang'.format(self.target_os)] = self.build_lang
+        options['matrix_cpus'] = self.cpu_list
+        options['matrix_lib_types'] = lib_types
+        options['jobs'] = jobs
+        return gn.make_config(**options)
+
+    def _print_success(self):
         print('\n[*] {0} {1} {2} success!'.format(
             'Build' if not self.only_gen else 'Only gen',
              self.target_os,
              self.build_type
         ))
 
+    def _get_arch_config(self, cpu: str, jobs: int = 0):
+        options = dict(self.gn_options)
+        options['{}_cpu'.format(self.target_os)] = cpu
+        options['{}_lang'.format(self.target_os)] = self.build_lang
+        options['jobs'] = jobs
+        return gn.make_config(**options)
+
+    def _get_arch_outputs(self) -> List[str]:
+        """Outputs of an arch out dir used by the later steps (lipo, XCFramework, archive, benchmark)"""
+        outputs = []
+        if self.target_os == 'ios' or self.target_os == 'mac':
+            if self.lib_type == 'shared':
+                outputs += ['{}.framework'.format(self.proj_name), '{}.dSYM'.format(self.proj_name)]
+            else:
+                outputs += ['lib{}.a'.format(self.proj_name), 'include']
+        elif self.target_os == 'linux':
+            outputs += ['lib{0}.{1}'.format(self.proj_name, 'so' if self.lib_type == 'shared' else 'a'), 'include']
+        if self.gn_options.get('bench'):
+            outputs.append(benchmark.BENCHMARK_EXECUTABLE)
+        if self.gn_options.get('base64_tool'):
+            outputs.append('gbe_base64')
+        return outputs
+
+    def _get_arch_binary(self, cpu: str) -> Optional[str]:
+        """Path of the library binary of an arch, None if the target OS has no library output"""
+        out_dir = get_out_dir(self.build_type, self.target_os, self.lib_type, self.build_lang, cpu)
+        if self.target_os == 'ios' or self.target_os == 'mac':
+            if self.lib_type == 'shared':
+                return os.path.join(out_dir, '{0}.framework'.format(self.proj_name), self.proj_name)
+            return os.path.join(out_dir, 'lib{}.a'.format(self.proj_name))
+        elif self.target_os == 'linux':
+            return os.path.join(out_dir, 'lib{0}.{1}'.format(self.proj_name, 'so' if self.lib_type == 'shared' else 'a'))
+        return None
+
+    def _build_arch(self, cpu: str, config, runner: Optional[CommandRunner] = None):
+        runner = runner or CommandRunner()
+        out_dir = get_out_dir(self.build_type, self.target_os, self.lib_type, self.build_lang, cpu)
+        outputs = self._get_arch_outputs()
+        key = None
+        if self.artifact_cache is not None and not self.only_gen and outputs:
+            with get_telemetry().phase('artifact_cache', cpu=cpu):
+                key = self.artifact_cache.get_key(gn.get_output_args(config), os.path.dirname(gn.get_buildtool('gn')),
+                                                  self.artifact_cache.get_compiler_id(self.target_os, self.xcrun))
+                if os.path.islink(out_dir) and self.artifact_cache.has(key):
+                    # Linked into a matrix out dir by a previous matrix build
+                    os.remove(out_dir)
+                if self.artifact_cache.restore(key, out_dir):
+                    runner.log('\n[*] Restored the outputs of {0} from the artifact cache: {1}'.format(cpu, ', '.join(outputs)))
+                    return
+
+        if not gn.generate_and_build(config, runner):
+            self.reused_cpus.append(cpu)
+        if key is not None:
+            with get_telemetry().phase('artifact_cache', cpu=cpu):
+                if not self.artifact_cache.put(key, out_dir, outputs):
+                    runner.log('\n[*] Missing outputs of {0}, not stored in the artifact cache.'.format(cpu))
+
+    def _build_archs_in_parallel(self, parallel: int):
+        """
+        Run `gn gen` and `ninja` of several archs at the same time,
+        the ninja `-j` budget of the machine is split across the running archs.
+        """
+        jobs = get_jobs_per_task(parallel)
+        print('\n[*] Build {0} archs in parallel ({1} at a time, ninja -j{2} each)...'.format(
+            len(self.cpu_list), parallel, jobs))
+        scheduler = JobScheduler(parallel)
+        for cpu in self.cpu_list:
+            config = self._get_arch_config(cpu, jobs)
+            scheduler.add_job(cpu, lambda runner, cpu=cpu, config=config: self._build_arch(cpu, config, runner))
+        scheduler.run()
+
+    def _report_compiler_cache(self, stats_offset: int):
+        stats = compiler_cache.read_stats(self.compiler_cache, stats_offset)
+        cacheable = stats['hit'] + stats['miss']
+        print('\n[*] [CompilerCache] {0} hits, {1} misses ({2:.0%} hit rate), {3} uncacheable, {4} failed compiles'.format(
+            stats['hit'], stats['miss'], stats['hit'] / cacheable if cacheable else 0, stats['uncacheable'], stats['error']))
+
     def _create_darwin_xcframework(self):
         """
         Use xcrun to create XCFramework for iOS/macOS
+
+        The hashes of the inputs are kept in a stamp next to the XCFramework,
+        lipo and xcodebuild are skipped if nothing changed, and only the changed
+        slices are replaced if the set of slices is the same as the last time.
         """
         if self.target_os != 'ios' and self.target_os != 'mac':
             raise Exception('[_create_darwin_xcframework] only work for iOS/macOS.')
 
+        xcframework_dir = get_out_dir(self.build_type, self.target_os, self.lib_type, self.build_lang, 'xcframework')
+        stamp = self._read_xcframework_stamp(xcframework_dir)
+        new_stamp: Dict[str, Any] = {'lipo': {}, 'slices': {}}
+
         def __lipo_combine_binary(self, src_arch: str, dst_arch: str):
             """
             Use lipo to combine 'src_arch' binary into 'dst_arch' binary.
@@ -94,61 +364,249 @@ class Builder():
             binary_file = 'lib{}.a'.format(self.proj_name) if self.lib_type == 'static' else '{0}.framework/{0}'.format(self.proj_name)
 
             src_binary = os.path.join(get_out_dir(self.build_type, self.target_os, self.lib_type, self.build_lang, src_arch), binary_file)
-            dst_binary = os.path.join(get_out_dir(self.build_type, self.target_os, self.lib_type, self.build_lang, dst_arch), binary_file)
-
-            lipo_info_cmd = ['xcrun', 'lipo', '-info', dst_binary]
-            print('\n[*] Check binary\'s arch.')
-            print('[*] Execute command: {}'.format(' '.join(lipo_info_cmd)))
-            res = subprocess.check_output(lipo_info_cmd).decode('utf8').strip()
-            print(res)
-
-            # If dst binary does not contains 'src_arch', combine src binary into dst.
-            if get_abi_from_cpu(self.target_os, src_arch) not in res:
-                lipo_create_cmd = ['xcrun', 'lipo', '-create',
-                    src_binary, dst_binary,
-                    '-output', dst_binary
-                ]
+            # The binary of a macOS framework is a symlink into 'Versions/A', write the real file
+            dst_binary = os.path.realpath(os.path.join(get_out_dir(self.build_type, self.target_os, self.lib_type, self.build_lang, dst_arch), binary_file))
+            src_abi = get_abi_from_cpu(self.target_os, src_arch)
+
+            src_hash = hash_file(src_binary)
+            dst_hash = hash_file(dst_binary)
+            record = stamp['lipo'].get(dst_arch, {})
+            if record.get('src_arch') == src_arch and record.get('src') == src_hash and record.get('fat') == dst_hash:
+                print('\n[*] {0} and {1} binaries are unchanged, skip lipo.'.format(src_arch, dst_arch))
+                new_stamp['lipo'][dst_arch] = record
+                return
+
+            if record.get('src_arch') == src_arch and record.get('fat') == dst_hash:
+                # Only the src binary changed, the dst binary is still the combined one
+                has_src_arch = True
+            else:
+                lipo_info_cmd = [self.xcrun, 'lipo', '-info', dst_binary]
+                print('\n[*] Check binary\'s arch.')
+                print('[*] Execute command: {}'.format(' '.join(lipo_info_cmd)))
+                with get_telemetry().phase('lipo_info', cpu=dst_arch):
+                    res = subprocess.check_output(lipo_info_cmd).decode('utf8').strip()
+                print(res)
+                has_src_arch = src_abi in res.split(':')[-1].split()
+
+            # Write into a temp file then rename, never leave a half written binary.
+            tmp_binary = dst_binary + '.lipo.tmp'
+            if has_src_arch:
+                # Replace the (stale) 'src_arch' slice of the dst binary.
+                lipo_cmd = [self.xcrun, 'lipo', dst_binary, '-replace', src_abi, src_binary, '-output', tmp_binary]
+                print('\n[*] Replace {0} slice of {1} binary with lipo.'.format(src_arch, dst_arch))
+            else:
+                lipo_cmd = [self.xcrun, 'lipo', '-create', src_binary, dst_binary, '-output', tmp_binary]
                 print('\n[*] Combine {0} into {1} binary with lipo.'.format(src_arch, dst_arch))
-                print('[*] Execute command: {}'.format(' '.join(lipo_create_cmd)))
-                subprocess.check_call(lipo_create_cmd)
+            print('[*] Execute command: {}'.format(' '.join(lipo_cmd)))
+            with get_telemetry().phase('lipo_create', cpu=dst_arch):
+                subprocess.check_call(lipo_cmd)
+            os.replace(tmp_binary, dst_binary)
+            new_stamp['lipo'][dst_arch] = {'src_arch': src_arch, 'src': src_hash, 'fat': hash_file(dst_binary)}
+
+        # The archs combined into the binary of another arch, {dst: src}
+        combined_archs: Dict[str, str] = {}
 
         # Combine iOS armv7 into arm64 binary
         if self.target_os == 'ios' and 'arm' in self.cpu_list and 'arm64' in self.cpu_list:
             __lipo_combine_binary(self, 'arm', 'arm64')
+            combined_archs['arm64'] = 'arm'
 
         # Combine macOS arm64 into x86_64 binary
         if self.target_os == 'mac' and 'arm64' in self.cpu_list and 'x64' in self.cpu_list:
             __lipo_combine_binary(self, 'arm64', 'x64')
+            combined_archs['x64'] = 'arm64'
 
         # Create the XCFramework
-        xcframework_output = os.path.join(get_out_dir(self.build_type, self.target_os, self.lib_type, self.build_lang, 'xcframework'), '%s.xcframework' % self.proj_name)
-        if os.path.exists(xcframework_output):
-            shutil.rmtree(xcframework_output)
+        xcframework_output = os.path.join(xcframework_dir, '%s.xcframework' % self.proj_name)
 
-        xcframework_cmd = ['xcrun', 'xcodebuild', '-create-xcframework']
+        xcframework_cmd = [self.xcrun, 'xcodebuild', '-create-xcframework']
+        slice_inputs: Dict[str, List[str]] = OrderedDict()
         for cpu in self.cpu_list:
-            if self.target_os == 'ios' and cpu == 'arm':
-                continue # iOS arm have been combined into arm64 binary
-            if self.target_os == 'mac' and cpu == 'arm64':
-                continue # macOS arm64 have been combined into x64 binary
+            if cpu in combined_archs.values():
+                continue # Have been combined into the binary of another arch
 
             if self.lib_type == 'shared':
+                framework = os.path.join(get_out_dir(self.build_type, self.target_os, self.lib_type, self.build_lang, cpu), '{}.framework'.format(self.proj_name))
                 xcframework_cmd.extend([
                     '-framework',
-                    os.path.join(get_out_dir(self.build_type, self.target_os, self.lib_type, self.build_lang, cpu), '{}.framework'.format(self.proj_name))
+                    framework
                 ])
+                slice_inputs[cpu] = [framework]
             elif self.lib_type == 'static':
+                library = os.path.join(get_out_dir(self.build_type, self.target_os, self.lib_type, self.build_lang, cpu), 'lib{}.a'.format(self.proj_name))
+                headers = os.path.join(get_out_dir(self.build_type, self.target_os, self.lib_type, self.build_lang, cpu), 'include')
                 xcframework_cmd.extend([
                     '-library',
-                    os.path.join(get_out_dir(self.build_type, self.target_os, self.lib_type, self.build_lang, cpu), 'lib{}.a'.format(self.proj_name)),
+                    library,
                     '-headers',
-                    os.path.join(get_out_dir(self.build_type, self.target_os, self.lib_type, self.build_lang, cpu), 'include'),
+                    headers,
                 ])
+                slice_inputs[cpu] = [library, headers]
 
         xcframework_cmd.extend([
             '-output',
             xcframework_output
         ])
 
-        print('\n[*] Execute command: {}'.format(' '.join(xcframework_cmd)))
-        subprocess.check_call(xcframework_cmd)
+        slice_hashes = {cpu: _hash_paths(paths) for cpu, paths in slice_inputs.items()}
+        old_slices = stamp['slices']
+        if os.path.exists(xcframework_output) and stamp.get('lib_type') == self.lib_type \
+                and sorted(old_slices) == sorted(slice_hashes) and all(x.get('library_identifier') for x in old_slices.values()):
+            changed = [cpu for cpu in slice_hashes if old_slices[cpu]['hash'] != slice_hashes[cpu]]
+            if not changed:
+                print('\n[*] XCFramework inputs are unchanged, skip xcodebuild: {}'.format(xcframework_output))
+            for cpu in changed:
+                print('\n[*] Replace the {0} slice of XCFramework: {1}'.format(cpu, old_slices[cpu]['library_identifier']))
+                with get_telemetry().phase('xcframework_slice', cpu=cpu):
+                    self._replace_xcframework_slice(xcframework_output, old_slices[cpu], slice_inputs[cpu])
+            for cpu, slice_hash in slice_hashes.items():
+                new_stamp['slices'][cpu] = dict(old_slices[cpu], hash=slice_hash)
+        else:
+            if os.path.exists(xcframework_output):
+                shutil.rmtree(xcframework_output)
+
+            print('\n[*] Execute command: {}'.format(' '.join(xcframework_cmd)))
+            with get_telemetry().phase('xcodebuild'):
+                subprocess.check_call(xcframework_cmd)
+
+            libraries = self._read_xcframework_libraries(xcframework_output)
+            for cpu, slice_hash in slice_hashes.items():
+                abis = {get_abi_from_cpu(self.target_os, x) for x in [cpu, combined_archs.get(cpu)] if x}
+                matched = [x for x in libraries if set(x.get('SupportedArchitectures', [])) == abis]
+                new_stamp['slices'][cpu] = {
+                    'hash': slice_hash,
+                    # Unknown if not exactly one library matches, then the next change recreates the whole XCFramework
+                    'library_identifier': matched[0]['LibraryIdentifier'] if len(matched) == 1 else None,
+                    'library_path': matched[0].get('LibraryPath') if len(matched) == 1 else None,
+                    'headers_path': matched[0].get('HeadersPath') if len(matched) == 1 else None,
+                }
+
+        new_stamp['lib_type'] = self.lib_type
+        self._write_xcframework_stamp(xcframework_dir, new_stamp)
+
+    def _replace_xcframework_slice(self, xcframework_output: str, library: Dict[str, Any], inputs: List[str]):
+        """Copy the inputs of a slice over the same slice of an existing XCFramework"""
+        slice_dir = os.path.join(xcframework_output, library['library_identifier'])
+        dst_paths = [os.path.join(slice_dir, library['library_path'])]
+        if self.lib_type == 'static':
+            dst_paths.append(os.path.join(slice_dir, library['headers_path']))
+
+        for src, dst in zip(inputs, dst_paths):
+            if os.path.isdir(src):
+                if os.path.exists(dst):
+                    shutil.rmtree(dst)
+                shutil.copytree(src, dst, symlinks=True)
+            else:
+                shutil.copy2(src, dst + '.tmp')
+                os.replace(dst + '.tmp', dst)
+
+    @staticmethod
+    def _read_xcframework_libraries(xcframework_output: str) -> List[Dict[str, Any]]:
+        try:
+            with open(os.path.join(xcframework_output, 'Info.plist'), 'rb') as fr:
+                return plistlib.load(fr).get('AvailableLibraries', [])
+        except (OSError, ValueError, plistlib.InvalidFileException):
+            return []
+
+    @staticmethod
+    def _read_xcframework_stamp(xcframework_dir: str) -> Dict[str, Any]:
+        try:
+            with open(os.path.join(xcframework_dir, XCFRAMEWORK_STAMP), 'r') as fr:
+                stamp = json.load(fr)
+            if isinstance(stamp.get('lipo'), dict) and isinstance(stamp.get('slices'), dict):
+                return stamp
+        except (OSError, ValueError):
+            pass
+        return {'lipo': {}, 'slices': {}}
+
+    @staticmethod
+    def _write_xcframework_stamp(xcframework_dir: str, stamp: Dict[str, Any]):
+        os.makedirs(xcframework_dir, exist_ok=True)
+        with open(os.path.join(xcframework_dir, XCFRAMEWORK_STAMP), 'w') as fw:
+            json.dump(stamp, fw, indent=2)
+
+
+def _hash_paths(paths: List[str]) -> str:
+    """Hash the content of files and dir trees, symlinks are hashed by their targets"""
+    h = hashlib.sha256()
+    for path in paths:
+        entries = [('', path)]
+        if os.path.isdir(path) and not os.path.islink(path):
+            entries = []
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files + [x for x in dirs if os.path.islink(os.path.join(root, x))]):
+                    full_path = os.path.join(root, name)
+                    entries.append((os.path.relpath(full_path, path), full_path))
+        h.update(path.encode('utf8') + b'\0')
+        for rel_path, full_path in entries:
+            h.update(rel_path.encode('utf8') + b'\0')
+            if os.path.islink(full_path) and rel_path:
+                h.update(b'link:' + os.readlink(full_path).encode('utf8'))
+            else:
+                h.update(hash_file(full_path).encode('utf8'))
+    return h.hexdigest()
+
+
+class MatrixBuilder():
+    """Build several (target_os, lib_type, lang) variants with as few `gn gen`/`ninja` runs as possible.
+
+    Variants of the same target_os and lang share one out dir, where every cpu is
+    built by its own secondary toolchain and all lib types are enabled, so a single
+    ninja schedules all of them. GN has a single `target_os`, so each target_os (and
+    lang, whose products share the same names) still needs its own out dir, these
+    out dirs are built at the same time.
+    """
+
+    def __init__(self, builders: List[Builder]) -> None:
+        if not builders:
+            raise Exception('Matrix build needs at least one variant.')
+        self.builders = builders
+
+    def build(self):
+        groups: Dict[Tuple[str, str], List[Builder]] = OrderedDict()
+        for builder in self.builders:
+            groups.setdefault((builder.target_os, builder.build_lang), []).append(builder)
+
+        first = self.builders[0]
+        print('\n[*] Start matrix building {0} variants in {1} out dir(s)...'.format(len(self.builders), len(groups)))
+        if first.artifact_cache is not None:
+            print('\n[*] The artifact cache is not used by matrix builds, ninja builds all archs of an out dir at once.')
+        if first.compiler_cache:
+            stats_offset = compiler_cache.get_stats_offset(first.compiler_cache)
+
+        configs = []
+        for (target_os, lang), builders in groups.items():
+            if any(builder.cpu_list != builders[0].cpu_list for builder in builders):
+                raise Exception('Matrix variants of {0} {1} must build the same archs.'.format(target_os, lang))
+            configs.append(('{0}-{1}'.format(target_os, lang), builders[0], [builder.lib_type for builder in builders]))
+
+        def _build_group(config, builders: List[Builder], runner: Optional[CommandRunner] = None):
+            # All archs and lib types of an out dir are built, or reused, together
+            built = gn.generate_and_build(config, runner)
+            for builder in builders:
+                builder.reused_cpus = [] if built else list(builder.cpu_list)
+
+        if len(configs) > 1:
+            jobs = get_jobs_per_task(len(configs))
+            scheduler = JobScheduler(len(configs))
+            for name, builder, lib_types in configs:
+                config = builder.get_matrix_config(lib_types, jobs)
+                scheduler.add_job(name, lambda runner, config=config, builders=groups[(builder.target_os, builder.build_lang)]:
+                                  _build_group(config, builders, runner))
+            scheduler.run()
+        else:
+            _, builder, lib_types = configs[0]
+            _build_group(builder.get_matrix_config(lib_types), groups[(builder.target_os, builder.build_lang)])
+
+        for builder in self.builders:
+            if not builder.only_gen:
+                print('\n[*] Create products of {0} {1} {2}...'.format(builder.target_os, builder.lib_type, builder.build_lang))
+            builder.create_products()
+            builder.analyze_binary_size()
+
+        if first.compiler_cache:
+            first._report_compiler_cache(stats_offset)
+
+        for builder in self.builders:
+            builder._print_success()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# Copyright © 2021 Patrick Fu.
+
+import os
+import sys
+import json
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+PROJ_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.append(PROJ_ROOT)
+
+from buildscripts.zipcache import hash_file
+
+"""
+Checksum manifest of the archived zips, and verification of extracted trees.
+
+    python3 buildscripts/checksums.py verify path/to/manifest.json path/to/extracted/dir
+"""
+
+# Written next to the zips by `Archiver`
+MANIFEST_FILE = 'manifest.json'
+MANIFEST_VERSION = 1
+
+
+def write_manifest(manifest_path: str, archives: Dict[str, List[Dict[str, Any]]]):
+    """Write the manifest of the zips
+
+    Args:
+        manifest_path (str): Path of the manifest
+        archives (Dict[str, List[Dict[str, Any]]]): {zip file name: records of `ziputil.zip_manifest`}
+    """
+    content = {
+        'version': MANIFEST_VERSION,
+        'archives': {
+            name: {
+                'size': os.path.getsize(os.path.join(os.path.dirname(manifest_path), name)),
+                'files': records,
+            } for name, records in archives.items()
+        },
+    }
+    with open(manifest_path + '.tmp', 'w') as fw:
+        json.dump(content, fw, indent=2, sort_keys=True)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+
+def read_manifest(manifest_path: str) -> Dict[str, Any]:
+    with open(manifest_path, 'r') as fr:
+        manifest = json.load(fr)
+    if manifest.get('version') != MANIFEST_VERSION:
+        raise Exception('Unsupported manifest version: {}.'.format(manifest.get('version')))
+    return manifest
+
+
+def verify_tree(manifest_path: str, root: str, archives: Optional[List[str]] = None, workers: Optional[int] = None) -> List[str]:
+    """Check the files extracted from the zips against the manifest, files are hashed in parallel
+
+    Soft links match if they point to the same target, or (extracted without link support)
+    if they are regular files whose content is the target.
+
+    Args:
+        manifest_path (str): Path of the manifest
+        root (str): Dir the zips are extracted into
+        archives (Optional[List[str]]): Zip file names to check, defaults to all of the manifest
+        workers (Optional[int]): Hashing threads, None means the cpu count
+
+    Returns:
+        List[str]: The mismatches, empty if the tree matches
+    """
+    manifest = read_manifest(manifest_path)
+    names = archives or sorted(manifest['archives'])
+    records = []
+    for name in names:
+        if name not in manifest['archives']:
+            raise Exception('Archive {0} is not in the manifest: {1}.'.format(name, manifest_path))
+        records.extend(manifest['archives'][name]['files'])
+
+    def _verify(record: Dict[str, Any]) -> Optional[str]:
+        path = os.path.join(root, record['path'])
+        if 'link' in record and os.path.islink(path):
+            target = os.readlink(path)
+            return None if target == record['link'] else '{0}: link to {1}, expected {2}'.format(record['path'], target, record['link'])
+        if not os.path.isfile(path):
+            return '{}: missing'.format(record['path'])
+        size = os.path.getsize(path)
+        if size != record['size']:
+            return '{0}: size {1}, expected {2}'.format(record['path'], size, record['size'])
+        if hash_file(path) != record['sha256']:
+            return '{}: SHA-256 mismatch'.format(record['path'])
+        return None
+
+    # hashlib releases the GIL while hashing, threads hash files in parallel
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        return [x for x in pool.map(_verify, records) if x is not None]
+
+
+def __parse_args(args):
+    parser = argparse.ArgumentParser(description='Checksum manifest of the archived zips.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    verify = subparsers.add_parser('verify', help='Check an extracted tree against the manifest.')
+    verify.add_argument('manifest', type=str, help='Path of the manifest.json.')
+    verify.add_argument('root', type=str, help='Dir the zips are extracted into.')
+    verify.add_argument('--archive', type=str, action='append', default=None, metavar='ZIP', help='Only check this zip (file name), can be repeated.')
+    verify.add_argument('--jobs', '-j', type=int, default=None, help='Hashing threads, defaults to the cpu count.')
+    return parser.parse_args(args[1:])
+
+
+def main(argv):
+    args = __parse_args(argv)
+    errors = verify_tree(args.manifest, args.root, args.archive, args.jobs)
+    for error in errors:
+        print('[*] {}'.format(error))
+    if errors:
+        print('[*] Verify failed, {0} mismatch(es): {1}'.format(len(errors), args.root))
+        return 1
+    print('[*] Verify success: {}'.format(args.root))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# Copyright © 2021 Patrick Fu.
+
+import os
+import sys
+import json
+import shutil
+import hashlib
+import subprocess
+from typing import Dict, List, Optional, Tuple
+
+"""
+A ccache-like compiler wrapper, used as the GN `cc_wrapper`.
+
+    python3 compiler_cache.py --cache-dir DIR <compiler> <args...>
+
+The cache key is the hash of the compiler, the command line (without the output
+paths), the preprocessed source and the profiles of `-fprofile-*use=`. On a hit,
+the object file, the depfile and the compiler's stderr are restored from the
+cache instead of compiling.
+"""
+
+_SOURCE_EXTENSIONS = ('.c', '.cc', '.cpp', '.cxx', '.m', '.mm', '.S')
+# Flags followed by a path which only controls where outputs are written
+_OUTPUT_FLAGS = ('-o', '-MF', '-MT', '-MQ')
+# Flags which make the compile not cacheable
+_UNCACHEABLE_FLAGS = ('-E', '-M', '-MM', '-S', '--analyze', '-fprofile-instr-generate', '-fprofile-generate')
+_UNCACHEABLE_PREFIXES = ('-fprofile-instr-generate=', '-fprofile-generate=')
+# Flags naming a profile whose content changes the output, e.g. `-fprofile-instr-use=gbe.profdata`
+_PROFILE_USE_PREFIXES = ('-fprofile-instr-use=', '-fprofile-use=', '-fprofile-sample-use=')
+
+STATS_FILE = 'stats.log'
+
+
+class CompileCommand():
+    def __init__(self, argv: List[str]) -> None:
+        self.argv = argv
+        self.output: Optional[str] = None
+        self.depfile: Optional[str] = None
+        self.source: Optional[str] = None
+        self.profiles: List[str] = []
+        self.cacheable = '-c' in argv
+
+        i = 1
+        while i < len(argv):
+            arg = argv[i]
+            if arg in _UNCACHEABLE_FLAGS or arg.startswith(_UNCACHEABLE_PREFIXES) or arg.startswith('@'):
+                self.cacheable = False
+            if arg.startswith(_PROFILE_USE_PREFIXES):
+                profile = arg.split('=', 1)[1]
+                if not os.path.isfile(profile):
+                    self.cacheable = False # e.g. a dir of .gcda files
+                self.profiles.append(profile)
+            if arg in _OUTPUT_FLAGS and i + 1 < len(argv):
+                if arg == '-o':
+                    self.output = argv[i + 1]
+                elif arg == '-MF':
+                    self.depfile = argv[i + 1]
+                i += 2
+                continue
+            if not arg.startswith('-') and arg.endswith(_SOURCE_EXTENSIONS):
+                if self.source is not None:
+                    self.cacheable = False # Multiple sources
+                self.source = arg
+            i += 1
+
+        if self.output is None or self.source is None:
+            self.cacheable = False
+
+    def get_preprocess_argv(self) -> List[str]:
+        argv = [self.argv[0]]
+        i = 1
+        while i < len(self.argv):
+            arg = self.argv[i]
+            if arg in _OUTPUT_FLAGS:
+                i += 2
+                continue
+            if arg not in ('-c', '-MD', '-MMD'):
+                argv.append(arg)
+            i += 1
+        return argv + ['-E']
+
+    def get_key_argv(self) -> List[str]:
+        """The command line without the output paths"""
+        argv = []
+        i = 1
+        while i < len(self.argv):
+            if self.argv[i] in _OUTPUT_FLAGS:
+                argv.append(self.argv[i])
+                i += 2
+                continue
+            argv.append(self.argv[i])
+            i += 1
+        return argv
+
+
+def get_compiler_id(cache_dir: str, compiler: str) -> str:
+    """Hash of the `--version` output of a compiler, cached in `cache_dir` by the path, size and mtime of the binary"""
+    path = shutil.which(compiler) or compiler
+    st = os.stat(path)
+    id_file = os.path.join(cache_dir, 'compilers', hashlib.sha256('{0}:{1}:{2}'.format(
+        os.path.realpath(path), st.st_size, st.st_mtime_ns).encode('utf8')).hexdigest())
+    if os.path.exists(id_file):
+        with open(id_file, 'r') as fr:
+            return fr.read()
+    version = subprocess.run([path, '--version'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT).stdout
+    compiler_id = hashlib.sha256(version).hexdigest()
+    _write_atomic(id_file, compiler_id.encode('utf8'))
+    return compiler_id
+
+
+def _get_cache_key(cache_dir: str, command: CompileCommand, preprocessed: bytes) -> str:
+    h = hashlib.sha256()
+    h.update(get_compiler_id(cache_dir, command.argv[0]).encode('utf8'))
+    h.update('\0'.join(command.get_key_argv()).encode('utf8'))
+    # Debug info contains the compilation dir, unless the compiler is told to use a fixed one
+    if not any(arg.startswith(('-fdebug-compilation-dir', '-ffile-compilation-dir')) for arg in command.argv):
+        h.update(os.getcwd().encode('utf8'))
+    # The profile may be retrained in place, under the same path
+    for profile in command.profiles:
+        h.update(b'\0' + _hash_file(profile).encode('utf8'))
+    h.update(b'\0')
+    h.update(preprocessed)
+    return h.hexdigest()
+
+
+def _hash_file(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as fr:
+        for chunk in iter(lambda: fr.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _write_atomic(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = '{0}.tmp{1}'.format(path, os.getpid())
+    with open(tmp_path, 'wb') as fw:
+        fw.write(data)
+    os.replace(tmp_path, path)
+
+
+def _record(cache_dir: str, result: str):
+    # Appends of a single short line are atomic, parallel compiles can share the file
+    fd = os.open(os.path.join(cache_dir, STATS_FILE), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, (result + '\n').encode('utf8'))
+    finally:
+        os.close(fd)
+
+
+def _replace_depfile_target(depfile: bytes, target: bytes) -> bytes:
+    index = depfile.find(b': ')
+    if index < 0:
+        return depfile
+    return target + depfile[index:]
+
+
+def run(cache_dir: str, argv: List[str]) -> int:
+    os.makedirs(cache_dir, exist_ok=True)
+    command = CompileCommand(argv)
+    if not command.cacheable:
+        _record(cache_dir, 'uncacheable')
+        return subprocess.call(argv)
+
+    preprocess = subprocess.run(command.get_preprocess_argv(), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if preprocess.returncode != 0:
+        # Let the real compile report the errors
+        _record(cache_dir, 'error')
+        return subprocess.call(argv)
+
+    key = _get_cache_key(cache_dir, command, preprocess.stdout)
+    entry_dir = os.path.join(cache_dir, 'objects', key[:2], key)
+    meta_file = os.path.join(entry_dir, 'meta.json')
+
+    if os.path.exists(meta_file):
+        with open(meta_file, 'r') as fr:
+            meta = json.load(fr)
+        shutil.copyfile(os.path.join(entry_dir, 'object'), command.output)
+        if command.depfile is not None and meta['depfile']:
+            with open(os.path.join(entry_dir, 'depfile'), 'rb') as fr:
+                depfile = fr.read()
+            with open(command.depfile, 'wb') as fw:
+                fw.write(_replace_depfile_target(depfile, command.output.encode('utf8')))
+        if meta['stderr']:
+            sys.stderr.write(meta['stderr'])
+        _record(cache_dir, 'hit')
+        return 0
+
+    compile_result = subprocess.run(argv, stderr=subprocess.PIPE)
+    stderr = compile_result.stderr.decode('utf8', errors='replace')
+    sys.stderr.write(stderr)
+    if compile_result.returncode != 0:
+        _record(cache_dir, 'error')
+        return compile_result.returncode
+
+    with open(command.output, 'rb') as fr:
+        _write_atomic(os.path.join(entry_dir, 'object'), fr.read())
+    has_depfile = command.depfile is not None and os.path.exists(command.depfile)
+    if has_depfile:
+        with open(command.depfile, 'rb') as fr:
+            _write_atomic(os.path.join(entry_dir, 'depfile'), fr.read())
+    # Written last, marks the entry complete
+    _write_atomic(meta_file, json.dumps({'depfile': has_depfile, 'stderr': stderr}).encode('utf8'))
+    _record(cache_dir, 'miss')
+    return 0
+
+
+def get_stats_offset(cache_dir: str) -> int:
+    """Current end of the stats log, pass it to `read_stats` after a build"""
+    try:
+        return os.path.getsize(os.path.join(cache_dir, STATS_FILE))
+    except OSError:
+        return 0
+
+
+def read_stats(cache_dir: str, offset: int = 0) -> Dict[str, int]:
+    """Count the compile results recorded after `offset` in the stats log
+
+    Returns:
+        Dict[str, int]: e.g. {'hit': 10, 'miss': 2, 'uncacheable': 1, 'error': 0}
+    """
+    stats = {'hit': 0, 'miss': 0, 'uncacheable': 0, 'error': 0}
+    try:
+        with open(os.path.join(cache_dir, STATS_FILE), 'r') as fr:
+            fr.seek(offset)
+            for line in fr:
+                result = line.strip()
+                stats[result] = stats.get(result, 0) + 1
+    except OSError:
+        pass
+    return stats
+
+
+def get_cc_wrapper(cache_dir: str) -> str:
+    """The GN `cc_wrapper` value which routes compiles through this script"""
+    return '{0} {1} --cache-dir {2}'.format(sys.executable, os.path.abspath(__file__), os.path.abspath(cache_dir))
+
+
+def __parse_argv(argv: List[str]) -> Tuple[str, List[str]]:
+    if len(argv) < 4 or argv[1] != '--cache-dir':
+        print('Usage: python3 compiler_cache.py --cache-dir DIR <compiler> <args...>')
+        sys.exit(2)
+    return argv[2], argv[3:]
+
+
+if __name__ == '__main__':
+    cache_dir, compile_argv = __parse_argv(sys.argv)
+    sys.exit(run(cache_dir, compile_argv))
@@ -2,9 +2,13 @@
 # Copyright © 2021 Patrick Fu.
 
 import argparse
+import hashlib
+import json
+import shutil
 import subprocess
 import sys
 import os
+from typing import List, Optional
 
 """
 Script used to call specific single `gn gen` and `ninja` commands
@@ -14,13 +18,25 @@ PROJ_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 sys.path.append(PROJ_ROOT)
 
-from buildscripts.utils import get_out_dir
+from buildscripts.utils import get_out_dir, get_matrix_out_dir
+from buildscripts.scheduler import CommandRunner
+from buildscripts.telemetry import get_telemetry
+from buildscripts.compiler_cache import get_cc_wrapper
+from buildscripts.affected import AffectedAnalyzer
+from buildscripts.artifact_cache import remove_restored_outputs
+from buildscripts.zipcache import hash_file
+
+GN_GEN_STAMP = 'gbe_gn_gen.stamp'
+# Written by //src:src in matrix mode, the root out dir of each cpu's toolchain
+MATRIX_OUTPUTS = 'gbe_matrix.json'
 
 
 def __to_command_line(gn_args):
     def merge(key, value):
         if type(value) is bool:
             return '%s=%s' % (key, 'true' if value else 'false')
+        if type(value) is int:
+            return '%s=%d' % (key, value)
         if type(value) is list:
             return '%s=[%s]' % (key, ','.join('"%s"' % v for v in value))
         return '%s="%s"' % (key, value)
@@ -42,42 +58,66 @@ def __to_gn_args(args):
         # please fill in the Team Name pattern of the specified certificate
         gn_args['ios_code_signing_identity_team_name'] = '' # e.g. 'Zego'
 
-        if args.lib_type == 'shared':
-            if args.ios_lang == 'objc':
-                gn_args['build_ios_objc_shared'] = True
-            elif args.ios_lang == 'c':
-                gn_args['build_ios_common_shared'] = True
-        elif args.lib_type == 'static':
-            if args.ios_lang == 'objc':
-                gn_args['build_ios_objc_static'] = True
-            elif args.ios_lang == 'c':
-                gn_args['build_ios_common_static'] = True
+        for lib_type in __get_lib_types(args):
+            if lib_type == 'shared':
+                if args.ios_lang == 'objc':
+                    gn_args['build_ios_objc_shared'] = True
+                elif args.ios_lang == 'c':
+                    gn_args['build_ios_common_shared'] = True
+            elif lib_type == 'static':
+                if args.ios_lang == 'objc':
+                    gn_args['build_ios_objc_static'] = True
+                elif args.ios_lang == 'c':
+                    gn_args['build_ios_common_static'] = True
 
     elif args.target_os == 'mac':
         gn_args['target_os'] = 'mac'
         gn_args['mac_app_bundle_id_prefix'] = 'com.paaatrick'
         gn_args['enable_dsyms'] = True # Always enable dsyms even debug
 
-        if args.lib_type == 'shared':
-            if args.mac_lang == 'objc':
-                gn_args['build_mac_objc_shared'] = True
-            elif args.mac_lang == 'c':
-                gn_args['build_mac_common_shared'] = True
-        elif args.lib_type == 'static':
-            if args.mac_lang == 'objc':
-                gn_args['build_mac_objc_static'] = True
-            elif args.mac_lang == 'c':
-                gn_args['build_mac_common_static'] = True
+        for lib_type in __get_lib_types(args):
+            if lib_type == 'shared':
+                if args.mac_lang == 'objc':
+                    gn_args['build_mac_objc_shared'] = True
+                elif args.mac_lang == 'c':
+                    gn_args['build_mac_common_shared'] = True
+            elif lib_type == 'static':
+                if args.mac_lang == 'objc':
+                    gn_args['build_mac_objc_static'] = True
+                elif args.mac_lang == 'c':
+                    gn_args['build_mac_common_static'] = True
+
+    elif args.target_os == 'linux':
+        gn_args['target_os'] = 'linux'
+
+        for lib_type in __get_lib_types(args):
+            if lib_type == 'shared':
+                gn_args['build_linux_common_shared'] = True
+            elif lib_type == 'static':
+                gn_args['build_linux_common_static'] = True
 
     else:
         raise Exception('Unknown target os: %s' % args.target_os)
 
+    if args.bench:
+        gn_args['build_benchmark'] = True
+
+    if args.base64_tool:
+        gn_args['build_base64_tool'] = True
+
     if args.target_os == 'android':
         gn_args['target_cpu'] = args.android_cpu
     elif args.target_os == 'ios':
         gn_args['target_cpu'] = args.ios_cpu
     elif args.target_os == 'mac':
         gn_args['target_cpu'] = args.mac_cpu
+    elif args.target_os == 'linux':
+        gn_args['target_cpu'] = args.linux_cpu
+
+    if args.matrix_cpus:
+        # The default toolchain only drives the per-cpu toolchains
+        gn_args['target_cpu'] = args.matrix_cpus[0]
+        gn_args['gbe_matrix_cpus'] = args.matrix_cpus
 
     # Make sure host_cpu matches the bit width of target_cpu on x86.
     # if gn_args['target_cpu'] == 'x86':
@@ -94,20 +134,168 @@ def __to_gn_args(args):
         gn_args['is_lsan'] = True
     if args.ubsan:
         gn_args['is_ubsan'] = True
+
+    # Unity build and precompiled headers, see //src/config/jumbo.gni
+    if args.jumbo:
+        if args.jumbo < 1:
+            raise Exception('Jumbo chunk count must be greater than 0.')
+        gn_args['gbe_use_jumbo_build'] = True
+        gn_args['gbe_jumbo_chunk_count'] = args.jumbo
+    if args.pch:
+        gn_args['gbe_enable_precompiled_headers'] = True
+
+    # Link-time / profile-guided optimization, see //src/config:gbe_optimization
+    if args.lto:
+        if 'static' in __get_lib_types(args):
+            # The archive would contain LLVM bitcode, only usable with the same clang version
+            raise Exception('LTO is only supported for shared libraries.')
+        gn_args['gbe_lto'] = args.lto
+    if args.pgo_instrument and args.pgo_profile:
+        raise Exception('PGO instrumented build does not use a profile.')
+    if args.pgo_instrument:
+        gn_args['gbe_pgo_phase'] = 1
+    elif args.pgo_profile:
+        gn_args['gbe_pgo_phase'] = 2
+        gn_args['gbe_pgo_profile'] = os.path.abspath(args.pgo_profile)
+
+    # Compiler launcher, put in front of every compile command
+    if args.compiler_cache:
+        gn_args['cc_wrapper'] = get_cc_wrapper(args.compiler_cache)
     return gn_args
 
-def __parse_args(args):
-    args = args[1:]
+
+def __get_affected_args(config: argparse.Namespace) -> List[str]:
+    """GN args compared by the affected analysis
+
+    A reproducible version only changes with the commit, its date and revision are left
+    out so unaffected out dirs are reused across commits. Other versions are compared as
+    they are, their build date affects every out dir.
+    """
+    gn_args = __to_gn_args(config)
+    if config.reproducible_version:
+        gn_args['gbe_version'] = '\\"{}\\"'.format('-'.join(config.version.split('-')[:2]))
+    return __to_command_line(gn_args)
+
+
+def get_output_args(config: argparse.Namespace) -> List[str]:
+    """Rendered GN args which determine the outputs, e.g. for the artifact cache key
+
+    The compiler launcher is left out, and the PGO profile is identified by its content instead of its path.
+    """
+    gn_args = __to_gn_args(config)
+    gn_args.pop('cc_wrapper', None)
+    if 'gbe_pgo_profile' in gn_args:
+        gn_args['gbe_pgo_profile'] = hash_file(gn_args['gbe_pgo_profile'])
+    return __to_command_line(gn_args)
+
+
+def __get_lib_types(args) -> List[str]:
+    return args.matrix_lib_types or [args.lib_type]
+
+
+def __read_gen_deps(out_dir) -> Optional[List[str]]:
+    """Read the .gn/BUILD.gn/.gni/script files which the last `gn gen` depends on"""
+    deps_file = os.path.join(out_dir, 'build.ninja.d')
+    if not os.path.exists(deps_file) or not os.path.exists(os.path.join(out_dir, 'build.ninja')):
+        return None
+    with open(deps_file, 'r', encoding='utf8') as fr:
+        content = fr.read()
+    # e.g. "build.ninja: ../../.gn ../../BUILD.gn ../../build/config/BUILDCONFIG.gn"
+    content = content[content.find(':') + 1:].replace('\\\n', ' ')
+    deps = []
+    for dep in content.replace('\\ ', '\0').split():
+        deps.append(dep.replace('\0', ' '))
+    return deps
+
+
+def __get_gen_fingerprint(gn_cmd: List[str], out_dir: str) -> Optional[str]:
+    """Fingerprint of the `gn gen` command line and the content of all its input files
+
+    Returns:
+        Optional[str]: None if there is no previous `gn gen` or one of its input files was removed
+    """
+    deps = __read_gen_deps(out_dir)
+    if deps is None:
+        return None
+    h = hashlib.sha256()
+    h.update('\0'.join(gn_cmd).encode('utf8'))
+    for dep in sorted(set(deps)):
+        if dep == 'args.gn':
+            continue # Rewritten by every `gn gen`, the args are already in the command line
+        try:
+            with open(os.path.join(out_dir, dep), 'rb') as fr:
+                h.update(dep.encode('utf8'))
+                h.update(hashlib.sha256(fr.read()).digest())
+        except OSError:
+            return None
+    return h.hexdigest()
+
+
+def __read_gen_stamp(out_dir: str) -> Optional[str]:
+    try:
+        with open(os.path.join(out_dir, GN_GEN_STAMP), 'r') as fr:
+            return fr.read().strip()
+    except OSError:
+        return None
+
+
+def __write_gen_stamp(out_dir: str, fingerprint: Optional[str]):
+    stamp_file = os.path.join(out_dir, GN_GEN_STAMP)
+    if fingerprint is None:
+        if os.path.exists(stamp_file):
+            os.remove(stamp_file)
+        return
+    with open(stamp_file, 'w') as fw:
+        fw.write(fingerprint)
+
+
+def __link_matrix_out_dirs(config: argparse.Namespace, out_dir: str, runner: CommandRunner):
+    """Link the per-arch out dirs (`get_out_dir`) to the toolchain sub dirs of a matrix out dir,
+    so the later steps (lipo, xcframework, archive) find the products at the usual paths.
+    """
+    with open(os.path.join(out_dir, MATRIX_OUTPUTS), 'r') as fr:
+        outputs = json.load(fr)
+    lang = getattr(config, '{}_lang'.format(config.target_os))
+    for lib_type in __get_lib_types(config):
+        for output in outputs:
+            arch_out_dir = get_out_dir(config.build_type, config.target_os, lib_type, lang, output['cpu'])
+            toolchain_out_dir = os.path.normpath(os.path.join(out_dir, output['root_out_dir']))
+            if os.path.islink(arch_out_dir):
+                if os.readlink(arch_out_dir) == toolchain_out_dir:
+                    continue
+                os.remove(arch_out_dir)
+            elif os.path.exists(arch_out_dir):
+                runner.log('[*] Replace the out dir of a non-matrix build: {}'.format(arch_out_dir))
+                shutil.rmtree(arch_out_dir)
+            os.makedirs(os.path.dirname(arch_out_dir), exist_ok=True)
+            os.symlink(toolchain_out_dir, arch_out_dir, target_is_directory=True)
+
+
+def __create_parser():
     parser = argparse.ArgumentParser(description='A script run `gn gen`.')
 
     parser.add_argument('--build-type', type=str, choices=['debug', 'release'], default='release')
-    parser.add_argument('--target-os', type=str, choices=['android', 'ios', 'mac', 'win'])
+    parser.add_argument('--target-os', type=str, choices=['android', 'ios', 'mac', 'win', 'linux'])
     parser.add_argument('--only-gen', default=False, action='store_true', help='Whether to generate only GN build files without actually compiling with ninja.')
 
     parser.add_argument('--version', type=str, default='Unknown', help='Internal version string (hard code in the lib, the `getVersion() function`)')
+    parser.add_argument('--reproducible-version', default=False, action='store_true', help='The version is based on the commit date, `--affected` ignores its date and revision.')
 
     parser.add_argument('--lib-type', type=str, choices=['shared', 'static'], default='shared')
 
+    parser.add_argument('--gn-check', default=False, action='store_true', help='Run `gn gen --check` to validate header includes (slow, meant for CI).')
+    parser.add_argument('--force-gen', default=False, action='store_true', help='Always run `gn gen`, even if the args and GN files are unchanged.')
+
+    parser.add_argument('--compiler-cache', type=str, default=None, metavar='DIR', help='Route compiles through `compiler_cache.py`, reusing the objects cached in DIR.')
+
+    parser.add_argument('--matrix-cpus', type=str, nargs='+', default=None, metavar='CPU', help='Matrix mode: build these cpus in one out dir, each in its own secondary toolchain.')
+    parser.add_argument('--matrix-lib-types', type=str, nargs='+', choices=['shared', 'static'], default=None, metavar='LIB_TYPE', help='Matrix mode: build these lib types in the same out dir, defaults to `--lib-type`.')
+
+    parser.add_argument('--affected', default=False, action='store_true',
+                        help='Skip `gn gen` and `ninja` if no target is affected by the changes since the last build of the out dir, and reuse its outputs.')
+
+    parser.add_argument('--jobs', '-j', type=int, default=0, help='Number of ninja jobs to run in parallel, 0 means the ninja default.')
+
     # Args for Android
     parser.add_argument('--android', dest='target_os', action='store_const', const='android')
     parser.add_argument('--android-cpu', type=str, choices=['arm', 'arm64', 'x86', 'x64'], default='arm')
@@ -129,6 +317,19 @@ def __parse_args(args):
     parser.add_argument('--win-cpu', type=str, choices=['x86', 'x64'], default='x64')
     parser.add_argument('--win-lang', type=str, choices=['c'], default='c')
 
+    # Args for Linux
+    parser.add_argument('--linux', dest='target_os', action='store_const', const='linux')
+    parser.add_argument('--linux-cpu', type=str, choices=['arm', 'arm64', 'x86', 'x64'], default='x64')
+    parser.add_argument('--linux-lang', type=str, choices=['c'], default='c')
+
+    parser.add_argument('--bench', default=False, action='store_true', help='Also build the native benchmark executable.')
+    parser.add_argument('--jumbo', type=int, default=0, metavar='CHUNKS', help='Unity build, compile each source_set as up to CHUNKS files per language (0: off).')
+    parser.add_argument('--pch', default=False, action='store_true', help='Precompile the common system headers.')
+    parser.add_argument('--lto', type=str, choices=['thin', 'full'], default=None, help='Link-time optimization of the library (shared libraries only).')
+    parser.add_argument('--pgo-instrument', default=False, action='store_true', help='Instrumented build for profile-guided optimization training.')
+    parser.add_argument('--pgo-profile', type=str, default=None, metavar='PROFDATA', help='Optimize with this merged profile (`llvm-profdata merge` output).')
+    parser.add_argument('--base64-tool', default=False, action='store_true', help='Also build the `gbe_base64` command-line tool.')
+
     # Sanitizers.
     parser.add_argument('--asan', default=False, action='store_true')
     parser.add_argument('--lsan', default=False, action='store_true')
@@ -136,28 +337,86 @@ def __parse_args(args):
     parser.add_argument('--tsan', default=False, action='store_true')
     parser.add_argument('--ubsan', default=False, action='store_true')
 
-    return parser.parse_args(args)
+    return parser
 
-def main(argv):
-    args = __parse_args(argv)
 
-    exe = '.exe' if sys.platform.startswith(('cygwin', 'win')) else ''
-    platform = ''
+def __parse_args(args):
+    args = args[1:]
+    return __create_parser().parse_args(args)
+
+
+def make_config(**kwargs) -> argparse.Namespace:
+    """Create the config for `generate_and_build`, same as parsing the command line of this script
+
+    Args:
+        **kwargs: Overrides of the default args, the keys are the arg names (e.g. `target_os`, `ios_cpu`)
+
+    Returns:
+        argparse.Namespace: The config
+    """
+    config = __create_parser().parse_args([])
+    for key, value in kwargs.items():
+        if not hasattr(config, key):
+            raise Exception('Unknown gn config: {}.'.format(key))
+        setattr(config, key, value)
+    return config
+
+
+def get_host_platform() -> str:
     if sys.platform == 'darwin':
-        platform = 'darwin'
+        return 'darwin'
     elif sys.platform.startswith(('cygwin', 'win')):
-        platform = 'windows'
+        return 'windows'
     elif sys.platform.startswith('linux'):
-        platform = 'linux'
+        return 'linux'
+    return ''
+
+
+def get_buildtool(name: str) -> str:
+    """Get the path of `gn` or `ninja` in ./buildtools for the host platform"""
+    exe = '.exe' if sys.platform.startswith(('cygwin', 'win')) else ''
+    return os.path.join(PROJ_ROOT, 'buildtools', get_host_platform(), '{0}{1}'.format(name, exe))
+
+
+def get_config_out_dir(config: argparse.Namespace) -> str:
+    if config.matrix_cpus:
+        return get_matrix_out_dir(
+            config.build_type,
+            config.target_os,
+            getattr(config, '{}_lang'.format(config.target_os))
+        )
+    return get_out_dir(
+        config.build_type,
+        config.target_os,
+        config.lib_type,
+        getattr(config, '{}_lang'.format(config.target_os)),
+        getattr(config, '{}_cpu'.format(config.target_os))
+    )
+
+
+def generate_and_build(config: argparse.Namespace, runner: Optional[CommandRunner] = None) -> bool:
+    """Run `gn gen` (skipped if unchanged) and `ninja` for a single arch, or all archs of a matrix config
+
+    Args:
+        config (argparse.Namespace): Created by `make_config`
+        runner (Optional[CommandRunner]): Runs the `gn` and `ninja` commands, defaults to inherit stdout
+
+    Returns:
+        bool: False if the build is skipped by `config.affected` and the previous outputs are reused
+
+    Raises:
+        subprocess.CalledProcessError: `gn` or `ninja` failed
+    """
+    runner = runner or CommandRunner()
+    platform = get_host_platform()
 
     gn_cmd = [
-        os.path.join(PROJ_ROOT, 'buildtools', platform, 'gn{}'.format(exe)),
+        get_buildtool('gn'),
         'gen',
-        '--check',
         '-v'
     ]
 
-    if args.target_os is None:
+    if config.target_os is None:
         raise Exception('Target OS must be specified.')
 
     if platform == 'darwin':
@@ -169,74 +428,112 @@ def main(argv):
         # On Windows, generate a Visual Studio project.
         gn_cmd.append('--ide=vs')
 
-    gn_args = __to_command_line(__to_gn_args(args))
-    out_dir = get_out_dir(
-        args.build_type,
-        args.target_os,
-        args.lib_type,
-        args.__getattribute__('{}_lang'.format(args.target_os)),
-        args.__getattribute__('{}_cpu'.format(args.target_os))
-    )
+    gn_args = __to_command_line(__to_gn_args(config))
+    out_dir = get_config_out_dir(config)
+    if config.matrix_cpus:
+        cpu = 'matrix-{0}-{1}'.format(config.target_os, getattr(config, '{}_lang'.format(config.target_os)))
+    else:
+        cpu = getattr(config, '{}_cpu'.format(config.target_os))
+    if os.path.islink(out_dir):
+        # Linked into a matrix out dir by a previous matrix build
+        runner.log('[*] Unlink the out dir of a matrix build: {}'.format(out_dir))
+        os.remove(out_dir)
+
+    telemetry = get_telemetry()
+    telemetry.add_out_dir(cpu, out_dir)
 
     gn_cmd.append(out_dir)
     gn_cmd.append('--args=%s' % ' '.join(gn_args))
 
-    print('\n[*] GN command: {}'.format(' '.join(gn_cmd)))
-    print('\n[*] Generating GN files in: {}'.format(out_dir))
-    try:
-        gn_call_result = subprocess.call(gn_cmd, cwd=PROJ_ROOT)
-    except subprocess.CalledProcessError as exc:
-        print('[*] Failed to generate gn files: ', exc.returncode, exc.output)
-        sys.exit(1)
-
-    if gn_call_result != 0:
-        # GN gen failed, exit early
-        print('[*] Failed to generate gn files.')
-        return gn_call_result
-
-    # Generate/Replace the compile commands database in out.
-    # It does not run a actual ninja build command,
-    # but just generate a full ninja compile commands.
-    compile_cmd_gen_cmd = [
-        os.path.join(PROJ_ROOT, 'buildtools', platform, 'ninja{}'.format(exe)),
-        '-C',
-        out_dir,
-        '-t',
-        'compdb',
-        'cc',
-        'cxx',
-        'objc',
-        'objcxx',
-        'asm',
-    ]
+    analyzer = AffectedAnalyzer(out_dir, __get_affected_args(config), __read_gen_deps(out_dir),
+                                get_buildtool('gn'), get_buildtool('ninja'), runner)
+    if config.affected and not config.only_gen:
+        with telemetry.phase('affected', cpu=cpu):
+            reason = analyzer.get_affected_reason()
+        if reason is None:
+            runner.log('\n[*] No target is affected by the changes since the last build, reuse the outputs in: {}'.format(out_dir))
+            if config.matrix_cpus:
+                __link_matrix_out_dirs(config, out_dir, runner)
+            return False
+        runner.log('\n[*] Affected ({0}), build: {1}'.format(reason, out_dir))
+    # Invalidate the stamp until `ninja` succeeds.
+    analyzer.remove_stamp()
+
+    fingerprint = None
+    if not config.gn_check and not config.force_gen:
+        fingerprint = __get_gen_fingerprint(gn_cmd, out_dir)
+
+    if fingerprint is not None and fingerprint == __read_gen_stamp(out_dir):
+        # Ninja regenerates its build files by itself if needed.
+        runner.log('\n[*] GN args and files are unchanged, skip generating GN files in: {}'.format(out_dir))
+    else:
+        # Invalidate the stamp until `gn gen` and `ninja -t compdb` succeed.
+        __write_gen_stamp(out_dir, None)
+        if config.gn_check:
+            gn_cmd.insert(2, '--check')
+
+        runner.log('\n[*] GN command: {}'.format(' '.join(gn_cmd)))
+        runner.log('\n[*] Generating GN files in: {}'.format(out_dir))
+        with telemetry.phase('gn_gen', cpu=cpu):
+            runner.check_call(gn_cmd, cwd=PROJ_ROOT)
+
+        # Generate/Replace the compile commands database in out.
+        # It does not run a actual ninja build command,
+        # but just generate a full ninja compile commands.
+        compile_cmd_gen_cmd = [
+            get_buildtool('ninja'),
+            '-C',
+            out_dir,
+            '-t',
+            'compdb',
+            'cc',
+            'cxx',
+            'objc',
+            'objcxx',
+            'asm',
+        ]
 
-    print('\n[*] Run ninja -t compdb command: {}'.format(' '.join(compile_cmd_gen_cmd)))
-    try:
-        contents = subprocess.check_output(compile_cmd_gen_cmd, cwd=PROJ_ROOT)
-        with open(os.path.join(out_dir, 'compile_commands.json'), 'wb') as fw:
-            fw.write(contents)
-    except subprocess.CalledProcessError as exc:
-        print('[*] Failed to run ninja -t compdb: ', exc.returncode, exc.output)
-        sys.exit(1)
+        runner.log('\n[*] Run ninja -t compdb command: {}'.format(' '.join(compile_cmd_gen_cmd)))
+        with telemetry.phase('compdb', cpu=cpu):
+            contents = runner.check_output(compile_cmd_gen_cmd, cwd=PROJ_ROOT)
+            with open(os.path.join(out_dir, 'compile_commands.json'), 'wb') as fw:
+                fw.write(contents)
+
+        __write_gen_stamp(out_dir, __get_gen_fingerprint([x for x in gn_cmd if x != '--check'], out_dir))
+
+    if config.matrix_cpus:
+        __link_matrix_out_dirs(config, out_dir, runner)
 
     # Run ninja build command to compile.
-    if not args.only_gen:
+    if not config.only_gen:
         compile_cmd = [
-            os.path.join(PROJ_ROOT, 'buildtools', platform, 'ninja{}'.format(exe)),
+            get_buildtool('ninja'),
             '-v',
             '-C',
             out_dir
         ]
+        if config.jobs > 0:
+            compile_cmd += ['-j', str(config.jobs)]
 
-        print('\n[*] Run ninja build command: {}'.format(' '.join(compile_cmd)))
-        try:
-            ninja_build_result = subprocess.check_call(compile_cmd, cwd=PROJ_ROOT)
-        except subprocess.CalledProcessError as exc:
-            print('[*] Failed to run ninja build: ', exc.returncode, exc.output)
-            sys.exit(1)
+        # Ninja must not write into hard links of the artifact cache
+        remove_restored_outputs(out_dir)
+
+        runner.log('\n[*] Run ninja build command: {}'.format(' '.join(compile_cmd)))
+        with telemetry.phase('ninja', cpu=cpu):
+            runner.check_call(compile_cmd, cwd=PROJ_ROOT)
+        analyzer.write_stamp()
+    return True
 
-    return ninja_build_result
+
+def main(argv):
+    args = __parse_args(argv)
+    try:
+        generate_and_build(args)
+    except subprocess.CalledProcessError as exc:
+        print('[*] Failed to run: {0}, exit code: {1}'.format(' '.join(exc.cmd), exc.returncode))
+        return 1
+    return 0
 
 
 if __name__ == '__main__':
-    sys.exit(main(sys.argv))
\ No newline at end of file
+    sys.exit(main(sys.argv))
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# Copyright © 2021 Patrick Fu.
+
+import os
+import sys
+import glob
+import shutil
+import hashlib
+import subprocess
+from typing import List, Optional
+
+PROJ_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.append(PROJ_ROOT)
+
+from buildscripts import benchmark
+from buildscripts.compiler_cache import get_compiler_id
+
+"""
+Profile-guided optimization: train the instrumented benchmark, merge the raw
+profiles, and cache the merged profile by source revision.
+"""
+
+# Training workload, small sizes are enough to find the hot paths
+TRAINING_MAX_SIZE = 16 * 1024 * 1024
+TRAINING_MIN_TIME = 0.05
+
+# Source of the library and the training workload, a change invalidates the cached profiles
+PROFILE_SOURCE_DIRS = ['src']
+
+
+def get_source_revision() -> str:
+    """Hash of the files under `PROFILE_SOURCE_DIRS`, same sources give the same revision, committed or not"""
+    h = hashlib.sha256()
+    for source_dir in PROFILE_SOURCE_DIRS:
+        for root, dirs, files in os.walk(os.path.join(PROJ_ROOT, source_dir)):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                h.update(os.path.relpath(path, PROJ_ROOT).replace(os.sep, '/').encode('utf8') + b'\0')
+                with open(path, 'rb') as fr:
+                    h.update(hashlib.sha256(fr.read()).digest())
+    return h.hexdigest()
+
+
+def get_profile_key(cache_dir: str, target_os: str, cpu: str, build_type: str, lto: Optional[str]) -> str:
+    """Key of the merged profile, a profile is only valid for the clang which wrote it"""
+    settings = '{0}:{1}:{2}:{3}:{4}:{5}'.format(get_source_revision(), _get_clang_id(cache_dir, target_os), target_os, cpu, build_type, lto or '')
+    return hashlib.sha256(settings.encode('utf8')).hexdigest()
+
+
+def _get_clang_id(cache_dir: str, target_os: str) -> str:
+    clang = 'clang'
+    if target_os in ('ios', 'mac'):
+        xcrun = os.environ.get('GBE_XCRUN', 'xcrun')
+        try:
+            clang = subprocess.run([xcrun, '--find', 'clang'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                   universal_newlines=True).stdout.strip() or clang
+        except OSError:
+            pass
+    try:
+        return get_compiler_id(cache_dir, clang)
+    except OSError:
+        return 'missing'
+
+
+def get_llvm_profdata() -> List[str]:
+    """Command of `llvm-profdata`, `GBE_LLVM_PROFDATA` overrides it"""
+    if os.environ.get('GBE_LLVM_PROFDATA'):
+        return [os.environ['GBE_LLVM_PROFDATA']]
+    if sys.platform == 'darwin':
+        return ['xcrun', 'llvm-profdata']
+    path = shutil.which('llvm-profdata')
+    if path is None:
+        raise Exception('Can not find llvm-profdata, please add it to PATH or set GBE_LLVM_PROFDATA.')
+    return [path]
+
+
+class ProfileCache():
+    """Merged profiles, stored as `<cache_dir>/<key>.profdata`
+
+    The least recently used profiles are evicted once there are more than `max_profiles`.
+    """
+
+    def __init__(self, cache_dir: str, max_profiles: int = 16) -> None:
+        self.cache_dir = cache_dir
+        self.max_profiles = max_profiles
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def get(self, key: str) -> Optional[str]:
+        path = self._profile_path(key)
+        if not os.path.isfile(path):
+            return None
+        os.utime(path)
+        return path
+
+    def put(self, key: str, profdata: str) -> str:
+        path = self._profile_path(key)
+        # Copy to a temp file then rename, parallel writers of the same key are safe.
+        tmp_path = '{0}.tmp{1}'.format(path, os.getpid())
+        shutil.copyfile(profdata, tmp_path)
+        os.replace(tmp_path, path)
+        self.evict()
+        return path
+
+    def evict(self):
+        profiles = sorted(glob.glob(os.path.join(self.cache_dir, '*.profdata')), key=os.path.getmtime)
+        for path in profiles[:max(0, len(profiles) - self.max_profiles)]:
+            os.remove(path)
+
+    def _profile_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, '{}.profdata'.format(key))
+
+
+def train(executable: str, work_dir: str, output_profdata: str):
+    """Run the instrumented benchmark executable and merge its raw profiles
+
+    Args:
+        executable (str): Path of the instrumented `gbe_benchmark`
+        work_dir (str): Dir of the raw profiles and the training results, cleaned first
+        output_profdata (str): Path of the merged profile
+    """
+    if os.path.exists(work_dir):
+        shutil.rmtree(work_dir)
+    os.makedirs(work_dir)
+
+    env = dict(os.environ)
+    env['LLVM_PROFILE_FILE'] = os.path.join(work_dir, 'gbe-%p.profraw')
+    benchmark.run_benchmark(executable, os.path.join(work_dir, 'training.json'), TRAINING_MAX_SIZE, TRAINING_MIN_TIME, env=env)
+
+    raw_profiles = sorted(glob.glob(os.path.join(work_dir, '*.profraw')))
+    if not raw_profiles:
+        raise Exception('The training run did not write any profile, is {} instrumented?'.format(executable))
+
+    cmd = get_llvm_profdata() + ['merge', '-o', output_profdata] + raw_profiles
+    print('\n[*] Execute command: {}'.format(' '.join(cmd)))
+    subprocess.check_call(cmd)
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# Copyright © 2021 Patrick Fu.
+
+import os
+import sys
+import queue
+import signal
+import threading
+import subprocess
+from collections import OrderedDict
+from typing import Callable, List, Dict, Optional
+
+"""
+Run build commands, and schedule build jobs in parallel.
+"""
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class CommandRunner():
+    """Run the commands of a build job.
+
+    Without a prefix the commands inherit stdout/stderr. With a prefix every
+    output line is prefixed, so the logs of parallel jobs stay readable.
+    The runner can be cancelled from another thread, which stops the running
+    command (and its child processes) and makes every further command fail.
+    """
+
+    def __init__(self, prefix: str = '', print_lock: Optional[threading.Lock] = None) -> None:
+        self.prefix = prefix
+        self._print_lock = print_lock or threading.Lock()
+        self._lock = threading.Lock()
+        self._proc: Optional[subprocess.Popen] = None
+        self._cancelled = False
+
+    def log(self, text: str):
+        if not self.prefix:
+            print(text)
+            return
+        with self._print_lock:
+            for line in text.split('\n'):
+                sys.stdout.write(self.prefix + line + '\n')
+            sys.stdout.flush()
+
+    def call(self, cmd: List[str], cwd: Optional[str] = None) -> int:
+        return self._run(cmd, cwd, None)
+
+    def check_call(self, cmd: List[str], cwd: Optional[str] = None):
+        returncode = self._run(cmd, cwd, None)
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, cmd)
+
+    def check_output(self, cmd: List[str], cwd: Optional[str] = None) -> bytes:
+        output: List[bytes] = []
+        returncode = self._run(cmd, cwd, output)
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, cmd, b''.join(output))
+        return b''.join(output)
+
+    def cancel(self):
+        with self._lock:
+            self._cancelled = True
+            if self._proc is not None:
+                _terminate(self._proc, bool(self.prefix))
+
+    def _run(self, cmd: List[str], cwd: Optional[str], output: Optional[List[bytes]]) -> int:
+        # Start each parallel command in its own process group, so cancelling
+        # also stops the compiler/linker processes spawned by ninja.
+        kwargs = {}
+        if self.prefix:
+            if sys.platform.startswith(('cygwin', 'win')):
+                kwargs['creationflags'] = subprocess.CREATE_NEW_PROCESS_GROUP
+            else:
+                kwargs['start_new_session'] = True
+
+        piped = output is not None or bool(self.prefix)
+        with self._lock:
+            if self._cancelled:
+                raise JobCancelled(' '.join(cmd))
+            proc = subprocess.Popen(cmd, cwd=cwd, stdout=subprocess.PIPE if piped else None,
+                                    stderr=subprocess.STDOUT if self.prefix and output is None else None, **kwargs)
+            self._proc = proc
+
+        try:
+            if output is not None:
+                output.append(proc.communicate()[0])
+            elif piped:
+                for line in iter(proc.stdout.readline, b''):
+                    self.log(line.decode('utf8', errors='replace').rstrip('\r\n'))
+                proc.stdout.close()
+            returncode = proc.wait()
+        except BaseException:
+            _terminate(proc, bool(self.prefix))
+            proc.wait()
+            raise
+        finally:
+            with self._lock:
+                self._proc = None
+
+        if self._cancelled:
+            raise JobCancelled(' '.join(cmd))
+        return returncode
+
+
+class JobScheduler():
+    def __init__(self, max_parallel: int) -> None:
+        self.max_parallel = max(1, max_parallel)
+        self.jobs: Dict[str, Callable[[CommandRunner], None]] = OrderedDict()
+        self._print_lock = threading.Lock()
+
+    def add_job(self, name: str, job: Callable[[CommandRunner], None]):
+        if name in self.jobs:
+            raise Exception('Duplicate job name: {}.'.format(name))
+        self.jobs[name] = job
+
+    def run(self):
+        """Run all jobs in threads, at most `max_parallel` at the same time.
+
+        Each job gets its own `CommandRunner` which prefixes the output with
+        `[name]`. The first failed job cancels all other running jobs and no
+        pending job will be started.
+
+        Raises:
+            Exception: The exception of the first failed job.
+        """
+        pending = list(self.jobs.items())
+        running: Dict[str, CommandRunner] = {}
+        finished: 'queue.Queue' = queue.Queue()
+        prefix_width = max([len(name) for name in self.jobs] + [0]) + 2
+
+        def _run_job(name: str, job: Callable[[CommandRunner], None], runner: CommandRunner):
+            try:
+                job(runner)
+                finished.put((name, None))
+            except BaseException as exc:
+                finished.put((name, exc))
+
+        try:
+            while pending or running:
+                while pending and len(running) < self.max_parallel:
+                    name, job = pending.pop(0)
+                    runner = CommandRunner('[{}]'.format(name).ljust(prefix_width) + ' ', self._print_lock)
+                    running[name] = runner
+                    threading.Thread(target=_run_job, args=(name, job, runner), name='job-{}'.format(name), daemon=True).start()
+
+                name, exc = finished.get()
+                running.pop(name)
+                if exc is not None:
+                    print('\n[*] Job {0} failed: {1}, cancel {2} running job(s).'.format(name, exc, len(running)))
+                    self._cancel(running, finished)
+                    raise exc
+        except KeyboardInterrupt:
+            self._cancel(running, finished)
+            raise
+
+    def _cancel(self, running: Dict[str, CommandRunner], finished: 'queue.Queue'):
+        for runner in running.values():
+            runner.cancel()
+        # Wait for the cancelled jobs so their logs stay complete.
+        while running:
+            name, _ = finished.get()
+            running.pop(name, None)
+
+
+def get_jobs_per_task(parallel_tasks: int) -> int:
+    """Split the machine's ninja `-j` budget across tasks running at the same time
+
+    Args:
+        parallel_tasks (int): How many tasks (e.g. archs) build at the same time
+
+    Returns:
+        int: The `-j` value for each task's ninja
+    """
+    # Ninja's default is `cpu_count + 2`, keep the same total budget.
+    total = (os.cpu_count() or 1) + 2
+    return max(1, total // max(1, parallel_tasks))
+
+
+def _terminate(proc: subprocess.Popen, process_group: bool):
+    if proc.poll() is not None:
+        return
+    try:
+        if not process_group:
+            proc.terminate()
+        elif sys.platform.startswith(('cygwin', 'win')):
+            proc.send_signal(signal.CTRL_BREAK_EVENT)
+        else:
+            os.killpg(proc.pid, signal.SIGTERM)
+    except (OSError, ValueError):
+        proc.terminate()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# Copyright © 2021 Patrick Fu.
+
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+"""
+Record the timing of build phases, and write them into a JSON report.
+"""
+
+
+class Telemetry():
+    def __init__(self) -> None:
+        self.start_time = time.time()
+        self.phases: List[Dict[str, Any]] = []
+        # {name: (out dir, position of its `.ninja_log` before the build)}
+        self.out_dirs: Dict[str, Tuple[str, Optional[Tuple[int, int]]]] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name: str, **tags) -> Iterator[Dict[str, Any]]:
+        """Record the wall time of a phase, e.g. `with telemetry.phase('ninja', cpu='arm64'):`
+
+        The yielded dict is the phase record, extra tags can be added into `record['tags']`.
+        """
+        record = {'name': name, 'tags': tags, 'start': round(time.time() - self.start_time, 3), 'seconds': 0.0, 'ok': False}
+        start_time = time.time()
+        try:
+            yield record
+            record['ok'] = True
+        finally:
+            record['seconds'] = round(time.time() - start_time, 3)
+            with self._lock:
+                self.phases.append(record)
+
+    def add_out_dir(self, name: str, out_dir: str):
+        """Register a gn out dir before ninja runs, the `.ninja_log` entries appended from now on are analyzed in the report"""
+        with self._lock:
+            # Built again in this process (e.g. PGO), keep the position before the first build
+            if name not in self.out_dirs or self.out_dirs[name][0] != out_dir:
+                self.out_dirs[name] = (out_dir, get_ninja_log_position(out_dir))
+
+    def get_report(self, top: int = 20, **info) -> Dict[str, Any]:
+        ninja = {}
+        for name, (out_dir, position) in self.out_dirs.items():
+            edges = parse_ninja_log(out_dir, position)
+            if edges is None:
+                continue
+            edges.sort(key=lambda edge: edge['seconds'], reverse=True)
+            ninja[name] = {
+                'out_dir': out_dir,
+                'edges': len(edges),
+                'total_seconds': round(sum(edge['seconds'] for edge in edges), 3),
+                'slowest': edges[:top],
+            }
+
+        return {
+            'info': info,
+            'start_time': time.strftime('%Y-%m-%dT%H:%M:%S%z', time.localtime(self.start_time)),
+            'total_seconds': round(time.time() - self.start_time, 3),
+            'phases': sorted(self.phases, key=lambda phase: phase['start']),
+            'ninja': ninja,
+        }
+
+    def write_report(self, path: str, top: int = 20, **info):
+        report = self.get_report(top, **info)
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as fw:
+            json.dump(report, fw, indent=2)
+        print('\n[*] Timing report: {}'.format(path))
+
+
+def get_ninja_log_position(out_dir: str) -> Optional[Tuple[int, int]]:
+    """(inode, size) of the `.ninja_log` of an out dir, None if there is no log"""
+    try:
+        st = os.stat(os.path.join(out_dir, '.ninja_log'))
+    except OSError:
+        return None
+    return (st.st_ino, st.st_size)
+
+
+def parse_ninja_log(out_dir: str, position: Optional[Tuple[int, int]] = None):
+    """Parse the `.ninja_log` (v5) of an out dir, only keep the latest build of each output
+
+    Args:
+        out_dir (str): The gn out dir
+        position (Optional[Tuple[int, int]]): `get_ninja_log_position` before the build, only the
+            entries appended after it are parsed. The whole log is parsed if it was replaced since
+            (e.g. recompacted by ninja), or if None
+
+    Returns:
+        Optional[List[Dict[str, Any]]]: [{'output': 'obj/...', 'seconds': 1.23}], None if there is no log
+    """
+    log_file = os.path.join(out_dir, '.ninja_log')
+    if not os.path.exists(log_file):
+        return None
+    current = get_ninja_log_position(out_dir)
+    offset = 0
+    if position is not None and current is not None and current[0] == position[0] and current[1] >= position[1]:
+        offset = position[1]
+
+    latest: Dict[str, Dict[str, Any]] = {}
+    with open(log_file, 'rb') as fr:
+        fr.seek(offset)
+        for raw_line in fr:
+            line = raw_line.decode('utf8', errors='replace')
+            if line.startswith('#'):
+                if line.startswith('# ninja log'):
+                    # A fresh log, the entries before it are from a replaced log
+                    latest.clear()
+                continue
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) < 5:
+                continue
+            start_ms, end_ms, _, output, cmd_hash = fields[:5]
+            latest[output] = {'start': int(start_ms), 'end': int(end_ms), 'hash': cmd_hash}
+
+    # Outputs of the same edge share the same command and time, report each edge once
+    edges: Dict[Any, Dict[str, Any]] = {}
+    for output, entry in latest.items():
+        key = (entry['hash'], entry['start'], entry['end'])
+        if key in edges:
+            edges[key]['outputs'].append(output)
+            continue
+        edges[key] = {'output': output, 'outputs': [output], 'seconds': (entry['end'] - entry['start']) / 1000.0}
+
+    result = []
+    for edge in edges.values():
+        outputs = sorted(edge.pop('outputs'))
+        edge['output'] = outputs[0]
+        if len(outputs) > 1:
+            edge['other_outputs'] = outputs[1:]
+        result.append(edge)
+    return result
+
+
+_telemetry = Telemetry()
+
+
+def get_telemetry() -> Telemetry:
+    """The telemetry of the current build"""
+    return _telemetry
@@ -0,0 +1,32 @@
+#!/bin/sh
+# Regenerate the binary size report fixtures, then `expected.json`:
+#
+#     sh buildscripts/testdata/binsize/generate.sh
+#
+# Needs gcc and binutils ar (ELF), llvm-mc, llvm-ar and llvm-lipo (Mach-O, universal, BSD ar).
+
+set -e
+cd "$(dirname "$0")"
+TMP_DIR=$(mktemp -d)
+trap 'rm -rf "$TMP_DIR"' EXIT
+
+# ELF object, and a GNU ar archive with a long member name (in the '//' table)
+gcc -O1 -fno-asynchronous-unwind-tables -ffunction-sections -fdata-sections -c sample.c -o elf_x64.o
+cp elf_x64.o "$TMP_DIR/sample_with_a_long_member_name.o"
+rm -f libsample_elf_x64.a
+ar rcD libsample_elf_x64.a elf_x64.o "$TMP_DIR/sample_with_a_long_member_name.o"
+
+# Thin and universal Mach-O objects
+llvm-mc -triple x86_64-apple-macos10.13 -filetype=obj sample_darwin_x64.s -o macho_x64.o
+llvm-mc -triple arm64-apple-ios9.0 -filetype=obj sample_darwin_arm64.s -o macho_arm64.o
+llvm-lipo -create macho_x64.o macho_arm64.o -segalign x86_64 8 -segalign arm64 8 -output macho_universal.o
+
+# Universal BSD ar archives, with long member names ('#1/<length>')
+for arch in x64 arm64; do
+    cp "macho_$arch.o" "$TMP_DIR/sample_with_a_long_member_name.o"
+    llvm-ar rcD --format=darwin "$TMP_DIR/libsample_$arch.a" "macho_$arch.o" "$TMP_DIR/sample_with_a_long_member_name.o"
+done
+llvm-lipo -create "$TMP_DIR/libsample_x64.a" "$TMP_DIR/libsample_arm64.a" -output libsample_macho_universal.a
+
+python3 ../../binsize.py report elf_x64.o libsample_elf_x64.a macho_x64.o macho_arm64.o macho_universal.o libsample_macho_universal.a \
+    --json expected.json
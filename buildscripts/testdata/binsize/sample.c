@@ -0,0 +1,13 @@
+// Sample of the binary size report fixtures, see generate.sh
+
+int gbe_sample_table[64] = {1};
+static int gbe_sample_counter;
+
+__attribute__((visibility("hidden"))) int gbe_sample_hidden(int x) {
+    return x * 3 + gbe_sample_table[x & 63];
+}
+
+int gbe_sample_add(int a, int b) {
+    gbe_sample_counter++;
+    return a + b + gbe_sample_hidden(a);
+}
@@ -0,0 +1,30 @@
+// Sample of the binary size report fixtures (arm64 Mach-O), see generate.sh
+	.section	__TEXT,__text,regular,pure_instructions
+	.private_extern	_gbe_sample_hidden
+	.globl	_gbe_sample_hidden
+	.p2align	2
+_gbe_sample_hidden:
+	add	w0, w0, w0, lsl #1
+	ret
+
+	.globl	_gbe_sample_add
+	.p2align	2
+_gbe_sample_add:
+	add	w0, w0, w1
+	add	w0, w0, #1
+	nop
+	ret
+
+	.section	__TEXT,__cstring,cstring_literals
+l_.str:
+	.asciz	"GNBuildExample"
+
+	.section	__DATA,__data
+	.globl	_gbe_sample_table
+	.p2align	3
+_gbe_sample_table:
+	.long	1
+	.space	252
+
+.zerofill __DATA,__bss,_gbe_sample_counter,4,2
+.subsections_via_symbols
@@ -0,0 +1,27 @@
+# Sample of the binary size report fixtures (x86_64 Mach-O), see generate.sh
+	.section	__TEXT,__text,regular,pure_instructions
+	.private_extern	_gbe_sample_hidden
+	.globl	_gbe_sample_hidden
+_gbe_sample_hidden:
+	leal	(%rdi,%rdi,2), %eax
+	retq
+
+	.globl	_gbe_sample_add
+_gbe_sample_add:
+	leal	(%rdi,%rsi), %eax
+	incl	_gbe_sample_counter(%rip)
+	retq
+
+	.section	__TEXT,__cstring,cstring_literals
+L_.str:
+	.asciz	"GNBuildExample"
+
+	.section	__DATA,__data
+	.globl	_gbe_sample_table
+	.p2align	4
+_gbe_sample_table:
+	.long	1
+	.space	252
+
+.zerofill __DATA,__bss,_gbe_sample_counter,4,2
+.subsections_via_symbols
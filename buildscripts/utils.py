@@ -15,7 +15,7 @@ def get_out_dir(build_type: str, target_os: str, lib_type: str, build_lang: str,
 
     Args:
         build_type (str): release or debug
-        target_os (str): android/ios/mac/win/...
+        target_os (str): android/ios/mac/win/linux/...
         lib_type (str): shared or static
         lang (str): c/objc/java/...
         cpu (str): arm/arm64/x86/x64/...
@@ -35,11 +35,36 @@ def get_out_dir(build_type: str, target_os: str, lib_type: str, build_lang: str,
     return path
 
 
+def get_matrix_out_dir(build_type: str, target_os: str, build_lang: str) -> str:
+    """Get the output dir path of a matrix build, which builds all cpus and lib types of a lang
+
+    Each cpu is built by its own toolchain in a sub dir, the per-cpu `get_out_dir`
+    paths are linked to these sub dirs after `gn gen`.
+
+    Args:
+        build_type (str): release or debug
+        target_os (str): ios/mac/...
+        lang (str): c/objc/...
+
+    Returns:
+        str: The output dir path
+    """
+
+    # e.g. "./_out/ios-matrix-objc/release/"
+    path = os.path.join(
+        PROJ_ROOT,
+        '_out',
+        '{0}-matrix-{1}'.format(target_os, build_lang),
+        build_type
+    )
+    return path
+
+
 def get_abi_from_cpu(target_os: str, cpu: str) -> str:
     """Get the platform-specific abi naming of the cpu architecture
 
     Args:
-        target_os (str): android/ios/mac/win/...
+        target_os (str): android/ios/mac/win/linux/...
         cpu (str): arm/arm64/x86/x64/...
 
     Returns:
@@ -52,6 +77,8 @@ def get_abi_from_cpu(target_os: str, cpu: str) -> str:
             return 'armeabi-v7a'
         elif target_os == 'win':
             return 'arm'
+        elif target_os == 'linux':
+            return 'armv7'
 
     elif cpu == 'arm64':
         if target_os == 'ios' or target_os == 'mac':
@@ -60,6 +87,8 @@ def get_abi_from_cpu(target_os: str, cpu: str) -> str:
             return 'arm64-v8a'
         elif target_os == 'win':
             return 'arm64'
+        elif target_os == 'linux':
+            return 'aarch64'
 
     elif cpu == 'x86':
         if target_os == 'ios' or target_os == 'mac':
@@ -68,6 +97,8 @@ def get_abi_from_cpu(target_os: str, cpu: str) -> str:
             return 'x86'
         elif target_os == 'win':
             return 'x86'
+        elif target_os == 'linux':
+            return 'i686'
 
     elif cpu == 'x64':
         if target_os == 'ios' or target_os == 'mac':
@@ -76,6 +107,8 @@ def get_abi_from_cpu(target_os: str, cpu: str) -> str:
             return 'x86_64'
         elif target_os == 'win':
             return 'x64'
+        elif target_os == 'linux':
+            return 'x86_64'
 
     else: # Unknown cpu
         return cpu
@@ -6,6 +6,7 @@ import sys
 import json
 import time
 import subprocess
+from typing import Optional
 
 """
 Generate library version string
@@ -13,33 +14,32 @@ Generate library version string
 
 PROJ_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
-def _get_git_desc() -> str:
-    git_cmd = ['git', '-C', PROJ_ROOT, 'describe', '--all', '--long', '--abbrev=10']
-    git_desc = subprocess.check_output(git_cmd).decode('utf8').strip()
-    git_desc = git_desc.replace('/', '_')
-    git_desc = git_desc.replace('remotes_', '')
-    git_desc = git_desc.replace('origin_', '')
-    return git_desc
 
+class VersionInfo():
+    """Library version info, `git describe` is only called once per instance."""
 
-def get_git_revision() -> str:
-    git_desc = _get_git_desc()
-    index = git_desc.rfind('-')
-    git_revision = git_desc[index+1:]
-    return git_revision
-
+    def __init__(self, proj_root: str = PROJ_ROOT) -> None:
+        self.proj_root = proj_root
+        self._git_desc: Optional[str] = None
 
-def get_short_semver() -> str:
-    version_file = os.path.join(PROJ_ROOT, 'version.json')
-    with open(version_file, 'r') as fr:
-        m = json.load(fr)
-    return '{0}.{1}.{2}'.format(m['major'], m['minor'], m['patch'])
+    def get_git_desc(self) -> str:
+        if self._git_desc is None:
+            git_cmd = ['git', '-C', self.proj_root, 'describe', '--all', '--long', '--abbrev=10']
+            git_desc = subprocess.check_output(git_cmd).decode('utf8').strip()
+            git_desc = git_desc.replace('/', '_')
+            git_desc = git_desc.replace('remotes_', '')
+            git_desc = git_desc.replace('origin_', '')
+            self._git_desc = git_desc
+        return self._git_desc
 
+    def get_git_revision(self) -> str:
+        git_desc = self.get_git_desc()
+        index = git_desc.rfind('-')
+        git_revision = git_desc[index+1:]
+        return git_revision
 
-def get_long_semver():
-
-    def __get_git_branch() -> str:
-        git_desc = _get_git_desc()
+    def get_git_branch(self) -> str:
+        git_desc = self.get_git_desc()
         git_branch = git_desc[0:git_desc.find('-')]
         index = git_branch.find('_')
         if index >= 0:
@@ -51,21 +51,63 @@ def get_long_semver():
             branch = git_branch
         return branch
 
-    ver = get_short_semver()
-    branch = __get_git_branch()
-    return '{0}-{1}'.format(ver, branch)
+    def get_short_semver(self) -> str:
+        version_file = os.path.join(self.proj_root, 'version.json')
+        with open(version_file, 'r') as fr:
+            m = json.load(fr)
+        return '{0}.{1}.{2}'.format(m['major'], m['minor'], m['patch'])
+
+    def get_long_semver(self) -> str:
+        return '{0}-{1}'.format(self.get_short_semver(), self.get_git_branch())
+
+    def get_full_version(self) -> str:
+        semver = self.get_long_semver()
+        date = time.strftime('%y%m%d-%H%M%S')
+        revision = self.get_git_revision()
+        return '{0}-{1}-{2}'.format(semver, date, revision)
+
+    def get_commit_timestamp(self) -> int:
+        # Honor https://reproducible-builds.org/specs/source-date-epoch/
+        source_date_epoch = os.environ.get('SOURCE_DATE_EPOCH')
+        if source_date_epoch:
+            return int(source_date_epoch)
+        git_cmd = ['git', '-C', self.proj_root, 'log', '-1', '--format=%ct', 'HEAD']
+        return int(subprocess.check_output(git_cmd).decode('utf8').strip())
+
+    def get_reproducible_version(self) -> str:
+        """Same format as `get_full_version`, but the date is the (UTC) commit date,
+        so the version only changes when HEAD changes.
+        """
+        semver = self.get_long_semver()
+        date = time.strftime('%y%m%d-%H%M%S', time.gmtime(self.get_commit_timestamp()))
+        revision = self.get_git_revision()
+        return '{0}-{1}-{2}'.format(semver, date, revision)
+
+
+def get_git_revision() -> str:
+    return VersionInfo().get_git_revision()
+
+
+def get_short_semver() -> str:
+    return VersionInfo().get_short_semver()
+
+
+def get_long_semver():
+    return VersionInfo().get_long_semver()
 
 
 def get_full_version():
-    semver = get_long_semver()
-    date = time.strftime('%y%m%d-%H%M%S')
-    revision = get_git_revision()
-    return '{0}-{1}-{2}'.format(semver, date, revision)
+    return VersionInfo().get_full_version()
+
+
+def get_reproducible_version():
+    return VersionInfo().get_reproducible_version()
 
 
 def main(argv):
     ACTIONS = {
         'fullver': get_full_version,
+        'reproducible': get_reproducible_version,
         'semver': get_short_semver,
         'revision': get_git_revision
     }
@@ -84,11 +126,15 @@ def __usage():
 
         python3 version_generator.py fullver
 
-    2. Get short semantic version: ( e.g. '1.2.3' )
+    2. Get reproducible full version, the date is the commit date: ( e.g '1.2.3-main-210101-120000-g6ff87c4924')
+
+        python3 version_generator.py reproducible
+
+    3. Get short semantic version: ( e.g. '1.2.3' )
 
         python3 version_generator.py semver
 
-    3. Get git revision: ( e.g. 'g6ff87c4924' )
+    4. Get git revision: ( e.g. 'g6ff87c4924' )
 
         python3 version_generator.py revision
 
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# Copyright © 2021 Patrick Fu.
+
+import os
+import json
+import hashlib
+import threading
+from typing import Dict, Iterator, Optional, Tuple
+
+"""
+Content-addressed cache of compressed zip entries.
+"""
+
+
+class ZipEntryCache():
+    """Compressed bytes of zip entries, keyed by (file content hash, compression settings).
+
+    Layout of the cache dir:
+        entries/<key[:2]>/<key>       compressed bytes, copied verbatim into new zips
+        entries/<key[:2]>/<key>.json  {"crc": .., "file_size": .., "compress_size": ..}
+        outputs/<zip path hash>.json  manifest hash of the last zip written to that path
+
+    The least recently used entries are evicted once the cache exceeds `max_size` bytes.
+    """
+
+    def __init__(self, cache_dir: str, max_size: int) -> None:
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.reused_bytes = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(cache_dir, 'entries'), exist_ok=True)
+        os.makedirs(os.path.join(cache_dir, 'outputs'), exist_ok=True)
+
+    @staticmethod
+    def get_key(content_hash: str, settings: str) -> str:
+        return hashlib.sha256('{0}:{1}'.format(content_hash, settings).encode('utf8')).hexdigest()
+
+    def get(self, key: str) -> Optional[Tuple[Dict[str, int], str]]:
+        """Look up an entry, and mark it as recently used
+
+        Returns:
+            Optional[Tuple[Dict[str, int], str]]: (meta, path of the compressed bytes), None if missing
+        """
+        data_path = self._entry_path(key)
+        try:
+            with open(data_path + '.json', 'r') as fr:
+                meta = json.load(fr)
+            if os.path.getsize(data_path) != meta['compress_size']:
+                raise ValueError('Corrupted cache entry')
+            os.utime(data_path)
+        except (OSError, ValueError, KeyError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+            self.reused_bytes += meta['compress_size']
+        return meta, data_path
+
+    def put(self, key: str, meta: Dict[str, int], chunks: Iterator[bytes]):
+        data_path = self._entry_path(key)
+        os.makedirs(os.path.dirname(data_path), exist_ok=True)
+        # Write to temp files then rename, parallel writers of the same key are safe.
+        tmp_suffix = '.tmp{0}-{1}'.format(os.getpid(), threading.get_ident())
+        with open(data_path + tmp_suffix, 'wb') as fw:
+            for chunk in chunks:
+                fw.write(chunk)
+        with open(data_path + '.json' + tmp_suffix, 'w') as fw:
+            json.dump(meta, fw)
+        os.replace(data_path + tmp_suffix, data_path)
+        os.replace(data_path + '.json' + tmp_suffix, data_path + '.json')
+
+    def is_output_up_to_date(self, zip_file: str, manifest_hash: str) -> bool:
+        """Whether `zip_file` was written from the same manifest, and not modified since"""
+        try:
+            with open(self._output_path(zip_file), 'r') as fr:
+                record = json.load(fr)
+            st = os.stat(zip_file)
+        except (OSError, ValueError):
+            return False
+        return record.get('manifest_hash') == manifest_hash and record.get('size') == st.st_size \
+            and record.get('mtime_ns') == st.st_mtime_ns
+
+    def set_output(self, zip_file: str, manifest_hash: str):
+        st = os.stat(zip_file)
+        with open(self._output_path(zip_file), 'w') as fw:
+            json.dump({'zip_file': zip_file, 'manifest_hash': manifest_hash, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}, fw)
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits in `max_size`"""
+        entries = []
+        total_size = 0
+        entries_dir = os.path.join(self.cache_dir, 'entries')
+        for root, _, files in os.walk(entries_dir):
+            for name in files:
+                if name.endswith('.json') or '.tmp' in name:
+                    continue
+                path = os.path.join(root, name)
+                st = os.stat(path)
+                entries.append((st.st_mtime, st.st_size, path))
+                total_size += st.st_size
+
+        entries.sort()
+        evicted = 0
+        while entries and total_size > self.max_size:
+            _, size, path = entries.pop(0)
+            for p in (path, path + '.json'):
+                if os.path.exists(p):
+                    os.remove(p)
+            total_size -= size
+            evicted += 1
+        if evicted:
+            print('[*] [ZipCache] Evicted {0} entries, {1:.1f} MB left'.format(evicted, total_size / 1024 / 1024))
+
+    def report(self):
+        print('[*] [ZipCache] {0} hits, {1} misses, {2:.1f} MB compressed data reused'.format(
+            self.hits, self.misses, self.reused_bytes / 1024 / 1024))
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, 'entries', key[:2], key)
+
+    def _output_path(self, zip_file: str) -> str:
+        name = hashlib.sha256(os.path.realpath(zip_file).encode('utf8')).hexdigest()
+        return os.path.join(self.cache_dir, 'outputs', '{}.json'.format(name))
+
+
+def hash_file(path: str, chunk_size: int = 4 * 1024 * 1024) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as fr:
+        for chunk in iter(lambda: fr.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
@@ -3,8 +3,65 @@
 # Copyright © 2021 Patrick Fu.
 
 import os
-from typing import List
+import bz2
+import lzma
+import sys
+import time
+import zlib
+import struct
+import hashlib
 import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from buildscripts.zipcache import ZipEntryCache, hash_file
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+COMPRESSION_METHODS = ['stored', 'deflate', 'bzip2', 'lzma', 'zstd']
+
+# Zip compression method ids
+_METHOD_IDS = {'stored': 0, 'deflate': 8, 'bzip2': 12, 'lzma': 14, 'zstd': 93}
+_METHOD_NAMES = {method_id: method for method, method_id in _METHOD_IDS.items()}
+# Minimum zip version needed to extract each method
+_METHOD_VERSIONS = {'stored': 10, 'deflate': 20, 'bzip2': 46, 'lzma': 63, 'zstd': 63}
+
+_DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+# Deflate window, each chunk is primed with the tail of the previous chunk (like pigz)
+_DEFLATE_DICT_SIZE = 32 * 1024
+_ZIP64_LIMIT = (1 << 31) - 1
+_SYMLINK_ATTR = 0xA1ED0000
+
+
+def check_compression(method: str, level: Optional[int]):
+    """Raise if the compression method is unknown or unavailable, or the level is out of its range"""
+    if method not in _METHOD_IDS:
+        raise Exception('Unknown compression method: {}.'.format(method))
+    if method == 'zstd' and zstandard is None:
+        raise Exception('Compression method zstd requires the `zstandard` package.')
+    if level is None:
+        return
+    if method == 'stored':
+        raise Exception('Compression method stored has no compression level.')
+    min_level, max_level = _get_level_range(method)
+    if not min_level <= level <= max_level:
+        raise Exception('Compression level of {0} must be in {1}..{2}, got {3}.'.format(method, min_level, max_level, level))
+
+
+def _get_level_range(method: str) -> Tuple[int, int]:
+    if method == 'deflate':
+        return -1, 9
+    if method == 'bzip2':
+        return 1, 9
+    if method == 'lzma':
+        # Preset of the LZMA1 filter
+        return 0, 9
+    return 1, zstandard.MAX_COMPRESSION_LEVEL
 
 
 def unzip_file(src_zip_file, dst_folder):
@@ -28,7 +85,59 @@ def zip_single_file(src_file: str, dst_folder: str, zip_name: str) -> bool:
     return True
 
 
-def zip_folders(src_folder_list: List[str], dst_folder: str, zip_name: str, exclude_files: List[str]=[], append_dir_link: bool=True):
+def zip_folders(src_folder_list: List[str], dst_folder: str, zip_name: str, exclude_files: List[str]=[], append_dir_link: bool=True,
+                method: str='deflate', level: Optional[int]=None, workers: Optional[int]=None, verbose: bool=False,
+                cache: Optional[ZipEntryCache]=None, records: Optional[List[Dict[str, Any]]]=None):
+    """Zip folders (or files) into `dst_folder/zip_name`, each folder is stored under its basename
+
+    See `zip_manifest` for the args.
+    """
+    manifest = [(src_folder, os.path.split(src_folder)[-1]) for src_folder in src_folder_list]
+    return zip_manifest(manifest, dst_folder, zip_name, exclude_files, append_dir_link, method, level, workers, verbose, cache, records)
+
+
+def zip_manifest(manifest: List[Tuple[str, str]], dst_folder: str, zip_name: str, exclude_files: List[str]=[], append_dir_link: bool=True,
+                 method: str='deflate', level: Optional[int]=None, workers: Optional[int]=None, verbose: bool=False,
+                 cache: Optional[ZipEntryCache]=None, records: Optional[List[Dict[str, Any]]]=None,
+                 volatile: List[Tuple[str, str]]=[]) -> bool:
+    """Zip a manifest of (source path, name in zip) into `dst_folder/zip_name`, without staging the files
+
+    A source folder (or a soft link to a folder) is added recursively under its name in zip,
+    other soft links are stored as links.
+    Entries are compressed across a thread pool and written in a deterministic (manifest, then sorted) order,
+    large files are read and compressed in chunks.
+
+    Args:
+        manifest (List[Tuple[str, str]]): (source path, name in zip) of folders, files or soft links
+        dst_folder (str): Folder of the zip file
+        zip_name (str): File name of the zip file
+        exclude_files (List[str]): Skip the files whose name ends with one of these
+        append_dir_link (bool): Also add the folder soft links (e.g. `Versions/Current` in macOS framework)
+        method (str): One of `COMPRESSION_METHODS`, `zstd` requires the `zstandard` package
+        level (Optional[int]): Compression level, None means the method's default
+        workers (Optional[int]): Compression threads, None means the cpu count
+        verbose (bool): Print every zipped file
+        cache (Optional[ZipEntryCache]): Reuse the compressed bytes of unchanged files,
+            and skip the zip if all inputs are unchanged since it was written
+        records (Optional[List[Dict[str, Any]]]): Appended with the {path, size, sha256, crc32} of every entry
+            (plus `link` for soft links), the SHA-256 is computed while reading the files for compression
+        volatile (List[Tuple[str, str]]): (source path, name in zip) of small files which change on every build
+            (e.g. the build date), written after the manifest. Only their names are compared by the cache,
+            a skipped zip gets their current content.
+
+    Returns:
+        bool: False if the zip is skipped because it is up to date
+    """
+    check_compression(method, level)
+    if not os.path.exists(dst_folder):
+        os.makedirs(dst_folder)
+
+    zip_file = os.path.realpath(os.path.join(dst_folder, zip_name))
+    return _zip_entries(zip_file, _iter_manifest_entries(manifest, exclude_files, append_dir_link), method, level, workers, verbose,
+                        cache=cache, records=records, volatile=volatile)
+
+
+def _iter_manifest_entries(manifest: List[Tuple[str, str]], exclude_files: List[str], append_dir_link: bool) -> Iterator[Tuple[str, str]]:
     def _is_exclude_file(fname):
         if exclude_files is None or len(exclude_files) == 0:
             return False
@@ -37,43 +146,476 @@ def zip_folders(src_folder_list: List[str], dst_folder: str, zip_name: str, excl
                 return True
         return False
 
-    if not os.path.exists(dst_folder):
-        os.makedirs(dst_folder)
-
-    zip_file = os.path.realpath(os.path.join(dst_folder, zip_name))
-    handle = zipfile.ZipFile(zip_file, 'w', zipfile.ZIP_DEFLATED)
+    for src_path, name_in_zip in manifest:
+        if not os.path.lexists(src_path):
+            print("[*] [ZipUtil] SRC Folder: `{}` does not exist!".format(src_path))
+            continue
 
-    for src_folder in src_folder_list:
-        if not os.path.exists(src_folder):
-            print("[*] [ZipUtil] SRC Folder: `{}` does not exist!".format(src_folder))
+        name_in_zip = name_in_zip.replace(os.sep, '/').strip('/')
+        if not os.path.isdir(src_path):
+            yield src_path, name_in_zip
             continue
 
-        filelist = []
-        if os.path.isfile(src_folder) or os.path.islink(src_folder):
-            filelist.append(src_folder)
+        for root, dirs, files in os.walk(src_path):
+            dirs.sort()
+            entries = [name for name in files if not _is_exclude_file(name)]
+            if append_dir_link:
+                # Folder soft links are also added to the package list (compatible with macOS framework)
+                entries += [name for name in dirs if os.path.islink(os.path.join(root, name))]
+            for name in sorted(entries):
+                tar = os.path.join(root, name)
+                yield tar, name_in_zip + tar[len(src_path):].replace(os.sep, '/')
+
+
+def _zip_entries(zip_file: str, entries: Iterator[Tuple[str, str]], method: str, level: Optional[int],
+                 workers: Optional[int], verbose: bool, chunk_size: int=_DEFAULT_CHUNK_SIZE,
+                 cache: Optional[ZipEntryCache]=None, records: Optional[List[Dict[str, Any]]]=None,
+                 volatile: List[Tuple[str, str]]=[]) -> bool:
+    """Compress (src_path, name_in_zip) entries in parallel and write them in order, then the `volatile` files
+
+    Returns:
+        bool: False if the zip is skipped, because it is up to date according to the cache
+    """
+    workers = workers or os.cpu_count() or 1
+    # Bound the in-flight chunks, so memory stays ~ (window * chunk_size)
+    window = workers * 2
+    start_time = time.time()
+    total_size = 0
+    count = 0
+    # Compressed bytes depend on all of these
+    settings = '{0}:{1}:{2}:{3}'.format(method, level, chunk_size, zlib.ZLIB_RUNTIME_VERSION)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        content_hashes: Dict[str, str] = {}
+        if cache is not None:
+            entries = list(entries)
+            files = [src_file for src_file, _ in entries if not os.path.islink(src_file)]
+            content_hashes = dict(zip(files, pool.map(hash_file, files)))
+            manifest_hash = _get_manifest_hash(entries, content_hashes, settings, [name for _, name in volatile])
+            if cache.is_output_up_to_date(zip_file, manifest_hash):
+                volatile_records: List[Dict[str, Any]] = []
+                if _replace_volatile_entries(zip_file, volatile, method, level, chunk_size, volatile_records):
+                    print('[*] [ZipUtil] Inputs are unchanged, skip: {}'.format(zip_file))
+                    if volatile:
+                        cache.set_output(zip_file, manifest_hash)
+                    if records is not None:
+                        records.extend(_read_records(zip_file, entries, content_hashes))
+                        records.extend(volatile_records)
+                    return False
+
+        with open(zip_file, 'w+b') as fp:
+            writer = _ZipWriter(fp)
+            pending: 'deque' = deque()
+            in_flight = 0
+
+            def _flush(max_in_flight: int):
+                nonlocal in_flight
+                while pending and (in_flight > max_in_flight or pending[0][0] != 'data'):
+                    kind, payload = pending.popleft()
+                    if kind == 'begin':
+                        writer.begin_file(payload)
+                    elif kind == 'data':
+                        in_flight -= 1
+                        writer.write(payload.result())
+                    elif kind == 'copy':
+                        with open(payload, 'rb') as fr:
+                            for data in iter(lambda: fr.read(chunk_size), b''):
+                                writer.write(data)
+                    elif kind == 'end':
+                        writer.end_file(payload)
+                        if records is not None:
+                            records.append(_get_record(payload))
+                        if payload.cache_key is not None:
+                            meta = {'crc': payload.crc, 'file_size': payload.file_size, 'compress_size': payload.compress_size}
+                            cache.put(payload.cache_key, meta, writer.read_data(payload, chunk_size))
+                    elif kind == 'link':
+                        entry = writer.add_symlink(*payload)
+                        if records is not None:
+                            records.append(_get_record(entry, link=payload[1]))
+
+            for src_file, name_in_zip in entries:
+                count += 1
+                if verbose:
+                    print(">> zip {0} {1}".format('link' if os.path.islink(src_file) else 'file', name_in_zip))
+
+                if os.path.islink(src_file):
+                    pending.append(('link', (name_in_zip, os.readlink(src_file), os.lstat(src_file).st_mtime)))
+                    _flush(window)
+                    continue
+
+                st = os.stat(src_file)
+                entry = _ZipEntry(name_in_zip, method, st.st_size, st.st_mtime, st.st_mode)
+                pending.append(('begin', entry))
+
+                cached = None
+                if cache is not None and method != 'stored':
+                    entry.cache_key = cache.get_key(content_hashes[src_file], settings)
+                    cached = cache.get(entry.cache_key)
+
+                # Already hashed for the cache, or hashed while reading the file below
+                entry.sha256 = content_hashes.get(src_file)
+
+                if cached is not None:
+                    # Reuse the compressed bytes verbatim
+                    meta, data_path = cached
+                    entry.cache_key = None
+                    entry.crc = meta['crc']
+                    entry.file_size = meta['file_size']
+                    pending.append(('copy', data_path))
+                elif method in ('stored', 'deflate'):
+                    # Chunks are read here in order (also computing the CRC and SHA-256) and compressed in the pool
+                    crc = 0
+                    size = 0
+                    sha256 = hashlib.sha256() if entry.sha256 is None else None
+                    prev_tail = b''
+                    with open(src_file, 'rb') as fr:
+                        chunk = fr.read(chunk_size)
+                        while True:
+                            next_chunk = fr.read(chunk_size) if len(chunk) == chunk_size else b''
+                            last = len(next_chunk) == 0
+                            crc = zlib.crc32(chunk, crc)
+                            if sha256 is not None:
+                                sha256.update(chunk)
+                            size += len(chunk)
+                            if method == 'stored':
+                                pending.append(('data', _Done(chunk)))
+                            else:
+                                pending.append(('data', pool.submit(_deflate_chunk, chunk, prev_tail, last, level)))
+                                prev_tail = chunk[-_DEFLATE_DICT_SIZE:]
+                            in_flight += 1
+                            _flush(window)
+                            if last:
+                                break
+                            chunk = next_chunk
+                    entry.crc = crc
+                    entry.file_size = size
+                    if sha256 is not None:
+                        entry.sha256 = sha256.hexdigest()
+                else:
+                    # Methods whose streams can not be split, compress the whole file in one task
+                    pending.append(('data', pool.submit(_compress_file, src_file, entry, level, chunk_size)))
+                    in_flight += 1
+
+                pending.append(('end', entry))
+                total_size += entry.file_size
+                _flush(window)
+
+            _flush(0)
+            for src_file, name_in_zip in volatile:
+                count += 1
+                entry = _write_file(writer, src_file, name_in_zip, method, level, chunk_size)
+                total_size += entry.file_size
+                if records is not None:
+                    records.append(_get_record(entry))
+            writer.close()
+            zip_size = fp.tell()
+
+        if cache is not None:
+            cache.set_output(zip_file, manifest_hash)
+
+    print('[*] [ZipUtil] Zipped {0} entries ({1:.1f} MB -> {2:.1f} MB, {3}) in {4:.2f}s: {5}'.format(
+        count, total_size / 1024 / 1024, zip_size / 1024 / 1024, method, time.time() - start_time, zip_file))
+    return True
+
+
+def _get_record(entry: '_ZipEntry', link: Optional[str] = None) -> Dict[str, Any]:
+    record = {'path': entry.name, 'size': entry.file_size, 'sha256': entry.sha256, 'crc32': '{:08x}'.format(entry.crc)}
+    if link is not None:
+        record['link'] = link
+    return record
+
+
+def _read_records(zip_file: str, entries: List[Tuple[str, str]], content_hashes: Dict[str, str]) -> List[Dict[str, Any]]:
+    """Records of a zip skipped by the cache, the sizes and CRCs from its central directory"""
+    records = []
+    with zipfile.ZipFile(zip_file, 'r') as zf:
+        for src_file, name_in_zip in entries:
+            info = zf.getinfo(name_in_zip)
+            record = {'path': name_in_zip, 'size': info.file_size, 'crc32': '{:08x}'.format(info.CRC)}
+            if os.path.islink(src_file):
+                link = os.readlink(src_file)
+                record['sha256'] = hashlib.sha256(link.encode('utf8')).hexdigest()
+                record['link'] = link
+            else:
+                record['sha256'] = content_hashes[src_file]
+            records.append(record)
+    return records
+
+
+def _get_manifest_hash(entries: List[Tuple[str, str]], content_hashes: Dict[str, str], settings: str, volatile_names: List[str]) -> str:
+    h = hashlib.sha256(settings.encode('utf8'))
+    for src_file, name_in_zip in entries:
+        if os.path.islink(src_file):
+            item = 'link:{0}:{1}'.format(name_in_zip, os.readlink(src_file))
         else:
-            for root, dirs, files in os.walk(src_folder):
-                for name in files:
-                    if _is_exclude_file(name):
-                        continue
-                    filelist.append(os.path.join(root, name))
-                if append_dir_link:
-                    # Folder soft links are also added to the package list (compatible with macOS framework)
-                    for name in dirs:
-                        if os.path.islink(os.path.join(root, name)):
-                            filelist.append(os.path.join(root, name))
-
-        for tar in filelist:
-            basename = os.path.split(src_folder)[-1]
-            arcname = tar[len(src_folder):]
-            filename = basename + arcname
-            _write_zip_content(tar, handle, filename)
-
-    handle.close()
+            item = 'file:{0}:{1}:{2:o}'.format(name_in_zip, content_hashes[src_file], os.stat(src_file).st_mode)
+        h.update(item.encode('utf8') + b'\0')
+    for name_in_zip in volatile_names:
+        h.update('volatile:{}'.format(name_in_zip).encode('utf8') + b'\0')
+    return h.hexdigest()
+
+
+def _write_file(writer: '_ZipWriter', src_file: str, name_in_zip: str, method: str, level: Optional[int], chunk_size: int) -> '_ZipEntry':
+    """Compress and write a small file in this thread"""
+    st = os.stat(src_file)
+    entry = _ZipEntry(name_in_zip, method, st.st_size, st.st_mtime, st.st_mode)
+    data = _compress_file(src_file, entry, level, chunk_size)
+    writer.begin_file(entry)
+    writer.write(data)
+    writer.end_file(entry)
+    return entry
+
+
+def _replace_volatile_entries(zip_file: str, volatile: List[Tuple[str, str]], method: str, level: Optional[int],
+                              chunk_size: int, records: List[Dict[str, Any]]) -> bool:
+    """Rewrite the volatile entries at the end of a zip written by `_zip_entries`, the other entries are kept as they are
+
+    Returns:
+        bool: False if the zip does not end with these entries
+    """
+    if not volatile:
+        return True
+    with zipfile.ZipFile(zip_file, 'r') as zf:
+        infos = zf.infolist()
+    kept = infos[:len(infos) - len(volatile)]
+    if [info.filename for info in infos[len(kept):]] != [name for _, name in volatile] \
+            or any(info.compress_type not in _METHOD_NAMES for info in kept):
+        return False
 
+    with open(zip_file, 'r+b') as fp:
+        writer = _ZipWriter(fp)
+        writer.entries = [_ZipEntry.from_info(info) for info in kept]
+        fp.seek(infos[len(kept)].header_offset)
+        fp.truncate()
+        for src_file, name_in_zip in volatile:
+            records.append(_get_record(_write_file(writer, src_file, name_in_zip, method, level, chunk_size)))
+        writer.close()
     return True
 
 
+def _deflate_chunk(chunk: bytes, prev_tail: bytes, last: bool, level: Optional[int]) -> bytes:
+    # zlib releases the GIL while compressing, so chunks compress in parallel.
+    # Non-last chunks end with a sync flush, the concatenation is one valid raw deflate stream.
+    if prev_tail:
+        compressor = zlib.compressobj(-1 if level is None else level, zlib.DEFLATED, -15, zdict=prev_tail)
+    else:
+        compressor = zlib.compressobj(-1 if level is None else level, zlib.DEFLATED, -15)
+    return compressor.compress(chunk) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+def _compress_file(src_file: str, entry: '_ZipEntry', level: Optional[int], chunk_size: int) -> bytes:
+    if entry.method == 'stored':
+        compressor = _StoredCompressor()
+    elif entry.method == 'deflate':
+        compressor = zlib.compressobj(-1 if level is None else level, zlib.DEFLATED, -15)
+    elif entry.method == 'bzip2':
+        compressor = bz2.BZ2Compressor(9 if level is None else level)
+    elif entry.method == 'lzma':
+        compressor = zipfile.LZMACompressor() if level is None else _LZMACompressor(level)
+    elif entry.method == 'zstd':
+        compressor = zstandard.ZstdCompressor(level=3 if level is None else level).compressobj()
+    else:
+        raise Exception('Unknown compression method: {}.'.format(entry.method))
+
+    crc = 0
+    size = 0
+    sha256 = hashlib.sha256() if entry.sha256 is None else None
+    output = []
+    with open(src_file, 'rb') as fr:
+        for chunk in iter(lambda: fr.read(chunk_size), b''):
+            crc = zlib.crc32(chunk, crc)
+            if sha256 is not None:
+                sha256.update(chunk)
+            size += len(chunk)
+            output.append(compressor.compress(chunk))
+    output.append(compressor.flush())
+    entry.crc = crc
+    entry.file_size = size
+    if sha256 is not None:
+        entry.sha256 = sha256.hexdigest()
+    return b''.join(output)
+
+
+class _LZMACompressor(zipfile.LZMACompressor):
+    """`zipfile.LZMACompressor` with the preset of the LZMA1 filter"""
+    def __init__(self, preset: int) -> None:
+        super().__init__()
+        self._preset = preset
+
+    def _init(self):
+        lzma_filter = {'id': lzma.FILTER_LZMA1, 'preset': self._preset}
+        props = lzma._encode_filter_properties(lzma_filter)
+        self._comp = lzma.LZMACompressor(lzma.FORMAT_RAW, filters=[lzma_filter])
+        return struct.pack('<BBH', 9, 4, len(props)) + props
+
+
+class _StoredCompressor():
+    """Pass the data through, like a compressor object"""
+    def compress(self, data: bytes) -> bytes:
+        return data
+
+    def flush(self) -> bytes:
+        return b''
+
+
+class _Done():
+    """A finished future"""
+    def __init__(self, value) -> None:
+        self.value = value
+
+    def result(self):
+        return self.value
+
+
+class _ZipEntry():
+    def __init__(self, name: str, method: str, file_size: int, mtime: float, mode: int) -> None:
+        self.name = name
+        self.method = method
+        self.file_size = file_size
+        self.compress_size = 0
+        self.crc = 0
+        self.date_time = time.localtime(mtime)[0:6]
+        self.external_attr = (mode & 0xFFFF) << 16
+        self.create_system = 0 if sys.platform.startswith('win') else 3
+        self.flag_bits = 0x02 if method == 'lzma' else 0 # LZMA streams have an end of stream marker
+        self.header_offset = 0
+        self.data_offset = 0
+        self.cache_key: Optional[str] = None
+        self.sha256: Optional[str] = None
+        # Decided before writing the local header, like zipfile
+        self.zip64 = file_size * 1.05 > _ZIP64_LIMIT
+
+    @staticmethod
+    def from_info(info: zipfile.ZipInfo) -> '_ZipEntry':
+        """Entry already written in a zip, only for its central directory record"""
+        entry = _ZipEntry(info.filename, _METHOD_NAMES[info.compress_type], info.file_size, 0, 0)
+        entry.date_time = info.date_time
+        entry.external_attr = info.external_attr
+        entry.create_system = info.create_system
+        entry.flag_bits = info.flag_bits & ~0x800
+        entry.crc = info.CRC
+        entry.compress_size = info.compress_size
+        entry.header_offset = info.header_offset
+        return entry
+
+
+class _ZipWriter():
+    """Write a zip file from already compressed data"""
+
+    def __init__(self, fp) -> None:
+        self.fp = fp
+        self.entries: List[_ZipEntry] = []
+
+    def add_symlink(self, name: str, target: str, mtime: float) -> _ZipEntry:
+        data = target.encode('utf8')
+        entry = _ZipEntry(name, 'stored', len(data), mtime, 0)
+        entry.external_attr = _SYMLINK_ATTR
+        entry.create_system = 3
+        entry.crc = zlib.crc32(data)
+        entry.sha256 = hashlib.sha256(data).hexdigest()
+        self.begin_file(entry)
+        self.write(data)
+        self.end_file(entry)
+        return entry
+
+    def begin_file(self, entry: _ZipEntry):
+        entry.header_offset = self.fp.tell()
+        self.fp.write(self._local_header(entry))
+        entry.data_offset = self.fp.tell()
+        self.entries.append(entry)
+
+    def read_data(self, entry: _ZipEntry, chunk_size: int) -> Iterator[bytes]:
+        """Read back the compressed data of a written entry"""
+        end = self.fp.tell()
+        offset = entry.data_offset
+        remaining = entry.compress_size
+        try:
+            while remaining > 0:
+                self.fp.seek(offset)
+                data = self.fp.read(min(chunk_size, remaining))
+                offset += len(data)
+                remaining -= len(data)
+                yield data
+        finally:
+            self.fp.seek(end)
+
+    def write(self, data: bytes):
+        self.fp.write(data)
+        self.entries[-1].compress_size += len(data)
+
+    def end_file(self, entry: _ZipEntry):
+        if not entry.zip64 and (entry.file_size > _ZIP64_LIMIT or entry.compress_size > _ZIP64_LIMIT):
+            raise Exception('File size of {} changed while zipping, too large for a zip entry.'.format(entry.name))
+        # Rewrite the local header, the CRC and sizes are known now
+        end = self.fp.tell()
+        self.fp.seek(entry.header_offset)
+        self.fp.write(self._local_header(entry))
+        self.fp.seek(end)
+
+    def close(self):
+        cd_offset = self.fp.tell()
+        for entry in self.entries:
+            extra = []
+            file_size, compress_size, header_offset = entry.file_size, entry.compress_size, entry.header_offset
+            if file_size > _ZIP64_LIMIT or compress_size > _ZIP64_LIMIT:
+                extra += [file_size, compress_size]
+                file_size = compress_size = 0xFFFFFFFF
+            if header_offset > _ZIP64_LIMIT:
+                extra.append(header_offset)
+                header_offset = 0xFFFFFFFF
+            extra_data = struct.pack('<HH' + 'Q' * len(extra), 1, 8 * len(extra), *extra) if extra else b''
+            name, flag_bits = self._encode_name(entry)
+            version = max(_METHOD_VERSIONS[entry.method], 45 if extra else 20)
+            dos_date, dos_time = _dos_date_time(entry.date_time)
+            self.fp.write(struct.pack('<4s4B4HL2L5H2L', b'PK\001\002',
+                                      version, entry.create_system, version, 0,
+                                      flag_bits, _METHOD_IDS[entry.method], dos_time, dos_date,
+                                      entry.crc, compress_size, file_size,
+                                      len(name), len(extra_data), 0, 0, 0, entry.external_attr, header_offset))
+            self.fp.write(name)
+            self.fp.write(extra_data)
+
+        cd_end = self.fp.tell()
+        count = len(self.entries)
+        cd_size = cd_end - cd_offset
+        if count >= 0xFFFF or cd_offset > _ZIP64_LIMIT or cd_size > _ZIP64_LIMIT:
+            # Zip64 end of central directory record and locator
+            self.fp.write(struct.pack('<4sQ2H2L4Q', b'PK\006\006', 44, 45, 45, 0, 0, count, count, cd_size, cd_offset))
+            self.fp.write(struct.pack('<4sLQL', b'PK\006\007', 0, cd_end, 1))
+            count = min(count, 0xFFFF)
+            cd_size = min(cd_size, 0xFFFFFFFF)
+            cd_offset = min(cd_offset, 0xFFFFFFFF)
+        self.fp.write(struct.pack('<4s4H2LH', b'PK\005\006', 0, 0, count, count, cd_size, cd_offset, 0))
+
+    def _local_header(self, entry: _ZipEntry) -> bytes:
+        name, flag_bits = self._encode_name(entry)
+        extra = b''
+        file_size, compress_size = entry.file_size, entry.compress_size
+        version = _METHOD_VERSIONS[entry.method]
+        if entry.zip64:
+            extra = struct.pack('<HHQQ', 1, 16, file_size, compress_size)
+            file_size = compress_size = 0xFFFFFFFF
+            version = max(version, 45)
+        dos_date, dos_time = _dos_date_time(entry.date_time)
+        header = struct.pack('<4s2B4HL2L2H', b'PK\003\004', version, 0, flag_bits, _METHOD_IDS[entry.method],
+                             dos_time, dos_date, entry.crc, compress_size, file_size, len(name), len(extra))
+        return header + name + extra
+
+    @staticmethod
+    def _encode_name(entry: _ZipEntry) -> Tuple[bytes, int]:
+        try:
+            return entry.name.encode('ascii'), entry.flag_bits
+        except UnicodeEncodeError:
+            return entry.name.encode('utf8'), entry.flag_bits | 0x800
+
+
+def _dos_date_time(date_time) -> Tuple[int, int]:
+    year, month, day, hour, minute, second = date_time
+    if year < 1980:
+        year, month, day, hour, minute, second = 1980, 1, 1, 0, 0, 0
+    return (year - 1980) << 9 | month << 5 | day, hour << 11 | minute << 5 | (second // 2)
+
+
 def _write_zip_content(src_file, zip_handle, name_in_zip):
     if os.path.islink(src_file):
         print(">> zip link {}".format(name_in_zip))
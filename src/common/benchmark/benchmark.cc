@@ -0,0 +1,261 @@
+#include "src/common/include/gn_build_example.h"
+#include "src/common/module/base64/Base64.h"
+
+#include <algorithm>
+#include <chrono>
+#include <climits>
+#include <cstdint>
+#include <cstdio>
+#include <cstdlib>
+#include <cstring>
+#include <functional>
+#include <string>
+#include <vector>
+
+/*
+ * Native benchmark of the common C API and the base64 module.
+ *
+ * Usage: gbe_benchmark [--json PATH] [--max-size BYTES] [--min-time SECONDS] [--filter NAME]
+ *
+ * Every case runs repeatedly until `--min-time` elapsed (at least once),
+ * the results are printed as JSON to stdout or written into `--json PATH`.
+ */
+
+namespace {
+
+struct BenchmarkOptions {
+    std::string json_path;
+    long long max_size = 256LL * 1024 * 1024;
+    double min_time = 0.2;
+    std::string filter;
+};
+
+struct BenchmarkResult {
+    std::string name;
+    long long size;
+    long long iterations;
+    double seconds;
+};
+
+// Keeps the compiler from optimizing the benchmarked calls away
+volatile uint64_t g_sink = 0;
+
+double now_seconds() {
+    return std::chrono::duration<double>(std::chrono::steady_clock::now().time_since_epoch()).count();
+}
+
+BenchmarkResult run_case(const std::string &name, long long size, const BenchmarkOptions &options,
+                         long long max_iterations, const std::function<uint64_t()> &func) {
+    // Run in doubling batches, so reading the clock does not dominate short cases
+    long long iterations = 0;
+    long long batch = 1;
+    double start = now_seconds();
+    double elapsed = 0;
+    while (true) {
+        for (long long i = 0; i < batch; i++) {
+            g_sink += func();
+        }
+        iterations += batch;
+        elapsed = now_seconds() - start;
+        if (elapsed >= options.min_time || iterations >= max_iterations) {
+            break;
+        }
+        batch = std::min(batch * 2, max_iterations - iterations);
+    }
+    return BenchmarkResult{name, size, iterations, elapsed};
+}
+
+std::vector<long long> get_sizes(long long max_size) {
+    // Bytes to hundreds of MB
+    const long long sizes[] = {
+        1, 3, 16, 64, 256, 1024, 4 * 1024, 16 * 1024, 64 * 1024, 256 * 1024,
+        1024 * 1024, 4 * 1024 * 1024, 16 * 1024 * 1024, 64 * 1024 * 1024, 128 * 1024 * 1024, 256 * 1024 * 1024,
+    };
+    std::vector<long long> result;
+    for (long long size : sizes) {
+        if (size <= max_size) {
+            result.push_back(size);
+        }
+    }
+    return result;
+}
+
+bool match_filter(const BenchmarkOptions &options, const std::string &name) {
+    return options.filter.empty() || name.find(options.filter) != std::string::npos;
+}
+
+void run_base64_cases(const BenchmarkOptions &options, std::vector<BenchmarkResult> &results) {
+    if (!match_filter(options, "base64_encode") && !match_filter(options, "base64_decode") && !match_filter(options, "base64_dec_len")
+        && !match_filter(options, "base64_encode_stream") && !match_filter(options, "base64_decode_stream")
+        && !match_filter(options, "base64_encode_parallel") && !match_filter(options, "base64_decode_parallel")) {
+        return;
+    }
+    // Chunk size of the incremental API cases
+    const size_t chunk = 64 * 1024;
+    std::vector<char> chunk_output((chunk + 2) / 3 * 4 + 4);
+    for (long long size : get_sizes(options.max_size)) {
+        if ((size + 2) / 3 * 4 > INT_MAX) {
+            // `base64_enc_len`/`base64_encode` return the encoded length as int
+            fprintf(stderr, "Skip base64 size %lld, it exceeds the int lengths of the base64 API\n", size);
+            continue;
+        }
+        std::vector<char> input(size);
+        uint32_t seed = 0x12345678;
+        for (long long i = 0; i < size; i++) {
+            seed = seed * 1103515245 + 12345;
+            input[i] = (char)(seed >> 16);
+        }
+
+        int encoded_len = base64_enc_len((int)size);
+        std::vector<char> encoded(encoded_len + 1);
+        int written = base64_encode(encoded.data(), input.data(), (int)size);
+        std::vector<char> decoded(base64_dec_len(encoded.data(), written) + 1);
+
+        // Large inputs run few iterations anyway, small inputs run many short ones
+        long long max_iterations = 100000000LL / size + 1;
+
+        if (match_filter(options, "base64_encode")) {
+            results.push_back(run_case("base64_encode", size, options, max_iterations, [&]() {
+                return (uint64_t)base64_encode(encoded.data(), input.data(), (int)size);
+            }));
+        }
+        if (match_filter(options, "base64_decode")) {
+            results.push_back(run_case("base64_decode", size, options, max_iterations, [&]() {
+                return (uint64_t)base64_decode(decoded.data(), encoded.data(), written);
+            }));
+        }
+        if (match_filter(options, "base64_dec_len")) {
+            results.push_back(run_case("base64_dec_len", written, options, max_iterations, [&]() {
+                return (uint64_t)base64_dec_len(encoded.data(), written);
+            }));
+        }
+        if (match_filter(options, "base64_encode_stream")) {
+            results.push_back(run_case("base64_encode_stream", size, options, max_iterations, [&]() {
+                base64_encode_state state;
+                base64_encode_init(&state);
+                uint64_t total = 0;
+                for (long long offset = 0; offset < size; offset += chunk) {
+                    size_t length = std::min((size_t)(size - offset), chunk);
+                    total += base64_encode_update(&state, chunk_output.data(), input.data() + offset, length);
+                }
+                return total + base64_encode_final(&state, chunk_output.data());
+            }));
+        }
+        if (match_filter(options, "base64_decode_stream")) {
+            results.push_back(run_case("base64_decode_stream", size, options, max_iterations, [&]() {
+                base64_decode_state state;
+                base64_decode_init(&state);
+                uint64_t total = 0;
+                size_t output_length = 0;
+                for (long long offset = 0; offset < written; offset += chunk) {
+                    size_t length = std::min((size_t)(written - offset), chunk);
+                    base64_decode_update(&state, chunk_output.data(), &output_length, encoded.data() + offset, length);
+                    total += output_length;
+                }
+                base64_decode_final(&state, chunk_output.data(), &output_length);
+                return total + output_length;
+            }));
+        }
+        // Smaller inputs stay on the calling thread
+        if (size >= BASE64_PARALLEL_THRESHOLD && match_filter(options, "base64_encode_parallel")) {
+            results.push_back(run_case("base64_encode_parallel", size, options, max_iterations, [&]() {
+                return (uint64_t)base64_encode_parallel(encoded.data(), input.data(), size, nullptr);
+            }));
+        }
+        if (size >= BASE64_PARALLEL_THRESHOLD && match_filter(options, "base64_decode_parallel")) {
+            results.push_back(run_case("base64_decode_parallel", size, options, max_iterations, [&]() {
+                return (uint64_t)base64_decode_parallel(decoded.data(), encoded.data(), written, nullptr);
+            }));
+        }
+    }
+}
+
+void run_message_cases(const BenchmarkOptions &options, std::vector<BenchmarkResult> &results) {
+    if (match_filter(options, "gn_build_example_get_message_raw")) {
+        results.push_back(run_case("gn_build_example_get_message_raw", 0, options, 100000000LL, []() {
+            return (uint64_t)(uintptr_t)gn_build_example_get_message(gn_build_example_message_type_raw);
+        }));
+    }
+    if (match_filter(options, "gn_build_example_get_message_base64")) {
+        results.push_back(run_case("gn_build_example_get_message_base64", 0, options, 100000000LL, []() {
+            return (uint64_t)(uintptr_t)gn_build_example_get_message(gn_build_example_message_type_base_64);
+        }));
+    }
+    if (match_filter(options, "gn_build_example_get_message_into_base64")) {
+        char buffer[256];
+        results.push_back(run_case("gn_build_example_get_message_into_base64", 0, options, 100000000LL, [&buffer]() {
+            return (uint64_t)gn_build_example_get_message_into(gn_build_example_message_type_base_64, buffer, sizeof(buffer));
+        }));
+    }
+}
+
+std::string to_json(const BenchmarkOptions &options, const std::vector<BenchmarkResult> &results) {
+    std::string json = "{\n";
+    json += "  \"version\": \"" + std::string(gn_build_example_get_version()) + "\",\n";
+    json += "  \"min_time\": " + std::to_string(options.min_time) + ",\n";
+    json += "  \"results\": [";
+    char buffer[512];
+    for (size_t i = 0; i < results.size(); i++) {
+        const BenchmarkResult &result = results[i];
+        double ns_per_op = result.seconds * 1e9 / result.iterations;
+        double mb_per_s = result.size > 0 && result.seconds > 0
+            ? (double)result.size * result.iterations / result.seconds / (1024 * 1024) : 0;
+        snprintf(buffer, sizeof(buffer),
+                 "%s\n    {\"name\": \"%s\", \"size\": %lld, \"iterations\": %lld, \"seconds\": %.6f, \"ns_per_op\": %.3f, \"mb_per_s\": %.3f}",
+                 i == 0 ? "" : ",", result.name.c_str(), result.size, result.iterations, result.seconds, ns_per_op, mb_per_s);
+        json += buffer;
+    }
+    json += "\n  ]\n}\n";
+    return json;
+}
+
+bool parse_options(int argc, char *argv[], BenchmarkOptions &options) {
+    for (int i = 1; i < argc; i++) {
+        std::string arg = argv[i];
+        if (i + 1 >= argc) {
+            fprintf(stderr, "Missing value of %s\n", arg.c_str());
+            return false;
+        }
+        if (arg == "--json") {
+            options.json_path = argv[++i];
+        } else if (arg == "--max-size") {
+            options.max_size = atoll(argv[++i]);
+        } else if (arg == "--min-time") {
+            options.min_time = atof(argv[++i]);
+        } else if (arg == "--filter") {
+            options.filter = argv[++i];
+        } else {
+            fprintf(stderr, "Unknown option: %s\n", arg.c_str());
+            return false;
+        }
+    }
+    return true;
+}
+
+} // namespace
+
+int main(int argc, char *argv[]) {
+    BenchmarkOptions options;
+    if (!parse_options(argc, argv, options)) {
+        fprintf(stderr, "Usage: %s [--json PATH] [--max-size BYTES] [--min-time SECONDS] [--filter NAME]\n", argv[0]);
+        return 2;
+    }
+
+    std::vector<BenchmarkResult> results;
+    run_base64_cases(options, results);
+    run_message_cases(options, results);
+
+    std::string json = to_json(options, results);
+    if (options.json_path.empty()) {
+        fputs(json.c_str(), stdout);
+        return 0;
+    }
+    FILE *file = fopen(options.json_path.c_str(), "w");
+    if (file == nullptr) {
+        fprintf(stderr, "Failed to open: %s\n", options.json_path.c_str());
+        return 1;
+    }
+    fputs(json.c_str(), file);
+    fclose(file);
+    return 0;
+}
@@ -1,6 +1,30 @@
 #include "src/common/include/gn_build_example.h"
 #include "src/common/module/base64/Base64.h"
 #include <string>
+#include <cstring>
+
+#ifndef GBE_CUSTOM_MESSAGE
+#define GBE_CUSTOM_MESSAGE "Hello World!" // Default message
+#endif
+
+namespace {
+
+const char kUnknownTypeMessage[] = "Unknown type";
+
+const std::string &get_base64_message() {
+    // Encoded once on first use, the initialization of a function-local static is thread-safe since C++11
+    static const std::string encoded_message = []() {
+        const char *raw_message = GBE_CUSTOM_MESSAGE;
+        int raw_length = (int)strlen(raw_message);
+        std::string encoded(base64_enc_len(raw_length) + 1, '\0');
+        int encoded_length = base64_encode(&encoded[0], (char *)raw_message, raw_length);
+        encoded.resize(encoded_length);
+        return encoded;
+    }();
+    return encoded_message;
+}
+
+} // namespace
 
 const char * gn_build_example_get_version() {
 #ifndef GBE_VERSION
@@ -10,20 +34,34 @@ const char * gn_build_example_get_version() {
 }
 
 const char * gn_build_example_get_message(enum gn_build_example_message_type type) {
+    if (type == gn_build_example_message_type_raw) {
+        return GBE_CUSTOM_MESSAGE;
+    } else if (type == gn_build_example_message_type_base_64) {
+        return get_base64_message().c_str();
+    } else {
+        return kUnknownTypeMessage;
+    }
+}
 
-#ifndef GBE_CUSTOM_MESSAGE
-#define GBE_CUSTOM_MESSAGE "Hello World!" // Default message
-#endif
-    const char *raw_message = GBE_CUSTOM_MESSAGE;
+size_t gn_build_example_get_message_into(enum gn_build_example_message_type type, char *buffer, size_t buffer_length) {
+    size_t message_length = 0;
+    const char *message = nullptr;
     if (type == gn_build_example_message_type_raw) {
-        return raw_message;
+        message = GBE_CUSTOM_MESSAGE;
+        message_length = sizeof(GBE_CUSTOM_MESSAGE) - 1;
     } else if (type == gn_build_example_message_type_base_64) {
-        int raw_length = strlen(raw_message);
-        int encoded_length = base64_enc_len(raw_length);
-        char *encoded_message = new char[encoded_length];
-        base64_encode(encoded_message, (char *)raw_message, raw_length);
-        return encoded_message;
+        const std::string &encoded_message = get_base64_message();
+        message = encoded_message.c_str();
+        message_length = encoded_message.size();
     } else {
-        return "Unknown type";
+        message = kUnknownTypeMessage;
+        message_length = sizeof(kUnknownTypeMessage) - 1;
+    }
+
+    if (buffer != nullptr && buffer_length > 0) {
+        size_t copy_length = message_length < buffer_length - 1 ? message_length : buffer_length - 1;
+        memcpy(buffer, message, copy_length);
+        buffer[copy_length] = '\0';
     }
+    return message_length;
 }
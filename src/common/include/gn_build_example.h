@@ -3,6 +3,8 @@
 
 #include "gn_build_example_defines.h"
 
+#include <stddef.h>
+
 GBE_BEGIN_DECLS
 
 /**
@@ -14,10 +16,19 @@ GBE_API const char * GBE_CALL gn_build_example_get_version();
 /**
  * Get message
  * @param type message type
- * @return message
+ * @return message, a static string owned by the library, do not free it
  */
 GBE_API const char * GBE_CALL gn_build_example_get_message(enum gn_build_example_message_type type);
 
+/**
+ * Copy message into a caller-supplied buffer, without any heap allocation
+ * @param type message type
+ * @param buffer destination, the copied message is truncated to `buffer_length - 1` chars and always null-terminated, may be NULL if `buffer_length` is 0
+ * @param buffer_length size of `buffer` in bytes
+ * @return length of the whole message (excluding the terminating null), the message was truncated if it is greater than or equal to `buffer_length`
+ */
+GBE_API size_t GBE_CALL gn_build_example_get_message_into(enum gn_build_example_message_type type, char *buffer, size_t buffer_length);
+
 GBE_END_DECLS
 
 #endif //__GN_BUILD_EXAMPLE_H__
\ No newline at end of file
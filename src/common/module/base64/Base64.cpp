@@ -1,4 +1,8 @@
 #include "Base64.h"
+#include "Base64Engine.h"
+
+#include <string.h>
+
 const char b64_alphabet[] = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
 		"abcdefghijklmnopqrstuvwxyz"
 		"0123456789+/";
@@ -14,20 +18,20 @@ int base64_encode(char *output, char *input, int inputLen) {
 	unsigned char a3[3];
 	unsigned char a4[4];
 
-	while(inputLen--) {
-		a3[i++] = *(input++);
-		if(i == 3) {
-			a3_to_a4(a4, a3);
-
-			for(i = 0; i < 4; i++) {
-				output[encLen++] = b64_alphabet[a4[i]];
-			}
-
-			i = 0;
-		}
+	if (inputLen < 0) {
+		inputLen = 0;
 	}
 
+	/* Complete 3-byte blocks */
+	int consumed = (int)gbe_base64::encode_blocks(output, (const unsigned char *)input, (size_t)inputLen);
+	encLen = consumed / 3 * 4;
+	input += consumed;
+	i = inputLen - consumed;
+
 	if(i) {
+		for(j = 0; j < i; j++) {
+			a3[j] = input[j];
+		}
 		for(j = i; j < 3; j++) {
 			a3[j] = '\0';
 		}
@@ -52,28 +56,24 @@ int base64_decode(char * output, char * input, int inputLen) {
 	unsigned char a3[3];
 	unsigned char a4[4];
 
+	if (inputLen < 0) {
+		inputLen = 0;
+	}
 
-	while (inputLen--) {
-		if(*input == '=') {
-			break;
-		}
-
-		a4[i++] = *(input++);
-		if (i == 4) {
-			for (i = 0; i <4; i++) {
-				a4[i] = b64_lookup(a4[i]);
-			}
-
-			a4_to_a3(a3,a4);
+	/* Complete blocks before the first '=' */
+	int consumed = (int)gbe_base64::decode_blocks_lenient((unsigned char *)output, input, (size_t)inputLen);
+	decLen = consumed / 4 * 3;
+	input += consumed;
+	inputLen -= consumed;
 
-			for (i = 0; i < 3; i++) {
-				output[decLen++] = a3[i];
-			}
-			i = 0;
-		}
+	/* Decoding stops at the first '=' */
+	for (i = 0; i < inputLen && input[i] != '='; i++) {
 	}
 
 	if (i) {
+		for (j = 0; j < i; j++) {
+			a4[j] = input[j];
+		}
 		for (j = i; j < 4; j++) {
 			a4[j] = '\0';
 		}
@@ -100,11 +100,154 @@ int base64_enc_len(int plainLen) {
 int base64_dec_len(char * input, int inputLen) {
 	int i = 0;
 	int numEq = 0;
-	for(i = inputLen - 1; input[i] == '='; i--) {
+	for(i = inputLen - 1; i >= 0 && input[i] == '='; i--) {
 		numEq++;
 	}
 
-	return ((6 * inputLen) / 8) - numEq;
+	/* 64-bit, `6 * inputLen` overflows int for large inputs */
+	return (int)((6 * (long long)inputLen) / 8) - numEq;
+}
+
+/*
+ * Incremental encoding / decoding
+ */
+
+void base64_encode_init(base64_encode_state *state) {
+	state->blockLen = 0;
+}
+
+size_t base64_encode_update(base64_encode_state *state, char *output, const char *input, size_t inputLen) {
+	const unsigned char *in = (const unsigned char *)input;
+	size_t encLen = 0;
+
+	/* Complete the block left by the previous chunk */
+	if (state->blockLen) {
+		while (state->blockLen < 3 && inputLen) {
+			state->block[state->blockLen++] = *(in++);
+			inputLen--;
+		}
+		if (state->blockLen < 3) {
+			return 0;
+		}
+		gbe_base64::encode_blocks(output, state->block, 3);
+		encLen = 4;
+		state->blockLen = 0;
+	}
+
+	size_t consumed = gbe_base64::encode_blocks(output + encLen, in, inputLen);
+	encLen += consumed / 3 * 4;
+	while (consumed < inputLen) {
+		state->block[state->blockLen++] = in[consumed++];
+	}
+	return encLen;
+}
+
+size_t base64_encode_final(base64_encode_state *state, char *output) {
+	int i = (int)state->blockLen;
+	int j = 0;
+	unsigned char a4[4];
+
+	state->blockLen = 0;
+	if (!i) {
+		return 0;
+	}
+	for (j = i; j < 3; j++) {
+		state->block[j] = '\0';
+	}
+	a3_to_a4(a4, state->block);
+	for (j = 0; j < 4; j++) {
+		output[j] = j <= i ? b64_alphabet[a4[j]] : '=';
+	}
+	return 4;
+}
+
+void base64_decode_init(base64_decode_state *state) {
+	state->blockLen = 0;
+	state->numEq = 0;
+	state->finished = 0;
+	state->failed = 0;
+}
+
+/* Decode one char through the context, returns the number of bytes written or -1 */
+static int base64_decode_char(base64_decode_state *state, unsigned char *output, char c) {
+	unsigned char a3[3];
+
+	if (state->finished) {
+		return -1;
+	}
+	if (c == '=') {
+		if (state->blockLen < 2) {
+			return -1;
+		}
+		state->numEq++;
+		state->block[state->blockLen++] = 0;
+	} else {
+		unsigned char value = b64_lookup(c);
+		if (state->numEq || (value & 0x80)) {
+			return -1;
+		}
+		state->block[state->blockLen++] = value;
+	}
+	if (state->blockLen < 4) {
+		return 0;
+	}
+
+	a4_to_a3(a3, state->block);
+	int decLen = 3 - (int)state->numEq;
+	memcpy(output, a3, decLen);
+	state->finished = state->numEq != 0;
+	state->blockLen = 0;
+	return decLen;
+}
+
+int base64_decode_update(base64_decode_state *state, char *output, size_t *outputLen, const char *input, size_t inputLen) {
+	unsigned char *out = (unsigned char *)output;
+	size_t decLen = 0;
+	size_t i = 0;
+
+	*outputLen = 0;
+	if (state->failed) {
+		return -1;
+	}
+	while (i < inputLen) {
+		/* Whole blocks while the context holds no partial block */
+		if (!state->blockLen && !state->finished) {
+			size_t consumed = gbe_base64::decode_blocks(out + decLen, input + i, inputLen - i);
+			decLen += consumed / 4 * 3;
+			i += consumed;
+			if (i == inputLen) {
+				break;
+			}
+		}
+		int written = base64_decode_char(state, out + decLen, input[i++]);
+		if (written < 0) {
+			state->failed = 1;
+			*outputLen = decLen;
+			return -1;
+		}
+		decLen += written;
+	}
+	*outputLen = decLen;
+	return 0;
+}
+
+int base64_decode_final(base64_decode_state *state, char *output, size_t *outputLen) {
+	unsigned char a3[3];
+	size_t blockLen = state->blockLen;
+	int failed = state->failed || (blockLen && state->numEq) || blockLen == 1;
+
+	*outputLen = 0;
+	if (!failed && blockLen) {
+		/* Unpadded final block */
+		for (size_t j = blockLen; j < 4; j++) {
+			state->block[j] = 0;
+		}
+		a4_to_a3(a3, state->block);
+		memcpy(output, a3, blockLen - 1);
+		*outputLen = blockLen - 1;
+	}
+	base64_decode_init(state);
+	return failed ? -1 : 0;
 }
 
 inline void a3_to_a4(unsigned char * a4, unsigned char * a3) {
@@ -121,10 +264,5 @@ inline void a4_to_a3(unsigned char * a3, unsigned char * a4) {
 }
 
 inline unsigned char b64_lookup(char c) {
-	if(c >='A' && c <='Z') return c - 'A';
-	if(c >='a' && c <='z') return c - 71;
-	if(c >='0' && c <='9') return c + 4;
-	if(c == '+') return 62;
-	if(c == '/') return 63;
-	return -1;
+	return gbe_base64::decode_table[(unsigned char)c];
 }
@@ -5,6 +5,8 @@
 #ifndef _BASE64_H
 #define _BASE64_H
 
+#include <stddef.h>
+
 /* b64_alphabet:
  * 		Description: Base64 alphabet table, a mapping between integers
  * 					 and base64 digits
@@ -76,4 +78,157 @@ int base64_enc_len(int inputLen);
  */
 int base64_dec_len(char *input, int inputLen);
 
+/* base64_encode_state / base64_decode_state:
+ * 		Description:
+ * 			Context of an incremental encoding / decoding, carries the
+ * 			partial 3-byte block / 4-char block between calls
+ * 		Notes: Initialize with base64_encode_init / base64_decode_init,
+ * 			   the fields are private
+ */
+typedef struct base64_encode_state {
+	unsigned char block[3];
+	size_t blockLen;
+} base64_encode_state;
+
+typedef struct base64_decode_state {
+	unsigned char block[4];
+	size_t blockLen;
+	size_t numEq;
+	int finished;
+	int failed;
+} base64_decode_state;
+
+/* base64_encode_init:
+ * 		Description:
+ * 			Start an incremental encoding
+ * 		Parameters:
+ * 			state: the encoding context
+ */
+void base64_encode_init(base64_encode_state *state);
+
+/* base64_encode_update:
+ * 		Description:
+ * 			Encode the next chunk of the input, the bytes which do not
+ * 			complete a 3-byte block are kept in the context
+ * 		Parameters:
+ * 			state: the encoding context
+ * 			output: the output buffer, at least (inputLen + 2) / 3 * 4 chars,
+ * 					not null-terminated
+ * 			input: the next chunk of the binary to be encoded
+ * 			inputLen: the length of the chunk, in bytes
+ * 		Return value:
+ * 			Returns the number of chars written into output
+ */
+size_t base64_encode_update(base64_encode_state *state, char *output, const char *input, size_t inputLen);
+
+/* base64_encode_final:
+ * 		Description:
+ * 			Encode the bytes left in the context with '=' padding, and
+ * 			reset the context
+ * 		Parameters:
+ * 			state: the encoding context
+ * 			output: the output buffer, at least 4 chars, not null-terminated
+ * 		Return value:
+ * 			Returns the number of chars written into output, 0 or 4
+ */
+size_t base64_encode_final(base64_encode_state *state, char *output);
+
+/* base64_decode_init:
+ * 		Description:
+ * 			Start an incremental decoding
+ * 		Parameters:
+ * 			state: the decoding context
+ */
+void base64_decode_init(base64_decode_state *state);
+
+/* base64_decode_update:
+ * 		Description:
+ * 			Decode the next chunk of a base64 encoded string, the chars
+ * 			which do not complete a 4-char block are kept in the context
+ * 		Parameters:
+ * 			state: the decoding context
+ * 			output: the output buffer, at least (inputLen + 3) / 4 * 3 bytes
+ * 			outputLen: stores the number of bytes written into output
+ * 			input: the next chunk of the base64 string to be decoded
+ * 			inputLen: the length of the chunk, in bytes
+ * 		Return value:
+ * 			Returns 0 on success, -1 if the input is not valid base64
+ * 			(chars out of the alphabet, misplaced '=' or chars after the
+ * 			padding), the context fails all following calls
+ */
+int base64_decode_update(base64_decode_state *state, char *output, size_t *outputLen, const char *input, size_t inputLen);
+
+/* base64_decode_final:
+ * 		Description:
+ * 			Decode the chars left in the context, the final block may be
+ * 			unpadded, and reset the context
+ * 		Parameters:
+ * 			state: the decoding context
+ * 			output: the output buffer, at least 2 bytes
+ * 			outputLen: stores the number of bytes written into output
+ * 		Return value:
+ * 			Returns 0 on success, -1 if the input was not valid base64
+ * 			or ends with an incomplete block
+ */
+int base64_decode_final(base64_decode_state *state, char *output, size_t *outputLen);
+
+/* BASE64_PARALLEL_THRESHOLD:
+ * 		Description:
+ * 			Inputs shorter than this many bytes are processed on the calling
+ * 			thread by base64_encode_parallel / base64_decode_parallel
+ */
+#define BASE64_PARALLEL_THRESHOLD (1024 * 1024)
+
+/* base64_thread_pool:
+ * 		Description:
+ * 			Worker threads of base64_encode_parallel / base64_decode_parallel,
+ * 			may be shared by concurrent calls
+ */
+typedef struct base64_thread_pool base64_thread_pool;
+
+/* base64_thread_pool_create:
+ * 		Description:
+ * 			Start a worker pool
+ * 		Parameters:
+ * 			numThreads: the number of worker threads, 0 for one less than the
+ * 						number of CPUs (the calling thread works as well)
+ * 		Return value:
+ * 			Returns the pool, release it with base64_thread_pool_destroy
+ */
+base64_thread_pool *base64_thread_pool_create(size_t numThreads);
+
+/* base64_thread_pool_destroy:
+ * 		Description:
+ * 			Stop the workers and release the pool, no call may still use it
+ */
+void base64_thread_pool_destroy(base64_thread_pool *pool);
+
+/* base64_encode_parallel:
+ * 		Description:
+ * 			Encode like base64_encode, splitting the input at 3-byte
+ * 			boundaries and encoding the chunks on a worker pool
+ * 		Parameters:
+ * 			output: the output buffer, at least (inputLen + 2) / 3 * 4 + 1 chars
+ * 			input: the binary to be encoded
+ * 			inputLen: the length of the input buffer, in bytes
+ * 			pool: the worker pool, NULL for a pool shared by the process
+ * 		Return value:
+ * 			Returns the length of the encoded string
+ */
+size_t base64_encode_parallel(char *output, const char *input, size_t inputLen, base64_thread_pool *pool);
+
+/* base64_decode_parallel:
+ * 		Description:
+ * 			Decode like base64_decode, splitting the input at 4-char
+ * 			boundaries and decoding the chunks on a worker pool
+ * 		Parameters:
+ * 			output: the output buffer, at least inputLen / 4 * 3 + 3 bytes
+ * 			input: the base64 string to be decoded
+ * 			inputLen: the length of the input buffer, in bytes
+ * 			pool: the worker pool, NULL for a pool shared by the process
+ * 		Return value:
+ * 			Returns the length of the decoded string
+ */
+size_t base64_decode_parallel(char *output, const char *input, size_t inputLen, base64_thread_pool *pool);
+
 #endif // _BASE64_H
@@ -0,0 +1,389 @@
+#include "Base64Engine.h"
+
+#include <stdint.h>
+#include <string.h>
+
+#if (defined(__x86_64__) || defined(__i386__)) && defined(__GNUC__)
+#define GBE_BASE64_X86 1
+#include <immintrin.h>
+#elif defined(__aarch64__) && defined(__ARM_NEON)
+#define GBE_BASE64_NEON 1
+#include <arm_neon.h>
+#endif
+
+namespace gbe_base64 {
+
+const unsigned char decode_table[256] = {
+	0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF,
+	0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF,
+	0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0x3E, 0xFF, 0xFF, 0xFF, 0x3F,
+	0x34, 0x35, 0x36, 0x37, 0x38, 0x39, 0x3A, 0x3B, 0x3C, 0x3D, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF,
+	0xFF, 0x00, 0x01, 0x02, 0x03, 0x04, 0x05, 0x06, 0x07, 0x08, 0x09, 0x0A, 0x0B, 0x0C, 0x0D, 0x0E,
+	0x0F, 0x10, 0x11, 0x12, 0x13, 0x14, 0x15, 0x16, 0x17, 0x18, 0x19, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF,
+	0xFF, 0x1A, 0x1B, 0x1C, 0x1D, 0x1E, 0x1F, 0x20, 0x21, 0x22, 0x23, 0x24, 0x25, 0x26, 0x27, 0x28,
+	0x29, 0x2A, 0x2B, 0x2C, 0x2D, 0x2E, 0x2F, 0x30, 0x31, 0x32, 0x33, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF,
+	0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF,
+	0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF,
+	0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF,
+	0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF,
+	0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF,
+	0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF,
+	0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF,
+	0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF,
+};
+
+static const char encode_alphabet[] = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+		"abcdefghijklmnopqrstuvwxyz"
+		"0123456789+/";
+
+/* Two base64 chars of every 12-bit value */
+struct EncodePairTable {
+	char pairs[4096 * 2];
+
+	EncodePairTable() {
+		for (int i = 0; i < 4096; i++) {
+			pairs[i * 2] = encode_alphabet[i >> 6];
+			pairs[i * 2 + 1] = encode_alphabet[i & 0x3f];
+		}
+	}
+};
+
+static const EncodePairTable &get_encode_pair_table() {
+	static const EncodePairTable table;
+	return table;
+}
+
+/*
+ * Scalar
+ */
+
+static size_t encode_blocks_scalar(char *output, const unsigned char *input, size_t inputLen) {
+	const char *pairs = get_encode_pair_table().pairs;
+	size_t blocks = inputLen / 3;
+	for (size_t i = 0; i < blocks; i++) {
+		uint32_t v = ((uint32_t)input[0] << 16) | ((uint32_t)input[1] << 8) | input[2];
+		memcpy(output, pairs + (v >> 12) * 2, 2);
+		memcpy(output + 2, pairs + (v & 0xfff) * 2, 2);
+		input += 3;
+		output += 4;
+	}
+	return blocks * 3;
+}
+
+static size_t decode_blocks_scalar(unsigned char *output, const char *input, size_t inputLen) {
+	const unsigned char *in = (const unsigned char *)input;
+	size_t consumed = 0;
+	while (inputLen - consumed >= 4) {
+		uint32_t a = decode_table[in[0]];
+		uint32_t b = decode_table[in[1]];
+		uint32_t c = decode_table[in[2]];
+		uint32_t d = decode_table[in[3]];
+		if ((a | b | c | d) & 0x80) {
+			break; // '=' or an invalid char, left to the caller
+		}
+		uint32_t v = (a << 18) | (b << 12) | (c << 6) | d;
+		output[0] = (unsigned char)(v >> 16);
+		output[1] = (unsigned char)(v >> 8);
+		output[2] = (unsigned char)v;
+		in += 4;
+		output += 3;
+		consumed += 4;
+	}
+	return consumed;
+}
+
+#if defined(GBE_BASE64_X86)
+
+/*
+ * SSSE3 / AVX2, selected at runtime
+ * Based on the algorithms of Wojciech Muła and Daniel Lemire (http://0x80.pl/articles/index.html#base64-algorithm-new)
+ */
+
+/* 6-bit values of 12 bytes (in each 128-bit lane) to ASCII */
+__attribute__((target("ssse3")))
+static inline __m128i encode_translate_ssse3(__m128i indices) {
+	const __m128i shift_lut = _mm_setr_epi8('a' - 26, '0' - 52, '0' - 52, '0' - 52, '0' - 52, '0' - 52,
+		'0' - 52, '0' - 52, '0' - 52, '0' - 52, '0' - 52, '+' - 62, '/' - 63, 'A', 0, 0);
+	__m128i result = _mm_subs_epu8(indices, _mm_set1_epi8(51));
+	const __m128i less = _mm_cmpgt_epi8(_mm_set1_epi8(26), indices);
+	result = _mm_or_si128(result, _mm_and_si128(less, _mm_set1_epi8(13)));
+	result = _mm_shuffle_epi8(shift_lut, result);
+	return _mm_add_epi8(result, indices);
+}
+
+__attribute__((target("ssse3")))
+static size_t encode_blocks_ssse3(char *output, const unsigned char *input, size_t inputLen) {
+	size_t consumed = 0;
+	// Loads 16 bytes for every 12 bytes encoded
+	while (inputLen - consumed >= 16) {
+		__m128i in = _mm_loadu_si128((const __m128i *)(input + consumed));
+		in = _mm_shuffle_epi8(in, _mm_set_epi8(10, 11, 9, 10, 7, 8, 6, 7, 4, 5, 3, 4, 1, 2, 0, 1));
+		const __m128i t0 = _mm_and_si128(in, _mm_set1_epi32(0x0fc0fc00));
+		const __m128i t1 = _mm_mulhi_epu16(t0, _mm_set1_epi32(0x04000040));
+		const __m128i t2 = _mm_and_si128(in, _mm_set1_epi32(0x003f03f0));
+		const __m128i t3 = _mm_mullo_epi16(t2, _mm_set1_epi32(0x01000010));
+		_mm_storeu_si128((__m128i *)output, encode_translate_ssse3(_mm_or_si128(t1, t3)));
+		consumed += 12;
+		output += 16;
+	}
+	return consumed + encode_blocks_scalar(output, input + consumed, inputLen - consumed);
+}
+
+__attribute__((target("avx2")))
+static size_t encode_blocks_avx2(char *output, const unsigned char *input, size_t inputLen) {
+	const __m256i shuffle = _mm256_set_epi8(10, 11, 9, 10, 7, 8, 6, 7, 4, 5, 3, 4, 1, 2, 0, 1,
+		10, 11, 9, 10, 7, 8, 6, 7, 4, 5, 3, 4, 1, 2, 0, 1);
+	const __m256i shift_lut = _mm256_setr_epi8('a' - 26, '0' - 52, '0' - 52, '0' - 52, '0' - 52, '0' - 52,
+		'0' - 52, '0' - 52, '0' - 52, '0' - 52, '0' - 52, '+' - 62, '/' - 63, 'A', 0, 0,
+		'a' - 26, '0' - 52, '0' - 52, '0' - 52, '0' - 52, '0' - 52,
+		'0' - 52, '0' - 52, '0' - 52, '0' - 52, '0' - 52, '+' - 62, '/' - 63, 'A', 0, 0);
+	size_t consumed = 0;
+	// Loads 12 bytes into each lane, reading 28 bytes for every 24 bytes encoded
+	while (inputLen - consumed >= 28) {
+		const __m128i lo = _mm_loadu_si128((const __m128i *)(input + consumed));
+		const __m128i hi = _mm_loadu_si128((const __m128i *)(input + consumed + 12));
+		__m256i in = _mm256_inserti128_si256(_mm256_castsi128_si256(lo), hi, 1);
+		in = _mm256_shuffle_epi8(in, shuffle);
+		const __m256i t0 = _mm256_and_si256(in, _mm256_set1_epi32(0x0fc0fc00));
+		const __m256i t1 = _mm256_mulhi_epu16(t0, _mm256_set1_epi32(0x04000040));
+		const __m256i t2 = _mm256_and_si256(in, _mm256_set1_epi32(0x003f03f0));
+		const __m256i t3 = _mm256_mullo_epi16(t2, _mm256_set1_epi32(0x01000010));
+		const __m256i indices = _mm256_or_si256(t1, t3);
+
+		__m256i result = _mm256_subs_epu8(indices, _mm256_set1_epi8(51));
+		const __m256i less = _mm256_cmpgt_epi8(_mm256_set1_epi8(26), indices);
+		result = _mm256_or_si256(result, _mm256_and_si256(less, _mm256_set1_epi8(13)));
+		result = _mm256_shuffle_epi8(shift_lut, result);
+		result = _mm256_add_epi8(result, indices);
+		_mm256_storeu_si256((__m256i *)output, result);
+		consumed += 24;
+		output += 32;
+	}
+	// Avoids the AVX-SSE transition penalty in the SSSE3 code
+	_mm256_zeroupper();
+	return consumed + encode_blocks_ssse3(output, input + consumed, inputLen - consumed);
+}
+
+/* Validate and translate 16 chars (in each 128-bit lane) to 6-bit values, sets `valid` to false on '=' or other chars */
+__attribute__((target("ssse3")))
+static inline __m128i decode_translate_ssse3(__m128i in, bool &valid) {
+	const __m128i shift_lut = _mm_setr_epi8(0, 0, 19, 4, -65, -65, -71, -71, 0, 0, 0, 0, 0, 0, 0, 0);
+	const __m128i mask_lut = _mm_setr_epi8(
+		(char)0xa8, (char)0xf8, (char)0xf8, (char)0xf8, (char)0xf8, (char)0xf8, (char)0xf8, (char)0xf8,
+		(char)0xf8, (char)0xf8, (char)0xf0, 0x54, 0x50, 0x50, 0x50, 0x54);
+	const __m128i bitpos_lut = _mm_setr_epi8(0x01, 0x02, 0x04, 0x08, 0x10, 0x20, 0x40, (char)0x80,
+		0, 0, 0, 0, 0, 0, 0, 0);
+	const __m128i higher_nibble = _mm_and_si128(_mm_srli_epi32(in, 4), _mm_set1_epi8(0x0f));
+	const __m128i lower_nibble = _mm_and_si128(in, _mm_set1_epi8(0x0f));
+	const __m128i m = _mm_shuffle_epi8(mask_lut, lower_nibble);
+	const __m128i bit = _mm_shuffle_epi8(bitpos_lut, higher_nibble);
+	const __m128i non_match = _mm_cmpeq_epi8(_mm_and_si128(m, bit), _mm_setzero_si128());
+	valid = _mm_movemask_epi8(non_match) == 0;
+
+	// '/' is the only char whose shift differs from the other chars of its higher nibble
+	const __m128i eq_slash = _mm_cmpeq_epi8(in, _mm_set1_epi8('/'));
+	const __m128i shift = _mm_or_si128(_mm_andnot_si128(eq_slash, _mm_shuffle_epi8(shift_lut, higher_nibble)),
+		_mm_and_si128(eq_slash, _mm_set1_epi8(16)));
+	return _mm_add_epi8(in, shift);
+}
+
+__attribute__((target("ssse3")))
+static size_t decode_blocks_ssse3(unsigned char *output, const char *input, size_t inputLen) {
+	size_t consumed = 0;
+	while (inputLen - consumed >= 16) {
+		bool valid = true;
+		const __m128i values = decode_translate_ssse3(_mm_loadu_si128((const __m128i *)(input + consumed)), valid);
+		if (!valid) {
+			break;
+		}
+		const __m128i merged = _mm_maddubs_epi16(values, _mm_set1_epi32(0x01400140));
+		const __m128i packed = _mm_madd_epi16(merged, _mm_set1_epi32(0x00011000));
+		const __m128i out = _mm_shuffle_epi8(packed, _mm_setr_epi8(2, 1, 0, 6, 5, 4, 10, 9, 8, 14, 13, 12, -1, -1, -1, -1));
+		// Store exactly 12 bytes, the output buffer may end right after them
+		_mm_storel_epi64((__m128i *)output, out);
+		const uint32_t last = (uint32_t)_mm_cvtsi128_si32(_mm_srli_si128(out, 8));
+		memcpy(output + 8, &last, 4);
+		consumed += 16;
+		output += 12;
+	}
+	return consumed + decode_blocks_scalar(output, input + consumed, inputLen - consumed);
+}
+
+__attribute__((target("avx2")))
+static size_t decode_blocks_avx2(unsigned char *output, const char *input, size_t inputLen) {
+	const __m256i shift_lut = _mm256_setr_epi8(0, 0, 19, 4, -65, -65, -71, -71, 0, 0, 0, 0, 0, 0, 0, 0,
+		0, 0, 19, 4, -65, -65, -71, -71, 0, 0, 0, 0, 0, 0, 0, 0);
+	const __m256i mask_lut = _mm256_setr_epi8(
+		(char)0xa8, (char)0xf8, (char)0xf8, (char)0xf8, (char)0xf8, (char)0xf8, (char)0xf8, (char)0xf8,
+		(char)0xf8, (char)0xf8, (char)0xf0, 0x54, 0x50, 0x50, 0x50, 0x54,
+		(char)0xa8, (char)0xf8, (char)0xf8, (char)0xf8, (char)0xf8, (char)0xf8, (char)0xf8, (char)0xf8,
+		(char)0xf8, (char)0xf8, (char)0xf0, 0x54, 0x50, 0x50, 0x50, 0x54);
+	const __m256i bitpos_lut = _mm256_setr_epi8(0x01, 0x02, 0x04, 0x08, 0x10, 0x20, 0x40, (char)0x80,
+		0, 0, 0, 0, 0, 0, 0, 0,
+		0x01, 0x02, 0x04, 0x08, 0x10, 0x20, 0x40, (char)0x80,
+		0, 0, 0, 0, 0, 0, 0, 0);
+	const __m256i pack_shuffle = _mm256_setr_epi8(2, 1, 0, 6, 5, 4, 10, 9, 8, 14, 13, 12, -1, -1, -1, -1,
+		2, 1, 0, 6, 5, 4, 10, 9, 8, 14, 13, 12, -1, -1, -1, -1);
+	size_t consumed = 0;
+	while (inputLen - consumed >= 32) {
+		const __m256i in = _mm256_loadu_si256((const __m256i *)(input + consumed));
+		const __m256i higher_nibble = _mm256_and_si256(_mm256_srli_epi32(in, 4), _mm256_set1_epi8(0x0f));
+		const __m256i lower_nibble = _mm256_and_si256(in, _mm256_set1_epi8(0x0f));
+		const __m256i m = _mm256_shuffle_epi8(mask_lut, lower_nibble);
+		const __m256i bit = _mm256_shuffle_epi8(bitpos_lut, higher_nibble);
+		const __m256i non_match = _mm256_cmpeq_epi8(_mm256_and_si256(m, bit), _mm256_setzero_si256());
+		if (_mm256_movemask_epi8(non_match) != 0) {
+			break;
+		}
+		const __m256i eq_slash = _mm256_cmpeq_epi8(in, _mm256_set1_epi8('/'));
+		const __m256i shift = _mm256_blendv_epi8(_mm256_shuffle_epi8(shift_lut, higher_nibble), _mm256_set1_epi8(16), eq_slash);
+		const __m256i values = _mm256_add_epi8(in, shift);
+
+		const __m256i merged = _mm256_maddubs_epi16(values, _mm256_set1_epi32(0x01400140));
+		const __m256i packed = _mm256_madd_epi16(merged, _mm256_set1_epi32(0x00011000));
+		__m256i out = _mm256_shuffle_epi8(packed, pack_shuffle);
+		// Move the 12 bytes of each lane together
+		out = _mm256_permutevar8x32_epi32(out, _mm256_setr_epi32(0, 1, 2, 4, 5, 6, 3, 7));
+		// Store exactly 24 bytes
+		_mm_storeu_si128((__m128i *)output, _mm256_castsi256_si128(out));
+		_mm_storel_epi64((__m128i *)(output + 16), _mm256_extracti128_si256(out, 1));
+		consumed += 32;
+		output += 24;
+	}
+	_mm256_zeroupper();
+	return consumed + decode_blocks_ssse3(output, input + consumed, inputLen - consumed);
+}
+
+#elif defined(GBE_BASE64_NEON)
+
+/*
+ * NEON (AArch64)
+ */
+
+static size_t encode_blocks_neon(char *output, const unsigned char *input, size_t inputLen) {
+	const uint8x16x4_t alphabet = vld1q_u8_x4((const uint8_t *)encode_alphabet);
+	size_t consumed = 0;
+	while (inputLen - consumed >= 48) {
+		const uint8x16x3_t in = vld3q_u8(input + consumed);
+		uint8x16x4_t indices;
+		indices.val[0] = vshrq_n_u8(in.val[0], 2);
+		indices.val[1] = vandq_u8(vorrq_u8(vshlq_n_u8(in.val[0], 4), vshrq_n_u8(in.val[1], 4)), vdupq_n_u8(0x3f));
+		indices.val[2] = vandq_u8(vorrq_u8(vshlq_n_u8(in.val[1], 2), vshrq_n_u8(in.val[2], 6)), vdupq_n_u8(0x3f));
+		indices.val[3] = vandq_u8(in.val[2], vdupq_n_u8(0x3f));
+		uint8x16x4_t out;
+		for (int i = 0; i < 4; i++) {
+			out.val[i] = vqtbl4q_u8(alphabet, indices.val[i]);
+		}
+		vst4q_u8((uint8_t *)output, out);
+		consumed += 48;
+		output += 64;
+	}
+	return consumed + encode_blocks_scalar(output, input + consumed, inputLen - consumed);
+}
+
+static size_t decode_blocks_neon(unsigned char *output, const char *input, size_t inputLen) {
+	const uint8x16x4_t table_lo = vld1q_u8_x4(decode_table);
+	const uint8x16x4_t table_hi = vld1q_u8_x4(decode_table + 64);
+	size_t consumed = 0;
+	while (inputLen - consumed >= 64) {
+		const uint8x16x4_t in = vld4q_u8((const uint8_t *)input + consumed);
+		uint8x16x4_t values;
+		uint8x16_t invalid = vdupq_n_u8(0);
+		for (int i = 0; i < 4; i++) {
+			// Chars 0..63 from the low table, 64..127 from the high table, 128..255 are invalid
+			uint8x16_t v = vqtbl4q_u8(table_lo, in.val[i]);
+			v = vqtbx4q_u8(v, table_hi, vsubq_u8(in.val[i], vdupq_n_u8(64)));
+			v = vorrq_u8(v, vcgeq_u8(in.val[i], vdupq_n_u8(128)));
+			invalid = vorrq_u8(invalid, v);
+			values.val[i] = v;
+		}
+		if (vmaxvq_u8(invalid) >= 64) {
+			break;
+		}
+		uint8x16x3_t out;
+		out.val[0] = vorrq_u8(vshlq_n_u8(values.val[0], 2), vshrq_n_u8(values.val[1], 4));
+		out.val[1] = vorrq_u8(vshlq_n_u8(values.val[1], 4), vshrq_n_u8(values.val[2], 2));
+		out.val[2] = vorrq_u8(vshlq_n_u8(values.val[2], 6), values.val[3]);
+		vst3q_u8(output, out);
+		consumed += 64;
+		output += 48;
+	}
+	return consumed + decode_blocks_scalar(output, input + consumed, inputLen - consumed);
+}
+
+#endif
+
+/*
+ * Runtime dispatch
+ */
+
+struct Engine {
+	size_t (*encode)(char *, const unsigned char *, size_t);
+	size_t (*decode)(unsigned char *, const char *, size_t);
+	const char *name;
+
+	Engine() : encode(encode_blocks_scalar), decode(decode_blocks_scalar), name("scalar") {
+#if defined(GBE_BASE64_X86)
+		__builtin_cpu_init();
+		if (__builtin_cpu_supports("avx2")) {
+			encode = encode_blocks_avx2;
+			decode = decode_blocks_avx2;
+			name = "avx2";
+		} else if (__builtin_cpu_supports("ssse3")) {
+			encode = encode_blocks_ssse3;
+			decode = decode_blocks_ssse3;
+			name = "ssse3";
+		}
+#elif defined(GBE_BASE64_NEON)
+		encode = encode_blocks_neon;
+		decode = decode_blocks_neon;
+		name = "neon";
+#endif
+		get_encode_pair_table();
+	}
+};
+
+static const Engine &get_engine() {
+	static const Engine engine;
+	return engine;
+}
+
+size_t encode_blocks(char *output, const unsigned char *input, size_t inputLen) {
+	return get_engine().encode(output, input, inputLen);
+}
+
+size_t decode_blocks(unsigned char *output, const char *input, size_t inputLen) {
+	return get_engine().decode(output, input, inputLen);
+}
+
+size_t decode_blocks_lenient(unsigned char *output, const char *input, size_t inputLen) {
+	const Engine &engine = get_engine();
+	const unsigned char *in = (const unsigned char *)input;
+	size_t consumed = 0;
+	while (true) {
+		size_t decoded = engine.decode(output, input + consumed, inputLen - consumed);
+		output += decoded / 4 * 3;
+		consumed += decoded;
+		if (inputLen - consumed < 4 || memchr(in + consumed, '=', 4) != NULL) {
+			break;
+		}
+
+		/* A block with other chars, same arithmetic as a4_to_a3 of Base64.cpp */
+		const unsigned char a = decode_table[in[consumed]];
+		const unsigned char b = decode_table[in[consumed + 1]];
+		const unsigned char c = decode_table[in[consumed + 2]];
+		const unsigned char d = decode_table[in[consumed + 3]];
+		output[0] = (unsigned char)((a << 2) + ((b & 0x30) >> 4));
+		output[1] = (unsigned char)(((b & 0xf) << 4) + ((c & 0x3c) >> 2));
+		output[2] = (unsigned char)(((c & 0x3) << 6) + d);
+		output += 3;
+		consumed += 4;
+	}
+	return consumed;
+}
+
+const char *get_simd_name() {
+	return get_engine().name;
+}
+
+} // namespace gbe_base64
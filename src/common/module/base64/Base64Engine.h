@@ -0,0 +1,58 @@
+/*
+ * Internal fast path of the base64 module, used by Base64.cpp.
+ */
+#ifndef _BASE64_ENGINE_H
+#define _BASE64_ENGINE_H
+
+#include <stddef.h>
+
+namespace gbe_base64 {
+
+/* encode_blocks:
+ * 		Description:
+ * 			Encode the complete 3-byte blocks of the input, without padding
+ * 			and without a terminating '\0'
+ * 		Return value:
+ * 			Returns the number of input bytes consumed, a multiple of 3,
+ * 			the output has (consumed / 3 * 4) chars
+ */
+size_t encode_blocks(char *output, const unsigned char *input, size_t inputLen);
+
+/* decode_blocks:
+ * 		Description:
+ * 			Decode the leading 4-char blocks of the input which only contain
+ * 			base64 alphabet chars, stops before the first block containing
+ * 			'=' or any other char
+ * 		Return value:
+ * 			Returns the number of input chars consumed, a multiple of 4,
+ * 			the output has (consumed / 4 * 3) bytes
+ */
+size_t decode_blocks(unsigned char *output, const char *input, size_t inputLen);
+
+/* decode_blocks_lenient:
+ * 		Description:
+ * 			Decode the 4-char blocks of the input before the first '=',
+ * 			like base64_decode, chars out of the alphabet are decoded as
+ * 			0xFF instead of stopping
+ * 		Return value:
+ * 			Returns the number of input chars consumed, a multiple of 4,
+ * 			the output has (consumed / 4 * 3) bytes
+ */
+size_t decode_blocks_lenient(unsigned char *output, const char *input, size_t inputLen);
+
+/* decode_table:
+ * 		Description:
+ * 			The 6-bit value of each base64 alphabet char, 0xFF for other chars
+ */
+extern const unsigned char decode_table[256];
+
+/* get_simd_name:
+ * 		Description:
+ * 			Name of the SIMD path selected for this CPU, e.g. "avx2", "ssse3",
+ * 			"neon" or "scalar"
+ */
+const char *get_simd_name();
+
+} // namespace gbe_base64
+
+#endif // _BASE64_ENGINE_H
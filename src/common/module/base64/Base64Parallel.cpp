@@ -0,0 +1,175 @@
+#include "Base64.h"
+#include "Base64Engine.h"
+
+#include <string.h>
+
+#include <algorithm>
+#include <atomic>
+#include <condition_variable>
+#include <deque>
+#include <functional>
+#include <memory>
+#include <mutex>
+#include <thread>
+#include <vector>
+
+/* Smallest chunk handed to a worker */
+static const size_t kBase64MinChunk = 256 * 1024;
+
+struct base64_thread_pool {
+	std::vector<std::thread> threads;
+	std::mutex mutex;
+	std::condition_variable cv;
+	std::deque<std::function<void()>> jobs;
+	bool stopping = false;
+
+	void work() {
+		while (true) {
+			std::function<void()> job;
+			{
+				std::unique_lock<std::mutex> lock(mutex);
+				cv.wait(lock, [this]() { return stopping || !jobs.empty(); });
+				if (jobs.empty()) {
+					return;
+				}
+				job = std::move(jobs.front());
+				jobs.pop_front();
+			}
+			job();
+		}
+	}
+
+	/* Run func(0) ... func(count - 1) on the workers and the calling thread, returns when all are done */
+	void run(size_t count, const std::function<void(size_t)> &func) {
+		if (count == 0) {
+			return;
+		}
+		struct Batch {
+			std::atomic<size_t> next{0};
+			size_t done = 0;
+			std::mutex mutex;
+			std::condition_variable cv;
+		};
+		std::shared_ptr<Batch> batch = std::make_shared<Batch>();
+		const size_t total = count;
+		auto drain = [batch, total, &func]() {
+			size_t finished = 0;
+			for (size_t index = batch->next++; index < total; index = batch->next++) {
+				func(index);
+				finished++;
+			}
+			if (finished) {
+				std::lock_guard<std::mutex> lock(batch->mutex);
+				batch->done += finished;
+				if (batch->done == total) {
+					batch->cv.notify_all();
+				}
+			}
+		};
+
+		// The calling thread takes a share as well
+		size_t helpers = std::min(threads.size(), count - 1);
+		if (helpers) {
+			std::lock_guard<std::mutex> lock(mutex);
+			for (size_t i = 0; i < helpers; i++) {
+				// `func` is only called while the batch is unfinished, which keeps the reference valid
+				jobs.push_back(drain);
+			}
+		}
+		cv.notify_all();
+		drain();
+
+		std::unique_lock<std::mutex> lock(batch->mutex);
+		batch->cv.wait(lock, [&batch, total]() { return batch->done == total; });
+	}
+};
+
+base64_thread_pool *base64_thread_pool_create(size_t numThreads) {
+	if (numThreads == 0) {
+		unsigned int cpus = std::thread::hardware_concurrency();
+		numThreads = cpus > 1 ? cpus - 1 : 0;
+	}
+	base64_thread_pool *pool = new base64_thread_pool();
+	for (size_t i = 0; i < numThreads; i++) {
+		pool->threads.emplace_back(&base64_thread_pool::work, pool);
+	}
+	return pool;
+}
+
+void base64_thread_pool_destroy(base64_thread_pool *pool) {
+	if (pool == NULL) {
+		return;
+	}
+	{
+		std::lock_guard<std::mutex> lock(pool->mutex);
+		pool->stopping = true;
+	}
+	pool->cv.notify_all();
+	for (std::thread &thread : pool->threads) {
+		thread.join();
+	}
+	delete pool;
+}
+
+static base64_thread_pool *get_shared_pool() {
+	static std::unique_ptr<base64_thread_pool, void (*)(base64_thread_pool *)> pool(
+		base64_thread_pool_create(0), base64_thread_pool_destroy);
+	return pool.get();
+}
+
+/* Number of chunks of `length` units, at least kBase64MinChunk bytes each */
+static size_t get_chunk_count(base64_thread_pool *pool, size_t length, size_t unit) {
+	size_t maxChunks = (pool->threads.size() + 1) * 4;
+	size_t chunks = length / (kBase64MinChunk / unit * unit);
+	return std::max<size_t>(1, std::min(chunks, maxChunks));
+}
+
+size_t base64_encode_parallel(char *output, const char *input, size_t inputLen, base64_thread_pool *pool) {
+	if (inputLen < BASE64_PARALLEL_THRESHOLD) {
+		return base64_encode(output, (char *)input, (int)inputLen);
+	}
+	if (pool == NULL) {
+		pool = get_shared_pool();
+	}
+
+	/* Chunks of complete 3-byte blocks, written at their final offsets */
+	size_t blocks = inputLen / 3;
+	size_t chunks = get_chunk_count(pool, inputLen, 3);
+	size_t blocksPerChunk = blocks / chunks;
+	pool->run(chunks, [&](size_t index) {
+		size_t first = index * blocksPerChunk;
+		size_t last = index == chunks - 1 ? blocks : first + blocksPerChunk;
+		gbe_base64::encode_blocks(output + first * 4, (const unsigned char *)input + first * 3, (last - first) * 3);
+	});
+
+	/* The padded tail and the terminating '\0' */
+	return blocks * 4 + base64_encode(output + blocks * 4, (char *)input + blocks * 3, (int)(inputLen - blocks * 3));
+}
+
+size_t base64_decode_parallel(char *output, const char *input, size_t inputLen, base64_thread_pool *pool) {
+	if (inputLen < BASE64_PARALLEL_THRESHOLD) {
+		return base64_decode(output, (char *)input, (int)inputLen);
+	}
+	if (pool == NULL) {
+		pool = get_shared_pool();
+	}
+
+	/* Decoding stops at the first '=' */
+	const char *eq = (const char *)memchr(input, '=', inputLen);
+	if (eq != NULL) {
+		inputLen = eq - input;
+	}
+
+	/* Chunks of complete 4-char blocks, written at their final offsets */
+	size_t blocks = inputLen / 4;
+	size_t chunks = get_chunk_count(pool, inputLen, 4);
+	size_t blocksPerChunk = blocks / chunks;
+	pool->run(chunks, [&](size_t index) {
+		size_t first = index * blocksPerChunk;
+		size_t last = index == chunks - 1 ? blocks : first + blocksPerChunk;
+		gbe_base64::decode_blocks_lenient((unsigned char *)output + first * 3, input + first * 4, (last - first) * 4);
+	});
+
+	/* The unpadded tail and the terminating '\0' */
+	return blocks * 3 + base64_decode(output + blocks * 3, (char *)input + blocks * 4, (int)(inputLen - blocks * 4));
+}
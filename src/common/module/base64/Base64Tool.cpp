@@ -0,0 +1,336 @@
+#include "Base64.h"
+
+#include <errno.h>
+#include <fcntl.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+
+#include <string>
+#include <vector>
+
+/*
+ * gbe_base64: encode / decode files with the base64 module of the library.
+ *
+ * Usage: gbe_base64 [-d] [-j THREADS] [INPUT [OUTPUT]]
+ *
+ * INPUT and OUTPUT default to "-", stdin and stdout. A regular input file is
+ * mapped into memory, and a regular output file is preallocated and mapped,
+ * so converting a file to a file does not copy through any buffer. Pipes are
+ * streamed in chunks through the incremental API.
+ *
+ * Encoding is multi-threaded. Decoding validates the input and ignores
+ * trailing line breaks.
+ */
+
+namespace {
+
+// Chunk size of the streamed input, a multiple of 3 and 4
+const size_t kStreamChunk = 3 * 4 * 256 * 1024;
+
+struct ToolOptions {
+	bool decode = false;
+	size_t threads = 0;
+	std::string input = "-";
+	std::string output = "-";
+};
+
+struct InputFile {
+	int fd = -1;
+	const char *data = nullptr;
+	size_t length = 0;
+	bool mapped = false;
+};
+
+bool is_stdio(const std::string &path) {
+	return path == "-";
+}
+
+void print_errno(const char *what, const std::string &path) {
+	fprintf(stderr, "gbe_base64: %s %s: %s\n", what, path.c_str(), strerror(errno));
+}
+
+bool write_all(int fd, const char *data, size_t length) {
+	while (length) {
+		ssize_t written = write(fd, data, length);
+		if (written < 0) {
+			if (errno == EINTR) {
+				continue;
+			}
+			return false;
+		}
+		data += written;
+		length -= written;
+	}
+	return true;
+}
+
+/* Map a regular input file, other inputs (pipes, stdin) are left unmapped to be streamed */
+bool open_input(const std::string &path, InputFile &input) {
+	if (is_stdio(path)) {
+		input.fd = STDIN_FILENO;
+	} else {
+		input.fd = open(path.c_str(), O_RDONLY);
+		if (input.fd < 0) {
+			print_errno("Failed to open", path);
+			return false;
+		}
+	}
+
+	struct stat st;
+	if (fstat(input.fd, &st) != 0 || !S_ISREG(st.st_mode)) {
+		return true;
+	}
+	input.length = (size_t)st.st_size;
+	input.mapped = true;
+	if (input.length == 0) {
+		return true;
+	}
+	void *data = mmap(nullptr, input.length, PROT_READ, MAP_PRIVATE, input.fd, 0);
+	if (data == MAP_FAILED) {
+		print_errno("Failed to map", path);
+		return false;
+	}
+	madvise(data, input.length, MADV_SEQUENTIAL);
+	input.data = (const char *)data;
+	return true;
+}
+
+size_t trim_line_breaks(const char *data, size_t length) {
+	while (length && (data[length - 1] == '\n' || data[length - 1] == '\r')) {
+		length--;
+	}
+	return length;
+}
+
+/* Decode all of `input` with a fresh context, returns the decoded length or -1 */
+long long decode_whole(char *output, const char *input, size_t inputLen) {
+	base64_decode_state state;
+	base64_decode_init(&state);
+	size_t decoded = 0;
+	size_t finalLen = 0;
+	if (base64_decode_update(&state, output, &decoded, input, inputLen) != 0
+		|| base64_decode_final(&state, output + decoded, &finalLen) != 0) {
+		return -1;
+	}
+	return (long long)(decoded + finalLen);
+}
+
+/* Mapped input to a preallocated, mapped output file */
+int convert_mapped(const ToolOptions &options, const InputFile &input) {
+	size_t inputLen = options.decode ? trim_line_breaks(input.data, input.length) : input.length;
+	// One more byte for the '\0' written by base64_encode_parallel, two for the final block of the decoder
+	size_t capacity = options.decode ? inputLen / 4 * 3 + 3 + 2 : (inputLen + 2) / 3 * 4 + 1;
+
+	int fd = open(options.output.c_str(), O_RDWR | O_CREAT | O_TRUNC, 0644);
+	if (fd < 0) {
+		print_errno("Failed to open", options.output);
+		return 1;
+	}
+	if (ftruncate(fd, (off_t)capacity) != 0) {
+		print_errno("Failed to allocate", options.output);
+		close(fd);
+		return 1;
+	}
+	void *mapping = mmap(nullptr, capacity, PROT_READ | PROT_WRITE, MAP_SHARED, fd, 0);
+	if (mapping == MAP_FAILED) {
+		print_errno("Failed to map", options.output);
+		close(fd);
+		return 1;
+	}
+
+	char *output = (char *)mapping;
+	long long outputLen = 0;
+	if (options.decode) {
+		outputLen = decode_whole(output, input.data, inputLen);
+	} else {
+		base64_thread_pool *pool = base64_thread_pool_create(options.threads);
+		outputLen = (long long)base64_encode_parallel(output, input.data, inputLen, pool);
+		base64_thread_pool_destroy(pool);
+	}
+
+	munmap(mapping, capacity);
+	int result = 0;
+	if (outputLen < 0) {
+		fprintf(stderr, "gbe_base64: Invalid base64 input: %s\n", options.input.c_str());
+		outputLen = 0;
+		result = 1;
+	}
+	if (ftruncate(fd, (off_t)outputLen) != 0) {
+		print_errno("Failed to truncate", options.output);
+		result = 1;
+	}
+	close(fd);
+	return result;
+}
+
+/* Anything involving a pipe, converted chunk by chunk through the incremental API */
+int convert_streamed(const ToolOptions &options, const InputFile &input) {
+	int outFd = STDOUT_FILENO;
+	if (!is_stdio(options.output)) {
+		outFd = open(options.output.c_str(), O_WRONLY | O_CREAT | O_TRUNC, 0644);
+		if (outFd < 0) {
+			print_errno("Failed to open", options.output);
+			return 1;
+		}
+	}
+
+	std::vector<char> buffer(input.mapped ? 0 : kStreamChunk);
+	std::vector<char> output(kStreamChunk / 3 * 4 + 8);
+	base64_encode_state encodeState;
+	base64_decode_state decodeState;
+	base64_encode_init(&encodeState);
+	base64_decode_init(&decodeState);
+
+	size_t offset = 0;
+	bool trailingBreaks = false;
+	int result = 0;
+	while (true) {
+		const char *chunk = nullptr;
+		size_t chunkLen = 0;
+		if (input.mapped) {
+			chunk = input.data + offset;
+			chunkLen = input.length - offset < kStreamChunk ? input.length - offset : kStreamChunk;
+			offset += chunkLen;
+		} else {
+			ssize_t readLen = read(input.fd, buffer.data(), buffer.size());
+			if (readLen < 0) {
+				if (errno == EINTR) {
+					continue;
+				}
+				print_errno("Failed to read", options.input);
+				result = 1;
+				break;
+			}
+			chunk = buffer.data();
+			chunkLen = (size_t)readLen;
+		}
+		if (chunkLen == 0) {
+			break;
+		}
+
+		size_t outputLen = 0;
+		if (options.decode) {
+			// Line breaks may only trail, data after dropped ones is invalid
+			size_t dataLen = trim_line_breaks(chunk, chunkLen);
+			bool invalid = trailingBreaks && dataLen;
+			trailingBreaks = trailingBreaks || dataLen < chunkLen;
+			if (invalid || base64_decode_update(&decodeState, output.data(), &outputLen, chunk, dataLen) != 0) {
+				fprintf(stderr, "gbe_base64: Invalid base64 input: %s\n", options.input.c_str());
+				result = 1;
+				break;
+			}
+		} else {
+			outputLen = base64_encode_update(&encodeState, output.data(), chunk, chunkLen);
+		}
+		if (!write_all(outFd, output.data(), outputLen)) {
+			print_errno("Failed to write", options.output);
+			result = 1;
+			break;
+		}
+	}
+
+	if (result == 0) {
+		size_t outputLen = 0;
+		if (options.decode) {
+			if (base64_decode_final(&decodeState, output.data(), &outputLen) != 0) {
+				fprintf(stderr, "gbe_base64: Invalid base64 input: %s\n", options.input.c_str());
+				result = 1;
+			}
+		} else {
+			outputLen = base64_encode_final(&encodeState, output.data());
+		}
+		if (result == 0 && !write_all(outFd, output.data(), outputLen)) {
+			print_errno("Failed to write", options.output);
+			result = 1;
+		}
+	}
+
+	if (outFd != STDOUT_FILENO) {
+		close(outFd);
+	}
+	return result;
+}
+
+bool parse_options(int argc, char *argv[], ToolOptions &options) {
+	std::vector<std::string> paths;
+	for (int i = 1; i < argc; i++) {
+		std::string arg = argv[i];
+		if (arg == "-d" || arg == "--decode") {
+			options.decode = true;
+		} else if (arg == "-j" || arg == "--threads") {
+			if (i + 1 >= argc) {
+				fprintf(stderr, "gbe_base64: Missing value of %s\n", arg.c_str());
+				return false;
+			}
+			options.threads = (size_t)atoll(argv[++i]);
+		} else if (arg.size() > 1 && arg[0] == '-') {
+			fprintf(stderr, "gbe_base64: Unknown option: %s\n", arg.c_str());
+			return false;
+		} else {
+			paths.push_back(arg);
+		}
+	}
+	if (paths.size() > 2) {
+		return false;
+	}
+	if (paths.size() > 0) {
+		options.input = paths[0];
+	}
+	if (paths.size() > 1) {
+		options.output = paths[1];
+	}
+	return true;
+}
+
+bool is_regular_output(const std::string &path) {
+	if (is_stdio(path)) {
+		return false;
+	}
+	struct stat st;
+	// A new file, or an existing regular file which can be resized and mapped
+	return stat(path.c_str(), &st) != 0 || S_ISREG(st.st_mode);
+}
+
+bool is_same_file(const InputFile &input, const std::string &path) {
+	struct stat inputStat;
+	struct stat outputStat;
+	return !is_stdio(path) && fstat(input.fd, &inputStat) == 0 && stat(path.c_str(), &outputStat) == 0
+		&& inputStat.st_dev == outputStat.st_dev && inputStat.st_ino == outputStat.st_ino;
+}
+
+} // namespace
+
+int main(int argc, char *argv[]) {
+	ToolOptions options;
+	if (!parse_options(argc, argv, options)) {
+		fprintf(stderr, "Usage: %s [-d] [-j THREADS] [INPUT [OUTPUT]]\n", argv[0]);
+		return 2;
+	}
+
+	InputFile input;
+	if (!open_input(options.input, input)) {
+		return 1;
+	}
+
+	int result = 0;
+	if (is_same_file(input, options.output)) {
+		fprintf(stderr, "gbe_base64: The output would overwrite the input: %s\n", options.output.c_str());
+		result = 1;
+	} else if (input.mapped && is_regular_output(options.output)) {
+		result = convert_mapped(options, input);
+	} else {
+		result = convert_streamed(options, input);
+	}
+
+	if (input.data != nullptr) {
+		munmap((void *)input.data, input.length);
+	}
+	if (input.fd != STDIN_FILENO) {
+		close(input.fd);
+	}
+	return result;
+}
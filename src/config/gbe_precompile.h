@@ -0,0 +1,19 @@
+// Precompiled header of the library sources, see //src/config:gbe_precompiled_headers
+// Only stable system headers, a change here recompiles everything.
+
+#if defined(__OBJC__)
+#import <Foundation/Foundation.h>
+#endif
+
+#if defined(__cplusplus)
+#include <algorithm>
+#include <atomic>
+#include <condition_variable>
+#include <cstring>
+#include <functional>
+#include <memory>
+#include <mutex>
+#include <string>
+#include <thread>
+#include <vector>
+#endif
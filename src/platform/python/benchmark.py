@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# Copyright © 2021 Patrick Fu.
+
+import os
+import sys
+import json
+import time
+import base64
+import binascii
+import argparse
+from typing import Any, Callable, Dict, List
+
+"""
+Compare the `gbe_base64` extension with the stdlib `base64`/`binascii`
+
+    python3 src/platform/python/setup.py build
+    python3 src/platform/python/benchmark.py --module-dir _out/python/lib.*
+"""
+
+SIZES = [64, 1024, 64 * 1024, 1024 * 1024, 16 * 1024 * 1024, 64 * 1024 * 1024]
+
+
+def __parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark the gbe_base64 extension against the stdlib.')
+    parser.add_argument('--module-dir', type=str, default=None, metavar='DIR', help='Dir of the built extension, defaults to the installed one.')
+    parser.add_argument('--max-size', type=int, default=SIZES[-1], metavar='BYTES', help='Largest input size.')
+    parser.add_argument('--min-time', type=float, default=0.2, metavar='SECONDS', help='Min run time of each case.')
+    parser.add_argument('--json', type=str, default=None, metavar='PATH', help='Write the results into a JSON file.')
+    return parser.parse_args()
+
+
+def run_case(func: Callable[[], Any], min_time: float) -> Dict[str, float]:
+    """Run `func` in doubling batches until `min_time` elapsed"""
+    iterations = 0
+    batch = 1
+    start = time.perf_counter()
+    while True:
+        for _ in range(batch):
+            func()
+        iterations += batch
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        batch *= 2
+    return {'iterations': iterations, 'seconds': elapsed}
+
+
+def get_cases(gbe_base64, data: bytes) -> Dict[str, Callable[[], Any]]:
+    encoded = base64.b64encode(data)
+    encode_out = bytearray(gbe_base64.encoded_length(len(data)))
+    decode_out = bytearray(gbe_base64.decoded_length(encoded))
+    return {
+        'gbe_base64.encode': lambda: gbe_base64.encode(data),
+        'gbe_base64.encode(out=)': lambda: gbe_base64.encode(data, out=encode_out),
+        'base64.b64encode': lambda: base64.b64encode(data),
+        'binascii.b2a_base64': lambda: binascii.b2a_base64(data, newline=False),
+        'gbe_base64.decode': lambda: gbe_base64.decode(encoded),
+        'gbe_base64.decode(out=)': lambda: gbe_base64.decode(encoded, out=decode_out),
+        'base64.b64decode': lambda: base64.b64decode(encoded),
+        'binascii.a2b_base64': lambda: binascii.a2b_base64(encoded),
+    }
+
+
+def main():
+    args = __parse_args()
+    if args.module_dir:
+        sys.path.insert(0, os.path.abspath(args.module_dir))
+    import gbe_base64
+
+    results: List[Dict[str, Any]] = []
+    for size in [size for size in SIZES if size <= args.max_size]:
+        data = os.urandom(size)
+        for name, func in get_cases(gbe_base64, data).items():
+            result = run_case(func, args.min_time)
+            result.update({
+                'name': name,
+                'size': size,
+                'mb_per_s': size * result['iterations'] / result['seconds'] / 1024 / 1024,
+            })
+            results.append(result)
+            print('[*] {0:<26} {1:>10} B {2:>10.1f} MB/s'.format(name, size, result['mb_per_s']))
+
+    if args.json:
+        with open(args.json, 'w') as fw:
+            json.dump({'python': sys.version, 'results': results}, fw, indent=2)
+        print('[*] Benchmark results: {}'.format(args.json))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+//
+//  gbe_base64_module.cpp
+//  gbe_base64
+//
+//  CPython binding of the base64 module (//src/common/module/base64).
+//
+
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+
+#include <string.h>
+
+#include "src/common/module/base64/Base64.h"
+
+/* Inputs from this size are converted with the GIL released */
+#define GBE_BASE64_RELEASE_GIL_THRESHOLD (64 * 1024)
+
+namespace {
+
+/* Length of the output of base64_encode, without the terminating '\0' */
+size_t get_encoded_length(size_t inputLen) {
+	return (inputLen + 2) / 3 * 4;
+}
+
+/* Length of the output of base64_decode, without the terminating '\0', which stops at the first '=' */
+size_t get_decoded_length(const char *input, size_t inputLen) {
+	const char *eq = (const char *)memchr(input, '=', inputLen);
+	size_t length = eq != NULL ? (size_t)(eq - input) : inputLen;
+	return length / 4 * 3 + (length % 4 ? length % 4 - 1 : 0);
+}
+
+/* Readable bytes of a buffer-protocol object, or of an ASCII str for decoding */
+struct InputBuffer {
+	Py_buffer view;
+	bool hasView = false;
+	const char *data = NULL;
+	size_t length = 0;
+
+	~InputBuffer() {
+		if (hasView) {
+			PyBuffer_Release(&view);
+		}
+	}
+
+	bool get(PyObject *object, bool allowStr) {
+		if (allowStr && PyUnicode_Check(object)) {
+			if (!PyUnicode_IS_ASCII(object)) {
+				PyErr_SetString(PyExc_ValueError, "string argument should contain only ASCII characters");
+				return false;
+			}
+			Py_ssize_t size = 0;
+			data = PyUnicode_AsUTF8AndSize(object, &size);
+			length = (size_t)size;
+			return data != NULL;
+		}
+		if (PyObject_GetBuffer(object, &view, PyBUF_SIMPLE) != 0) {
+			return false;
+		}
+		hasView = true;
+		data = (const char *)view.buf;
+		length = (size_t)view.len;
+		return true;
+	}
+};
+
+/* Writable bytes of a caller-provided output buffer */
+struct OutputBuffer {
+	Py_buffer view;
+	bool hasView = false;
+
+	~OutputBuffer() {
+		if (hasView) {
+			PyBuffer_Release(&view);
+		}
+	}
+
+	bool get(PyObject *object, size_t required) {
+		if (PyObject_GetBuffer(object, &view, PyBUF_WRITABLE) != 0) {
+			return false;
+		}
+		hasView = true;
+		if ((size_t)view.len < required) {
+			PyErr_Format(PyExc_ValueError, "output buffer too small: %zd bytes, %zu required", view.len, required);
+			return false;
+		}
+		return true;
+	}
+};
+
+/*
+ * base64_encode/base64_decode write a terminating '\0' after the output. New
+ * bytes objects have room for it, caller buffers get the last block through a
+ * small temp buffer instead, so they only need the exact output length.
+ */
+
+size_t encode_into(char *output, const char *input, size_t inputLen, bool exact) {
+	if (!exact || inputLen == 0) {
+		return base64_encode_parallel(output, input, inputLen, NULL);
+	}
+	size_t head = (inputLen - 1) / 3 * 3;
+	size_t encLen = base64_encode_parallel(output, input, head, NULL);
+	char tail[5];
+	size_t tailLen = (size_t)base64_encode(tail, (char *)input + head, (int)(inputLen - head));
+	memcpy(output + encLen, tail, tailLen);
+	return encLen + tailLen;
+}
+
+size_t decode_into(char *output, const char *input, size_t inputLen, bool exact) {
+	if (!exact) {
+		return base64_decode_parallel(output, input, inputLen, NULL);
+	}
+	const char *eq = (const char *)memchr(input, '=', inputLen);
+	size_t length = eq != NULL ? (size_t)(eq - input) : inputLen;
+	if (length < 2) {
+		return 0;
+	}
+	// Leave 2 to 5 chars, which decode to at least one byte
+	size_t head = (length - 2) / 4 * 4;
+	size_t decLen = base64_decode_parallel(output, input, head, NULL);
+	char tail[8];
+	size_t tailLen = (size_t)base64_decode(tail, (char *)input + head, (int)(length - head));
+	memcpy(output + decLen, tail, tailLen);
+	return decLen + tailLen;
+}
+
+typedef size_t (*convert_func)(char *, const char *, size_t, bool);
+
+/* Convert `input` into a new bytes object, or into `out` returning the written length */
+PyObject *convert(PyObject *inputObject, PyObject *outObject, bool decode) {
+	InputBuffer input;
+	if (!input.get(inputObject, decode)) {
+		return NULL;
+	}
+	size_t outputLen = decode ? get_decoded_length(input.data, input.length) : get_encoded_length(input.length);
+	convert_func func = decode ? decode_into : encode_into;
+	bool releaseGil = input.length >= GBE_BASE64_RELEASE_GIL_THRESHOLD;
+
+	if (outObject != NULL && outObject != Py_None) {
+		OutputBuffer output;
+		if (!output.get(outObject, outputLen)) {
+			return NULL;
+		}
+		size_t written = 0;
+		if (releaseGil) {
+			Py_BEGIN_ALLOW_THREADS
+			written = func((char *)output.view.buf, input.data, input.length, true);
+			Py_END_ALLOW_THREADS
+		} else {
+			written = func((char *)output.view.buf, input.data, input.length, true);
+		}
+		return PyLong_FromSize_t(written);
+	}
+
+	if (outputLen > (size_t)PY_SSIZE_T_MAX) {
+		return PyErr_NoMemory();
+	}
+	// Written in place, the bytes object has one more byte for the terminating '\0'
+	PyObject *result = PyBytes_FromStringAndSize(NULL, (Py_ssize_t)outputLen);
+	if (result == NULL) {
+		return NULL;
+	}
+	char *data = PyBytes_AS_STRING(result);
+	if (releaseGil) {
+		Py_BEGIN_ALLOW_THREADS
+		func(data, input.data, input.length, false);
+		Py_END_ALLOW_THREADS
+	} else {
+		func(data, input.data, input.length, false);
+	}
+	return result;
+}
+
+PyObject *gbe_base64_encode(PyObject *, PyObject *args, PyObject *kwargs) {
+	static const char *keywords[] = {"data", "out", NULL};
+	PyObject *data = NULL;
+	PyObject *out = NULL;
+	if (!PyArg_ParseTupleAndKeywords(args, kwargs, "O|$O:encode", (char **)keywords, &data, &out)) {
+		return NULL;
+	}
+	return convert(data, out, false);
+}
+
+PyObject *gbe_base64_decode(PyObject *, PyObject *args, PyObject *kwargs) {
+	static const char *keywords[] = {"data", "out", NULL};
+	PyObject *data = NULL;
+	PyObject *out = NULL;
+	if (!PyArg_ParseTupleAndKeywords(args, kwargs, "O|$O:decode", (char **)keywords, &data, &out)) {
+		return NULL;
+	}
+	return convert(data, out, true);
+}
+
+PyObject *gbe_base64_encoded_length(PyObject *, PyObject *arg) {
+	Py_ssize_t length = PyNumber_AsSsize_t(arg, PyExc_OverflowError);
+	if (length == -1 && PyErr_Occurred()) {
+		return NULL;
+	}
+	if (length < 0) {
+		PyErr_SetString(PyExc_ValueError, "length must be non-negative");
+		return NULL;
+	}
+	return PyLong_FromSize_t(get_encoded_length((size_t)length));
+}
+
+PyObject *gbe_base64_decoded_length(PyObject *, PyObject *arg) {
+	InputBuffer input;
+	if (!input.get(arg, true)) {
+		return NULL;
+	}
+	return PyLong_FromSize_t(get_decoded_length(input.data, input.length));
+}
+
+PyMethodDef gbe_base64_methods[] = {
+	{"encode", (PyCFunction)(void (*)(void))gbe_base64_encode, METH_VARARGS | METH_KEYWORDS,
+		"encode(data, *, out=None)\n--\n\n"
+		"Base64 encode a bytes-like object with `base64_encode`.\n\n"
+		"Returns a new bytes object, or writes into the writable buffer `out`\n"
+		"(at least `encoded_length(len(data))` bytes) and returns the written length."},
+	{"decode", (PyCFunction)(void (*)(void))gbe_base64_decode, METH_VARARGS | METH_KEYWORDS,
+		"decode(data, *, out=None)\n--\n\n"
+		"Base64 decode a bytes-like object or ASCII str with `base64_decode`.\n\n"
+		"Like the native function, decoding stops at the first '=' and does not\n"
+		"validate the input. Returns a new bytes object, or writes into the\n"
+		"writable buffer `out` (at least `decoded_length(data)` bytes) and returns\n"
+		"the written length."},
+	{"encoded_length", gbe_base64_encoded_length, METH_O,
+		"encoded_length(length, /)\n--\n\n"
+		"Length of the encoded form of `length` bytes."},
+	{"decoded_length", gbe_base64_decoded_length, METH_O,
+		"decoded_length(data, /)\n--\n\n"
+		"Length of the decoded form of `data`."},
+	{NULL, NULL, 0, NULL},
+};
+
+struct PyModuleDef gbe_base64_module = {
+	PyModuleDef_HEAD_INIT,
+	"gbe_base64",
+	"Base64 of the GNBuildExample library, for any buffer-protocol object.",
+	-1,
+	gbe_base64_methods,
+};
+
+} // namespace
+
+PyMODINIT_FUNC PyInit_gbe_base64(void) {
+	return PyModule_Create(&gbe_base64_module);
+}
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# Copyright © 2021 Patrick Fu.
+
+import os
+import sys
+from setuptools import setup, Extension
+
+"""
+Build the `gbe_base64` CPython extension from the sources of //src/common/module/base64
+
+    # Into ./_out/python/lib.*/
+    python3 src/platform/python/setup.py build
+
+    # Or install into the current environment
+    python3 -m pip install src/platform/python
+"""
+
+PROJ_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+# Sources are relative to the project root, so the objects stay in the build dir
+os.chdir(PROJ_ROOT)
+
+BASE64_DIR = os.path.join('src', 'common', 'module', 'base64')
+
+# The same sources as the `base64` source_set
+SOURCES = [
+    os.path.join('src', 'platform', 'python', 'gbe_base64_module.cpp'),
+    os.path.join(BASE64_DIR, 'Base64.cpp'),
+    os.path.join(BASE64_DIR, 'Base64Engine.cpp'),
+    os.path.join(BASE64_DIR, 'Base64Parallel.cpp'),
+]
+
+if sys.platform.startswith('win'):
+    extra_compile_args = ['/O2', '/std:c++14']
+    extra_link_args = []
+else:
+    extra_compile_args = ['-O2', '-std=c++11', '-pthread', '-fvisibility=hidden']
+    extra_link_args = ['-pthread']
+
+setup(
+    name='gbe_base64',
+    version='1.0.0',
+    description='Base64 of the GNBuildExample library, for any buffer-protocol object',
+    ext_modules=[
+        Extension(
+            'gbe_base64',
+            sources=SOURCES,
+            include_dirs=['.'],
+            language='c++',
+            extra_compile_args=extra_compile_args,
+            extra_link_args=extra_link_args,
+        )
+    ],
+    # `./build` is the GN build config
+    options={'build': {'build_base': os.path.join('_out', 'python')}},
+)